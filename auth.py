@@ -1,9 +1,16 @@
 import os
 import json
+import time
+import asyncio
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 from urllib.request import urlopen
 from urllib.error import URLError
-from jose import jwt, JWTError
+from jose import jwk, jwt, JWTError
+from jose.backends.base import Key
 from dotenv import load_dotenv
 
 # Load environment variables from .env
@@ -24,51 +31,203 @@ if not api_audience:
 ALGORITHMS = ["RS256"]
 jwks_url = f"https://{auth0_domain}/.well-known/jwks.json"
 
-# Cache for JWKS to avoid repeated network calls
-_jwks_cache = None
+# Hur länge JWKS anses färsk, och minsta tid mellan omhämtningar vid okänt kid
+# (skyddar mot att tokens med påhittade kid får oss att spamma Auth0)
+JWKS_TTL_SECONDS = float(os.getenv("JWKS_TTL_SECONDS", "3600"))
+JWKS_MIN_REFETCH_SECONDS = float(os.getenv("JWKS_MIN_REFETCH_SECONDS", "30"))
+# Antal verifierade tokens vars claims hålls i minnet tills de går ut
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
 
-def _get_jwks() -> dict:
+
+class JWKSCache:
     """
-    Hämtar och cache:ar JSON Web Key Set från Auth0.
+    JWKS indexerat på kid med färdigkonstruerade nyckelobjekt.
+
+    Nycklarna förnyas i bakgrunden innan TTL löper ut; ett okänt kid (t.ex.
+    efter nyckelrotation i Auth0) schemalägger en strypt omhämtning i en
+    tråd, högst en per min_refetch sekunder. Uppslag blockerar aldrig
+    event-loopen: de besvaras från de senast kända nycklarna, och en token
+    med okänt kid avvisas tills omhämtningen är klar.
     """
-    global _jwks_cache
-    if _jwks_cache is None:
+
+    def __init__(self, url: str, ttl: float, min_refetch: float):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch = min_refetch
+        self._keys: Dict[str, Key] = {}
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Optional[asyncio.Task] = None
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._fetched_at > self.ttl
+
+    def refresh(self) -> None:
+        """Hämtar JWKS och bygger om kid-indexet (blockerande)."""
+        with self._lock:
+            self._attempted_at = time.monotonic()
+            try:
+                logger.info(f"Hämtar JWKS från {jwks_url}")
+                with urlopen(self.url, timeout=5) as response:
+                    jwks = json.loads(response.read())
+            except URLError as e:
+                logger.error(f"Kan inte hämta JWKS: {e}")
+                if not self._keys:
+                    raise RuntimeError(
+                        "Kontakt med Auth0 misslyckades, kontrollera nätverk eller AUTH0_DOMAIN"
+                    ) from e
+                return
+
+            keys = {}
+            for key in jwks.get("keys", []):
+                if key.get("kid") and key.get("kty") == "RSA":
+                    try:
+                        keys[key["kid"]] = jwk.construct(key, algorithm=ALGORITHMS[0])
+                    except Exception as e:
+                        logger.error(f"Ogiltig nyckel {key.get('kid')} i JWKS: {e}")
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _may_refetch(self) -> bool:
+        return time.monotonic() - self._attempted_at > self.min_refetch
+
+    async def _refresh_in_background(self) -> None:
+        try:
+            await asyncio.to_thread(self.refresh)
+        except Exception as e:
+            logger.error(f"Omhämtning av JWKS misslyckades: {e}")
+        finally:
+            self._pending = None
+
+    def _schedule_refresh(self) -> None:
+        """Startar en omhämtning utan att vänta på den; strypt med min_refetch."""
+        if self._pending is not None or not self._may_refetch():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Anropad utanför event-loopen (t.ex. från en tråd): blockera här
+            try:
+                self.refresh()
+            except RuntimeError as e:
+                logger.error(f"Omhämtning av JWKS misslyckades: {e}")
+            return
+        # Räknas som ett försök redan nu så att samtidiga uppslag inte köar fler
+        self._attempted_at = time.monotonic()
+        self._pending = loop.create_task(self._refresh_in_background())
+
+    def get_key(self, kid: Optional[str]) -> Optional[Key]:
+        key = self._keys.get(kid)
+        if key is None or self.is_stale:
+            # Okänt kid: nyckeln kan ha roterats sedan senaste hämtningen
+            self._schedule_refresh()
+        return key
+
+    def snapshot(self) -> dict:
+        return {
+            "keys": sorted(self._keys),
+            "age_seconds": round(time.monotonic() - self._fetched_at, 1) if self._keys else None,
+        }
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            # Förnya i god tid innan TTL så att requests aldrig väntar på Auth0
+            await asyncio.sleep(max(self.ttl * 0.8, 1.0))
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Bakgrundsförnyelse av JWKS misslyckades: {e}")
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
         try:
-            logger.info(f"Hämtar JWKS från {jwks_url}")
-            with urlopen(jwks_url, timeout=5) as response:
-                _jwks_cache = json.loads(response.read())
-        except URLError as e:
-            logger.error(f"Kan inte hämta JWKS: {e}")
-            raise RuntimeError(
-                "Kontakt med Auth0 misslyckades, kontrollera nätverk eller AUTH0_DOMAIN"
-            ) from e
-    return _jwks_cache
+            await asyncio.to_thread(self.refresh)
+        except RuntimeError as e:
+            # Första requesten försöker igen; startup ska inte falla på Auth0
+            logger.error(f"Förhämtning av JWKS misslyckades: {e}")
+        self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+
+class VerifiedTokenCache:
+    """
+    Begränsad LRU med claims för redan verifierade tokens, nycklad på
+    tokenens sha256. Poster gäller till tokenens exp.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def token_key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, key: str, claims: dict) -> None:
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)) or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (dict(claims), float(expires_at))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+jwks_cache = JWKSCache(jwks_url, JWKS_TTL_SECONDS, JWKS_MIN_REFETCH_SECONDS)
+token_cache = VerifiedTokenCache(TOKEN_CACHE_SIZE)
+
 
 def decode_auth0_token(token: str) -> dict:
     """
     Validerar en Auth0 JWT och returnerar dess claims.
 
     Förväntar en RS256-signerad access token med rätt audience och issuer.
+    Redan verifierade tokens besvaras från cachen utan ny RSA-verifiering.
     """
+    cache_key = token_cache.token_key(token)
+    cached = token_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
         unverified_header = jwt.get_unverified_header(token)
     except JWTError as e:
         logger.error(f"Ogiltigt tokenheader: {e}")
         raise JWTError("Ogiltig JWT-header")
 
-    jwks = _get_jwks()
-    rsa_key = {}
-    for key in jwks.get("keys", []):
-        if key.get("kid") == unverified_header.get("kid"):
-            rsa_key = {
-                "kty": key.get("kty"),
-                "kid": key.get("kid"),
-                "use": key.get("use"),
-                "n":   key.get("n"),
-                "e":   key.get("e"),
-            }
-            break
-    if not rsa_key:
+    rsa_key = jwks_cache.get_key(unverified_header.get("kid"))
+    if rsa_key is None:
         logger.error(f"Ingen passande nyckel för kid {unverified_header.get('kid')}")
         raise JWTError("Ingen lämplig nyckel hittades i JWKS")
 
@@ -80,7 +239,9 @@ def decode_auth0_token(token: str) -> dict:
             audience=api_audience,
             issuer=f"https://{auth0_domain}/"
         )
-        return payload
     except JWTError as e:
         logger.error(f"JWT-validering misslyckades: {e}")
         raise JWTError(f"JWT-validering misslyckades: {e}")
+
+    token_cache.put(cache_key, payload)
+    return payload
@@ -1,33 +1,467 @@
 import os
-from datetime import datetime
-from typing import Optional, Generator, Dict, Any
-from sqlmodel import SQLModel, Field, create_engine, Session
-from sqlalchemy import Column
+from datetime import date, datetime
+from typing import Optional, Generator, AsyncGenerator, Dict, Any, List, Set, Tuple
+from sqlmodel import SQLModel, Field, Relationship, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import BigInteger, Column, Index, LargeBinary, event, inspect, select, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm.attributes import instance_dict, set_committed_value
 from sqlalchemy.types import JSON
 
+from utils.result_codec import encode_results, decode_results
+from utils.report_search import create_search_index
+from utils.report_rollups import accumulate_rollup
+
 # Konfigurationsvariabel för databas-URL; standard till en lokal SQLite-fil
 database_url = os.getenv("DATABASE_URL", "sqlite:///./database.db")
-# Skapa engine
-engine = create_engine(database_url, echo=True)
+database_echo = os.getenv("DATABASE_ECHO", "false").lower() in ("1", "true", "yes")
+
+# Poolinställningar; SQLite serialiserar skrivningar så en liten pool räcker där
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+is_sqlite = database_url.startswith("sqlite")
+search_index = create_search_index(database_url)
+
+
+def _async_database_url(url: str) -> str:
+    """
+    Översätter DATABASE_URL till motsvarande asynkrona drivrutin:
+    aiosqlite för SQLite och asyncpg för Postgres.
+    """
+    if url.startswith("sqlite:///"):
+        return url.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+    for prefix in ("postgres://", "postgresql://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+def _pool_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    if not is_sqlite:
+        options.update(pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    WAL låter läsare och en skrivare jobba samtidigt, busy_timeout väntar in
+    låsta skrivningar i stället för att direkt kasta "database is locked" och
+    synchronous=NORMAL räcker för hållbarhet i WAL-läge.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+# Skapa engines: synkron för skript och verktyg, asynkron för API-routes
+engine = create_engine(database_url, echo=database_echo, **_pool_options())
+async_engine = create_async_engine(
+    _async_database_url(database_url), echo=database_echo, **_pool_options()
+)
+
+if is_sqlite:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+async_session_maker = async_sessionmaker(
+    async_engine, class_=AsyncSession, expire_on_commit=False
+)
+
+class ResultBlob(SQLModel, table=True):
+    """
+    Komprimerat, innehållsadresserat analysresultat. Nyckeln är sha256 av den
+    kanoniska JSON:en, så identiska resultat lagras bara en gång.
+    """
+    digest: str = Field(primary_key=True)
+    codec: str
+    raw_size: int
+    stored_size: int
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 
 class Report(SQLModel, table=True):
     """
     Databasmodell för sparade rapporter per användare.
+
+    `results` lagras som en ResultBlob och packas upp transparent när
+    rapporten laddas; kolumnen results används bara av äldre, okompakterade rader.
     """
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: str
     analysis_type: str
     url: str
-    results: Dict[str, Any] = Field(sa_column=Column(JSON), default={})
+    results: Optional[Dict[str, Any]] = Field(
+        sa_column=Column(JSON(none_as_null=True)), default={}
+    )
+    results_digest: Optional[str] = Field(default=None, foreign_key="resultblob.digest")
+    # Liten utdragning ur results som listvyer kan visa utan att läsa hela JSON:en
+    highlights: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    blob: Optional[ResultBlob] = Relationship(sa_relationship_kwargs={"lazy": "joined"})
+
+
+# Täcker "mina rapporter, nyast först" så att listningen blir en indexskanning
+Index("ix_report_user_id_created_at", Report.user_id, Report.created_at.desc())
+
+
+class ReportRollup(SQLModel, table=True):
+    """
+    Dagliga aggregat per användare och URL som uppdateras vid varje ny rapport,
+    så att trendfrågor inte behöver läsa och tolka rapporterna.
+
+    design_stats: mått i designScore -> [antal, summa, min, max]
+    section_stats: sektion -> [antal rapporter, antal observationer]
+    """
+    user_id: str = Field(primary_key=True)
+    url: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    report_count: int = 0
+    design_stats: Dict[str, List[float]] = Field(default={}, sa_column=Column(JSON))
+    section_stats: Dict[str, List[int]] = Field(default={}, sa_column=Column(JSON))
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class WebhookEvent(SQLModel, table=True):
+    """
+    Outbox för Stripe-webhooks, nycklad på Stripes event-id så att
+    omleveranser inte ger dubbla planuppdateringar.
+
+    status: pending -> done, eller failed när försöken tagit slut.
+    next_attempt_at fungerar också som lås: en worker som plockar en rad
+    skjuter fram den, så att en annan process inte tar samma rad samtidigt.
+    """
+    event_id: str = Field(primary_key=True)
+    event_type: str
+    user_id: str
+    plan: str
+    status: str = "pending"
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    processed_at: Optional[datetime] = None
+
+
+# Workern frågar efter förfallna rader med status pending
+Index("ix_webhookevent_status_next_attempt_at", WebhookEvent.status, WebhookEvent.next_attempt_at)
+
+
+class AnalysisJob(SQLModel, table=True):
+    """
+    Ett analysjobb från POST /analyses: samma parametrar som /get_suggestions
+    men med en eller flera URL:er, som var och en blir en AnalysisJobItem.
+    """
+    id: str = Field(primary_key=True)
+    owner: str
+    tier: str
+    query: str
+    analysis_type: Optional[str] = None
+    is_competitor: bool = False
+    deadline_seconds: Optional[float] = None
+    total: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class AnalysisJobItem(SQLModel, table=True):
+    """
+    En URL i ett analysjobb.
+
+    status: queued -> running -> done, eller failed. lease_until fungerar
+    som lås medan raden körs och förnyas av workern; en rad som står kvar
+    som running med utgånget lås (processen dog) plockas upp igen. En köad
+    rad med not_before väntar till dess (analyskön var full).
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: str = Field(foreign_key="analysisjob.id")
+    position: int
+    url: str
+    # Index i utils.admission.TIERS; lägre körs först
+    priority: int
+    status: str = "queued"
+    attempts: int = 0
+    lease_until: Optional[datetime] = None
+    not_before: Optional[datetime] = None
+    result: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
+    error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+Index("ix_analysisjobitem_job_id_position", AnalysisJobItem.job_id, AnalysisJobItem.position)
+# Workern plockar nästa rad efter status, prioritet och ålder
+Index("ix_analysisjobitem_status_priority_id",
+      AnalysisJobItem.status, AnalysisJobItem.priority, AnalysisJobItem.id)
+
+
+class TrackedUrl(SQLModel, table=True):
+    """
+    En URL som analyseras om med jämna mellanrum (utils.url_monitor).
+
+    prompt_cache: hash av renderad prompt -> {"response", "seconds"} från
+    senaste körningen; field_fingerprints: extracted_data-fält -> hash.
+    next_run_at fungerar som lås på samma sätt som i WebhookEvent.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: str
+    url: str
+    query: str = ""
+    analysis_type: Optional[str] = None
+    is_competitor: bool = False
+    interval_hours: float
+    next_run_at: datetime = Field(default_factory=datetime.utcnow)
+    last_run_at: Optional[datetime] = None
+    last_report_id: Optional[int] = None
+    prompt_cache: Dict[str, Any] = Field(default={}, sa_column=Column(JSON))
+    field_fingerprints: Dict[str, str] = Field(default={}, sa_column=Column(JSON))
+    # Utfall och besparing för senaste körningen
+    last_run: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
+    runs: int = 0
+    changed_runs: int = 0
+    prompts_reused: int = 0
+    seconds_saved: float = 0.0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+Index("ix_trackedurl_next_run_at", TrackedUrl.next_run_at)
+Index("ix_trackedurl_user_id", TrackedUrl.user_id)
+
+
+class PageSignature(SQLModel, table=True):
+    """
+    SimHash-signatur av en analyserad sidas mall (utils.near_duplicates)
+    med de råsvar som kan återanvändas för nästan identiska sidor.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    domain: str
+    url: str
+    # 64-bitars signatur lagrad med tecken
+    signature: int = Field(sa_column=Column(BigInteger, nullable=False))
+    responses: Dict[str, str] = Field(default={}, sa_column=Column(JSON))
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
-def init_db() -> None:
+Index("ix_pagesignature_created_at", PageSignature.created_at)
+
+
+class ReportSummary(SQLModel):
+    """
+    Projektion av en rapport för listvyer; results hämtas via GET /reports/{id}.
+    """
+    id: int
+    analysis_type: str
+    url: str
+    created_at: datetime
+    highlights: Optional[Dict[str, Any]] = None
+
+
+class ReportPage(SQLModel):
+    """
+    En sida av rapportlistan med cursor till nästa sida (None på sista sidan).
+    """
+    items: List[ReportSummary]
+    next_cursor: Optional[str] = None
+
+
+class ReportSearchHit(SQLModel):
+    """
+    En träff från fulltextsökningen med markerat utdrag ur rapporttexten.
+    """
+    id: int
+    url: str
+    analysis_type: str
+    created_at: datetime
+    snippet: str
+    score: float
+
+
+class ReportSearchResults(SQLModel):
+    items: List[ReportSearchHit]
+    took_ms: float
+
+
+def report_highlights(results: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Plockar ut de fält ur results som rapportkorten visar.
+    """
+    results = results or {}
+    design_score = results.get("designScore") or {}
+    return {
+        "is_competitor": bool(results.get("is_competitor", False)),
+        "store_name": results.get("store_name"),
+        "designScore": {
+            key: value
+            for key, value in design_score.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        } if isinstance(design_score, dict) else {},
+    }
+
+
+def _dialect_insert(connection):
+    """INSERT med stöd för ON CONFLICT för den aktuella databasen."""
+    return postgresql_insert if connection.dialect.name == "postgresql" else sqlite_insert
+
+
+def insert_result_blob(connection, fields: Dict[str, Any]) -> bool:
+    """
+    Lagrar en blob om hashen inte redan finns. Returnerar True om den var ny.
+    """
+    result = connection.execute(
+        _dialect_insert(connection)(ResultBlob)
+        .values(created_at=datetime.utcnow(), **fields)
+        .on_conflict_do_nothing(index_elements=["digest"])
+    )
+    return result.rowcount == 1
+
+
+@event.listens_for(Report, "before_insert")
+def _prepare_report_insert(mapper, connection, target: Report) -> None:
+    if target.highlights is None:
+        target.highlights = report_highlights(target.results)
+    if target.results and target.results_digest is None:
+        fields = encode_results(target.results)
+        insert_result_blob(connection, fields)
+        target.results_digest = fields["digest"]
+        # Skriv NULL till results-kolumnen men behåll värdet i objektet efter insert
+        connection.info.setdefault("pending_results", {})[id(target)] = target.results
+        target.results = None
+
+
+def record_report_rollup(connection, user_id: str, url: str, created_at: datetime,
+                         results: Optional[Dict[str, Any]]) -> None:
+    """
+    Lägger till en rapport i dagens rollup-rad för (user_id, url).
+    Raden låses under läs-och-skriv så att samtidiga inserts inte tappar värden.
+    """
+    key = {"user_id": user_id, "url": url, "day": created_at.date()}
+    connection.execute(
+        _dialect_insert(connection)(ReportRollup)
+        .values(**key, report_count=0, design_stats={}, section_stats={},
+                updated_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["user_id", "url", "day"])
+    )
+    where = [getattr(ReportRollup, column) == value for column, value in key.items()]
+    row = connection.execute(
+        select(ReportRollup.report_count, ReportRollup.design_stats, ReportRollup.section_stats)
+        .where(*where)
+        .with_for_update()
+    ).one()
+    design_stats, section_stats = accumulate_rollup(row.design_stats, row.section_stats, results)
+    connection.execute(
+        update(ReportRollup)
+        .where(*where)
+        .values(
+            report_count=row.report_count + 1,
+            design_stats=design_stats,
+            section_stats=section_stats,
+            updated_at=datetime.utcnow(),
+        )
+    )
+
+
+@event.listens_for(Report, "after_insert")
+def _after_report_insert(mapper, connection, target: Report) -> None:
+    payload = connection.info.get("pending_results", {}).pop(id(target), None)
+    if payload is not None:
+        set_committed_value(target, "results", payload)
+    # Sökindex och rollups uppdateras i samma transaktion som rapporten
+    search_index.index_report(
+        connection, target.id, target.user_id, target.url, target.results
+    )
+    record_report_rollup(
+        connection, target.user_id, target.url, target.created_at, target.results
+    )
+
+
+@event.listens_for(Report, "load")
+@event.listens_for(Report, "refresh")
+def _inflate_report_results(target: Report, context, attrs=None) -> None:
+    blob = instance_dict(target).get("blob")
+    if blob is not None and not instance_dict(target).get("results"):
+        set_committed_value(target, "results", decode_results(blob.codec, blob.data))
+
+
+def _migrate_schema(connection) -> Set[Tuple[str, str]]:
+    """
+    create_all skapar bara saknade tabeller. Lägger till nya (nullbara) kolumner
+    och saknade index på befintliga tabeller och returnerar tillagda kolumner.
+    """
+    inspector = inspect(connection)
+    added = set()
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(
+                    text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+                )
+                added.add((table.name, column.name))
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    return added
+
+
+def _backfill_report_rollups(connection) -> None:
+    """Bygger rollups från befintliga rapporter om tabellen är ny och tom."""
+    if connection.execute(select(ReportRollup.user_id).limit(1)).first() is not None:
+        return
+    session = Session(bind=connection)
+    last_id = 0
+    while True:
+        reports = session.scalars(
+            select(Report).where(Report.id > last_id).order_by(Report.id).limit(200)
+        ).all()
+        if not reports:
+            break
+        for report in reports:
+            record_report_rollup(
+                connection, report.user_id, report.url, report.created_at, report.results
+            )
+            last_id = report.id
+        session.expunge_all()
+
+
+def _backfill_report_highlights(connection) -> None:
+    rows = connection.execute(
+        select(Report.id, Report.results).where(Report.highlights.is_(None))
+    ).all()
+    for report_id, results in rows:
+        connection.execute(
+            update(Report)
+            .where(Report.id == report_id)
+            .values(highlights=report_highlights(results))
+        )
+
+async def init_db() -> None:
     """
     Initierar databasen och skapar alla tabeller.
     Ska kallas vid applikationens startup.
     """
-    SQLModel.metadata.create_all(engine)
+    async with async_engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        added = await conn.run_sync(_migrate_schema)
+        if ("report", "highlights") in added:
+            await conn.run_sync(_backfill_report_highlights)
+        await conn.run_sync(search_index.create)
+        await conn.run_sync(search_index.backfill)
+        await conn.run_sync(_backfill_report_rollups)
 
 
 def get_session() -> Generator[Session, None, None]:
@@ -39,3 +473,12 @@ def get_session() -> Generator[Session, None, None]:
     """
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Asynkron databas-session (FastAPI dependency) så att DB-anrop inte tar
+    platser i trådpoolen som skrapningen behöver.
+    """
+    async with async_session_maker() as session:
+        yield session
@@ -2,46 +2,71 @@
 from fastapi import FastAPI, HTTPException, Request
 from dotenv import load_dotenv
 import os
-import openai
 import logging
 from fastapi.middleware.cors import CORSMiddleware
 import re
-from fastapi.responses import JSONResponse
 from database import init_db
+from auth import jwks_cache
 
 # Import our modules
 from utils.logging_utils import configure_logging
-from routes import analysis_routes, user_routes, report_routes
+from utils.loop_monitor import start_loop_monitor, stop_loop_monitor
+from utils.report_writer import report_writer
+from utils.quota_store import quota_store
+from utils.webhook_outbox import webhook_worker
+from utils.analysis_jobs import analysis_jobs
+from utils.url_monitor import url_monitor
+from utils.prefetch import prefetcher
+from utils.warmup import warmup
+from utils.web_scraper import browser_pool
+from utils.analysis_utils import close_openai_client
+from utils.middleware import CompressionMiddleware, ErrorLoggingMiddleware
+from utils.responses import FastJSONResponse
+from routes import analysis_routes, user_routes, report_routes, metrics_routes
 
 # Load environment variables
 load_dotenv()
 
 # Get API key or raise an error
-openai.api_key = os.getenv("VITE_OPENAI_API_KEY")
-if not openai.api_key:
+if not os.getenv("VITE_OPENAI_API_KEY"):
     raise ValueError("OpenAI API-nyckel saknas i miljövariabler.")
 
 # Configure logging
 logger = configure_logging()
 
 # Create FastAPI application
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Set up startup event handlers
 app.add_event_handler("startup", init_db)
+app.add_event_handler("startup", start_loop_monitor)
+app.add_event_handler("startup", report_writer.start)
+app.add_event_handler("startup", webhook_worker.start)
+# Återupptar analysjobb som var köade eller avbrutna vid förra avstängningen
+app.add_event_handler("startup", analysis_jobs.start)
+app.add_event_handler("startup", url_monitor.start)
+# Förstartade webbläsare, OpenAI-anslutning och JWKS; /ready svarar 200 när det är klart
+app.add_event_handler("startup", warmup.start)
+app.add_event_handler("shutdown", stop_loop_monitor)
+app.add_event_handler("shutdown", report_writer.stop)
+app.add_event_handler("shutdown", jwks_cache.stop)
+app.add_event_handler("shutdown", quota_store.close)
+app.add_event_handler("shutdown", webhook_worker.stop)
+app.add_event_handler("shutdown", analysis_jobs.stop)
+app.add_event_handler("shutdown", url_monitor.stop)
+app.add_event_handler("shutdown", prefetcher.stop)
+app.add_event_handler("shutdown", warmup.stop)
+app.add_event_handler("shutdown", close_openai_client)
+app.add_event_handler("shutdown", browser_pool.close)
 
 # Error middleware to capture and log detailed error information
-@app.middleware("http")
-async def error_logging_middleware(request: Request, call_next):
-    try:
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        logger.error(f"Uncaught exception: {str(e)}", exc_info=True)
-        return JSONResponse(
-            status_code=500,
-            content={"detail": f"Server error: {str(e)}"},
-        )
+app.add_middleware(ErrorLoggingMiddleware)
+
+# Komprimera svar (brotli/gzip enligt Accept-Encoding) över en viss storlek
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_BYTES", "1024")),
+)
 
 # Updated CORS middleware to allow more origins
 app.add_middleware(
@@ -64,3 +89,4 @@ app.add_middleware(
 app.include_router(analysis_routes.router)
 app.include_router(user_routes.router)
 app.include_router(report_routes.router)
+app.include_router(metrics_routes.router)
@@ -7,6 +7,32 @@ class Query(BaseModel):
     url: str
     analysis_type: Optional[str] = None
     is_competitor: Optional[bool] = False
+    # Önskad tidsbudget i sekunder; begränsas av plannivåns tak
+    deadline_seconds: Optional[float] = None
+
+class AnalysisJobRequest(BaseModel):
+    query: str
+    urls: List[str]
+    analysis_type: Optional[str] = None
+    is_competitor: Optional[bool] = False
+    deadline_seconds: Optional[float] = None
+
+class CompareRequest(BaseModel):
+    query: str = ""
+    url: str
+    competitors: List[str]
+    deadline_seconds: Optional[float] = None
+
+class PrefetchRequest(BaseModel):
+    url: str
+
+class TrackUrlRequest(BaseModel):
+    url: str
+    query: str = ""
+    analysis_type: Optional[str] = None
+    is_competitor: Optional[bool] = False
+    # Tid mellan körningar; standard MONITOR_DEFAULT_INTERVAL_H
+    interval_hours: Optional[float] = None
 
 class UserRequest(BaseModel):
     user_id: str
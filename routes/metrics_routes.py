@@ -0,0 +1,50 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from auth import jwks_cache, token_cache
+
+from utils.admission import analysis_admission
+from utils.analysis_jobs import analysis_jobs
+from utils.inflight import scrape_flights, visitor_flights
+from utils.llm_hedging import llm_completer
+from utils.logging_utils import performance_metrics
+from utils.loop_monitor import loop_monitor
+from utils.near_duplicates import near_duplicate_index
+from utils.prompt_templates import prompt_registry
+from utils.prefetch import prefetcher
+from utils.report_writer import report_writer
+from utils.responses import response_timings
+from utils.url_monitor import url_monitor
+from utils.warmup import warmup
+from utils.web_scraper import browser_pool
+from utils.webhook_outbox import webhook_worker
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics(top: int = 10):
+    """Samlade prestandamått: senaste tidsmätningar och event-loopens lag."""
+    return {
+        "timings": {name: round(elapsed, 4) for name, elapsed in performance_metrics.items()},
+        "event_loop": loop_monitor.snapshot(top=top),
+        "report_writes": report_writer.snapshot(),
+        "auth": {"jwks": jwks_cache.snapshot(), "token_cache": token_cache.snapshot()},
+        "admission": analysis_admission.snapshot(),
+        "webhooks": await webhook_worker.snapshot(),
+        "analysis_jobs": await analysis_jobs.snapshot(),
+        "monitoring": await url_monitor.snapshot(),
+        "near_duplicates": near_duplicate_index.snapshot(),
+        "llm": llm_completer.snapshot(),
+        "prompt_templates": prompt_registry.snapshot(),
+        "warmup": warmup.snapshot(),
+        "browsers": browser_pool.snapshot(),
+        "prefetch": prefetcher.snapshot(),
+        "shared_work": {"scrapes": scrape_flights.snapshot(), "visitor_lookups": visitor_flights.snapshot()},
+        "responses": response_timings.snapshot(),
+    }
+
+@router.get("/ready")
+async def get_ready():
+    """Readiness för lastbalanserare: 503 tills uppvärmningen är klar, därefter 200."""
+    snapshot = warmup.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
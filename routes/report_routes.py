@@ -1,20 +1,64 @@
-from fastapi import APIRouter, HTTPException, Depends
+import base64
+import binascii
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple, Literal
+from urllib.parse import urlparse
+from fastapi import APIRouter, HTTPException, Depends, Query, Body
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlmodel import Session, select
-from database import get_session, Report
+from sqlalchemy import and_, func, or_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import (
+    async_session_maker,
+    get_async_session,
+    search_index,
+    Report,
+    ReportSummary,
+    ReportPage,
+    ReportSearchResults,
+    ReportRollup,
+    ResultBlob,
+    TrackedUrl,
+)
+from models import TrackUrlRequest
+from utils.report_rollups import rollup_trends
+from utils.report_export import chunked, csv_header, csv_line, gzip_stream, ndjson_line
+from utils.result_codec import decode_results
+from utils.report_writer import report_writer
+from utils.quota_store import quota_store
+from utils.url_monitor import url_monitor
 from auth import decode_auth0_token
-# Rätt import från samma paket
-from .user_routes import admin_users
 
 router = APIRouter()
 security = HTTPBearer()
 
-@router.post("/reports", response_model=Report)
-def create_report(
-    report_in: Report,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    session: Session = Depends(get_session),
-):
+# Max antal rapporter per anrop till POST /reports/batch
+MAX_BATCH_REPORTS = 100
+
+# Bevakade URL:er: antal per användare och intervall mellan körningar (timmar)
+MONITOR_MAX_PER_USER = int(os.getenv("MONITOR_MAX_PER_USER", "20"))
+MONITOR_DEFAULT_INTERVAL_H = float(os.getenv("MONITOR_DEFAULT_INTERVAL_H", "168"))
+MONITOR_MIN_INTERVAL_H = float(os.getenv("MONITOR_MIN_INTERVAL_H", "1"))
+
+def _encode_cursor(created_at: datetime, report_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{report_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, report_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(report_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(400, "Ogiltig cursor")
+
+async def _authorize_report_writer(credentials: HTTPAuthorizationCredentials) -> str:
+    """
+    Validerar JWT och kräver admin eller betald plan. Returnerar user_id.
+    """
     # Validera JWT och hämta claims
     payload   = decode_auth0_token(credentials.credentials)
     user_id   = payload.get("sub")
@@ -23,8 +67,8 @@ def create_report(
     # Kontrollera admin via roller eller backend-lista
     roles       = payload.get("https://oculis-ai.example.com/roles", [])
     is_admin    = isinstance(roles, list) and "admin" in roles
-    # Backend-registrerade admins via user_routes
-    if user_id in admin_users:
+    # Backend-registrerade admins via /set-admin
+    if not is_admin and (await quota_store.get_user(user_id)).is_admin:
         is_admin = True
 
     # Kontrollera plan från app_metadata om angivet
@@ -40,39 +84,308 @@ def create_report(
     # Admin ELLER Betald plan krävs
     if not is_admin and user_plan not in ("plus", "pro", "pro-trial"):
         raise HTTPException(403, "Betald plan krävs för att spara rapporter")
+    return user_id
 
-    # Skapa och spara rapporten
+@router.post("/reports", response_model=Report)
+async def create_report(
+    report_in: Report,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_async_session),
+):
+    user_id = await _authorize_report_writer(credentials)
+
+    # Skapa och spara rapporten; expire_on_commit=False gör att id och
+    # övriga fält finns kvar efter commit utan en extra refresh
     report = Report(
         user_id=user_id,
         analysis_type=report_in.analysis_type,
         url=report_in.url,
         results=report_in.results
     )
-    session.add(report)
-    session.commit()
-    session.refresh(report)
+    await report_writer.save([report], session)
     return report
 
-@router.get("/reports", response_model=list[Report])
-def list_reports(
+@router.post("/reports/batch", response_model=List[Report])
+async def create_reports_batch(
+    reports_in: List[Report] = Body(..., min_length=1, max_length=MAX_BATCH_REPORTS),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Sparar flera rapporter i en och samma transaktion.
+    """
+    user_id = await _authorize_report_writer(credentials)
+    reports = [
+        Report(
+            user_id=user_id,
+            analysis_type=report_in.analysis_type,
+            url=report_in.url,
+            results=report_in.results,
+        )
+        for report_in in reports_in
+    ]
+    await report_writer.save(reports, session)
+    return reports
+
+@router.get("/reports", response_model=ReportPage)
+async def list_reports(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Listar användarens rapporter nyast först, sida för sida (keyset-paginering).
+    Returnerar bara sammanfattningar; fullständiga results via GET /reports/{id}.
+    """
+    user_id = decode_auth0_token(credentials.credentials)["sub"]
+    statement = select(
+        Report.id, Report.analysis_type, Report.url, Report.created_at, Report.highlights
+    ).where(Report.user_id == user_id)
+    if cursor:
+        after_created_at, after_id = _decode_cursor(cursor)
+        statement = statement.where(
+            or_(
+                Report.created_at < after_created_at,
+                and_(Report.created_at == after_created_at, Report.id < after_id),
+            )
+        )
+    # Hämta en extra rad för att veta om det finns en nästa sida
+    result = await session.exec(
+        statement.order_by(Report.created_at.desc(), Report.id.desc()).limit(limit + 1)
+    )
+    rows = result.all()
+
+    items = [ReportSummary(**row._mapping) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = _encode_cursor(last.created_at, last.id)
+    return ReportPage(items=items, next_cursor=next_cursor)
+
+@router.get("/reports/search", response_model=ReportSearchResults)
+async def search_reports(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Fulltextsökning i användarens sparade rapporter (url och all analystext),
+    rankad efter relevans och med markerade utdrag.
+    """
+    user_id = decode_auth0_token(credentials.credentials)["sub"]
+    search_start = time.perf_counter()
+    hits = await search_index.search(session, user_id, q, limit)
+    took_ms = (time.perf_counter() - search_start) * 1000
+    return ReportSearchResults(items=hits, took_ms=round(took_ms, 2))
+
+@router.get("/reports/trends")
+async def report_trends(
+    url: Optional[str] = None,
+    days: int = Query(90, ge=1, le=730),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Trender för designpoäng och sektioner från de dagliga rollup-raderna.
+    Med url: dagsserie, percentiler och förändringar för den URL:en.
+    Utan url: en översikt per URL som användaren har rapporter för.
+    """
+    user_id = decode_auth0_token(credentials.credentials)["sub"]
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    statement = select(ReportRollup).where(
+        ReportRollup.user_id == user_id, ReportRollup.day >= since
+    )
+    if url:
+        statement = statement.where(ReportRollup.url == url)
+    result = await session.exec(statement.order_by(ReportRollup.url, ReportRollup.day))
+    rows = result.all()
+
+    if url:
+        return {"url": url, "days": days, **rollup_trends(rows)}
+
+    rows_by_url = {}
+    for row in rows:
+        rows_by_url.setdefault(row.url, []).append(row)
+    overview = []
+    for row_url, url_rows in rows_by_url.items():
+        trends = rollup_trends(url_rows)
+        overview.append({
+            "url": row_url,
+            "reports": trends["reports"],
+            "last_day": url_rows[-1].day.isoformat(),
+            "metrics": {
+                key: {name: stats[name] for name in ("latest", "delta_previous", "delta_window")}
+                for key, stats in trends["metrics"].items()
+            },
+        })
+    overview.sort(key=lambda item: item["last_day"], reverse=True)
+    return {"days": days, "urls": overview}
+
+EXPORT_BATCH_SIZE = 200
+
+@router.get("/reports/export")
+async def export_reports(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    analysis_type: Optional[str] = None,
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    session: Session = Depends(get_session),
 ):
+    """
+    Strömmar användarens rapporter som NDJSON eller CSV (valfritt gzip).
+    Raderna läses med en server-side cursor i batchar och kodas medan de
+    skickas, så minnesåtgången är konstant oavsett exportens storlek.
+    """
     user_id = decode_auth0_token(credentials.credentials)["sub"]
-    return session.exec(
-        select(Report)
+    statement = (
+        select(
+            Report.id,
+            Report.analysis_type,
+            Report.url,
+            Report.created_at,
+            Report.results,
+            ResultBlob.codec,
+            ResultBlob.data,
+        )
+        .outerjoin(ResultBlob, Report.results_digest == ResultBlob.digest)
         .where(Report.user_id == user_id)
-        .order_by(Report.created_at.desc())
-    ).all()
+    )
+    if since:
+        statement = statement.where(Report.created_at >= since)
+    if until:
+        statement = statement.where(Report.created_at < until)
+    if analysis_type:
+        statement = statement.where(Report.analysis_type == analysis_type)
+    statement = statement.order_by(Report.created_at.desc()).execution_options(
+        yield_per=EXPORT_BATCH_SIZE
+    )
+    encode = ndjson_line if format == "ndjson" else csv_line
+
+    async def rows():
+        if format == "csv":
+            yield csv_header()
+        # Egen session: strömmen läses efter att routen returnerat
+        async with async_session_maker() as session:
+            result = await session.stream(statement)
+            async for partition in result.partitions():
+                for row in partition:
+                    results = (
+                        decode_results(row.codec, row.data) if row.data is not None
+                        else row.results or {}
+                    )
+                    yield encode({
+                        "id": row.id,
+                        "analysis_type": row.analysis_type,
+                        "url": row.url,
+                        "created_at": row.created_at.isoformat(),
+                        "results": results,
+                    })
+
+    body = chunked(rows())
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8"
+    filename = f"oculis-reports.{format}"
+    if gzip:
+        body = gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 @router.get("/reports/{report_id}", response_model=Report)
-def get_report(
+async def get_report(
     report_id: int,
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     user_id = decode_auth0_token(credentials.credentials)["sub"]
-    report = session.get(Report, report_id)
+    report = await session.get(Report, report_id)
     if not report or report.user_id != user_id:
         raise HTTPException(404, "Rapporten hittades inte")
     return report
+
+def _tracked_url_view(tracked: TrackedUrl) -> dict:
+    """Bevakningen utan promptcachen, som kan vara stor."""
+    return {
+        "id": tracked.id,
+        "url": tracked.url,
+        "query": tracked.query,
+        "analysis_type": tracked.analysis_type,
+        "is_competitor": tracked.is_competitor,
+        "interval_hours": tracked.interval_hours,
+        "next_run_at": tracked.next_run_at,
+        "last_run_at": tracked.last_run_at,
+        "last_report_id": tracked.last_report_id,
+        "last_run": tracked.last_run,
+        "runs": tracked.runs,
+        "changed_runs": tracked.changed_runs,
+        "prompts_reused": tracked.prompts_reused,
+        "seconds_saved": round(tracked.seconds_saved, 2),
+        "created_at": tracked.created_at,
+    }
+
+@router.post("/tracked-urls", status_code=201)
+async def create_tracked_url(
+    tracked_in: TrackUrlRequest,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Bevakar en URL: den analyseras direkt och sedan var interval_hours
+    timme, och en ny rapport sparas bara när sidan ändrats.
+    """
+    user_id = await _authorize_report_writer(credentials)
+    parsed = urlparse(tracked_in.url)
+    if not all([parsed.scheme, parsed.netloc]):
+        raise HTTPException(400, "Ogiltig URL angiven.")
+    interval_hours = tracked_in.interval_hours or MONITOR_DEFAULT_INTERVAL_H
+    if interval_hours < MONITOR_MIN_INTERVAL_H:
+        raise HTTPException(400, f"Intervallet måste vara minst {MONITOR_MIN_INTERVAL_H:g} timmar")
+
+    count = await session.scalar(
+        select(func.count()).select_from(TrackedUrl).where(TrackedUrl.user_id == user_id)
+    )
+    if count >= MONITOR_MAX_PER_USER:
+        raise HTTPException(429, f"Max {MONITOR_MAX_PER_USER} bevakade URL:er per användare")
+
+    tracked = TrackedUrl(
+        user_id=user_id,
+        url=tracked_in.url,
+        query=tracked_in.query,
+        analysis_type=tracked_in.analysis_type,
+        is_competitor=bool(tracked_in.is_competitor),
+        interval_hours=interval_hours,
+    )
+    session.add(tracked)
+    await session.commit()
+    url_monitor.wake()
+    return _tracked_url_view(tracked)
+
+@router.get("/tracked-urls")
+async def list_tracked_urls(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_async_session),
+):
+    user_id = decode_auth0_token(credentials.credentials)["sub"]
+    tracked = (await session.exec(
+        select(TrackedUrl).where(TrackedUrl.user_id == user_id).order_by(TrackedUrl.id)
+    )).all()
+    return [_tracked_url_view(item) for item in tracked]
+
+@router.delete("/tracked-urls/{tracked_id}", status_code=204)
+async def delete_tracked_url(
+    tracked_id: int,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_async_session),
+):
+    user_id = decode_auth0_token(credentials.credentials)["sub"]
+    tracked = await session.get(TrackedUrl, tracked_id)
+    if not tracked or tracked.user_id != user_id:
+        raise HTTPException(404, "Bevakningen hittades inte")
+    await session.delete(tracked)
+    await session.commit()
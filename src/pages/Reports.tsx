@@ -18,8 +18,24 @@ interface Report {
   created_at: string;
 }
 
+interface ReportSummary {
+  id: number;
+  analysis_type: string;
+  url: string;
+  created_at: string;
+  highlights: {
+    is_competitor?: boolean;
+    store_name?: string | null;
+    designScore?: Record<string, number>;
+  } | null;
+}
+
+const PAGE_SIZE = 20;
+
 const Reports = () => {
-  const [reports, setReports] = useState<Report[]>([]);
+  const [reports, setReports] = useState<ReportSummary[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [isLoading, setIsLoading] = useState(true);
   const [activeTab, setActiveTab] = useState("all");
   const { toast } = useToast();
@@ -27,6 +43,33 @@ const Reports = () => {
   const { reportId } = useParams<{ reportId: string }>();
   const [selectedReport, setSelectedReport] = useState<Report | null>(null);
 
+  const fetchReportPage = async (cursor: string | null) => {
+    const token = await getAccessTokenSilently();
+    const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+    if (cursor) params.set("cursor", cursor);
+    const response = await fetch(`${BACKEND_URL}/reports?${params}`, {
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    });
+
+    if (!response.ok) {
+      throw new Error("Kunde inte hämta rapporter");
+    }
+
+    return response.json() as Promise<{ items: ReportSummary[]; next_cursor: string | null }>;
+  };
+
+  const fetchFullReport = async (id: number): Promise<Report | null> => {
+    const token = await getAccessTokenSilently();
+    const response = await fetch(`${BACKEND_URL}/reports/${id}`, {
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    });
+    return response.ok ? response.json() : null;
+  };
+
   useEffect(() => {
     const fetchReports = async () => {
       if (!isAuthenticated) {
@@ -35,23 +78,13 @@ const Reports = () => {
       }
 
       try {
-        const token = await getAccessTokenSilently();
-        const response = await fetch(`${BACKEND_URL}/reports`, {
-          headers: {
-            Authorization: `Bearer ${token}`,
-          },
-        });
-
-        if (!response.ok) {
-          throw new Error("Kunde inte hämta rapporter");
-        }
-
-        const data = await response.json();
-        setReports(data);
+        const data = await fetchReportPage(null);
+        setReports(data.items);
+        setNextCursor(data.next_cursor);
 
-        // If a specific report ID is in the URL, find and select that report
+        // If a specific report ID is in the URL, load that report in full
         if (reportId) {
-          const report = data.find((r: Report) => r.id === parseInt(reportId));
+          const report = await fetchFullReport(parseInt(reportId));
           if (report) {
             setSelectedReport(report);
           } else {
@@ -77,11 +110,30 @@ const Reports = () => {
     fetchReports();
   }, [isAuthenticated, getAccessTokenSilently, toast, reportId]);
 
+  const loadMoreReports = async () => {
+    if (!nextCursor) return;
+    setIsLoadingMore(true);
+    try {
+      const data = await fetchReportPage(nextCursor);
+      setReports((previous) => [...previous, ...data.items]);
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error("Error fetching reports:", error);
+      toast({
+        title: "Ett fel uppstod",
+        description: "Kunde inte hämta fler rapporter",
+        variant: "destructive",
+      });
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   // Filter reports based on active tab
   const filteredReports = reports.filter((report) => {
     if (activeTab === "all") return true;
-    if (activeTab === "stores") return report.results?.is_competitor === false;
-    if (activeTab === "competitors") return report.results?.is_competitor === true;
+    if (activeTab === "stores") return report.highlights?.is_competitor !== true;
+    if (activeTab === "competitors") return report.highlights?.is_competitor === true;
     return true;
   });
 
@@ -97,8 +149,21 @@ const Reports = () => {
     }).format(date);
   };
 
-  const viewReport = (report: Report) => {
-    setSelectedReport(report);
+  const viewReport = async (summary: ReportSummary) => {
+    try {
+      const report = await fetchFullReport(summary.id);
+      if (!report) {
+        throw new Error("Kunde inte hämta rapporten");
+      }
+      setSelectedReport(report);
+    } catch (error) {
+      console.error("Error fetching report:", error);
+      toast({
+        title: "Ett fel uppstod",
+        description: "Kunde inte hämta rapporten",
+        variant: "destructive",
+      });
+    }
   };
 
   if (isLoading) {
@@ -303,6 +368,15 @@ const Reports = () => {
                 )}
               </TabsContent>
             </Tabs>
+
+            {nextCursor && (
+              <div className="flex justify-center">
+                <Button variant="outline" onClick={loadMoreReports} disabled={isLoadingMore}>
+                  {isLoadingMore && <Loader2 className="h-4 w-4 mr-2 animate-spin" />}
+                  Visa fler rapporter
+                </Button>
+              </div>
+            )}
           </>
         )}
       </div>
@@ -311,12 +385,12 @@ const Reports = () => {
 };
 
 interface ReportCardProps {
-  report: Report;
-  onView: (report: Report) => void;
+  report: ReportSummary;
+  onView: (report: ReportSummary) => void;
 }
 
 const ReportCard = ({ report, onView }: ReportCardProps) => {
-  const isCompetitor = report.results?.is_competitor === true;
+  const isCompetitor = report.highlights?.is_competitor === true;
   const formatDate = (dateString: string) => {
     const date = new Date(dateString);
     return new Intl.DateTimeFormat("sv-SE", {
@@ -327,8 +401,8 @@ const ReportCard = ({ report, onView }: ReportCardProps) => {
   };
 
   // Get design scores
-  const usabilityScore = report.results?.designScore?.usability || 0;
-  const performanceScore = report.results?.designScore?.performance || 0;
+  const usabilityScore = report.highlights?.designScore?.usability || 0;
+  const performanceScore = report.highlights?.designScore?.performance || 0;
 
   return (
     <Card className={`hover:shadow-md transition-shadow ${
@@ -345,7 +419,7 @@ const ReportCard = ({ report, onView }: ReportCardProps) => {
               <ShoppingCart className="h-5 w-5 text-blue-500" />
             )}
             <CardTitle className="text-lg">
-              {report.results?.store_name || new URL(report.url).hostname}
+              {report.highlights?.store_name || new URL(report.url).hostname}
             </CardTitle>
           </div>
           <CardDescription className="text-xs bg-gray-100 dark:bg-gray-800 px-2 py-1 rounded">
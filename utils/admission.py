@@ -0,0 +1,263 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.logging_utils import logger
+
+# Prioritetsnivåer i kön; lägre index släpps in först
+TIERS = ("priority", "standard", "free")
+TIER_BY_PLAN = {
+    "admin": "priority",
+    "pro": "priority",
+    "pro-trial": "standard",
+    "plus": "standard",
+    "basic": "standard",
+}
+
+
+def tier_for_plan(plan: Optional[str]) -> str:
+    return TIER_BY_PLAN.get(plan or "", "free")
+
+
+class AdmissionRejected(Exception):
+    """Requesten släpps inte in; status_code och retry_after blir svarets 503/429."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int, reason: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("tier", "user_key", "future", "queued_at")
+
+    def __init__(self, tier: str, user_key: str, future: asyncio.Future):
+        self.tier = tier
+        self.user_key = user_key
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Begränsar antalet samtidiga analyser och köar resten i en begränsad
+    prioritetskö ordnad på plannivå (FIFO inom samma nivå).
+
+    En request avvisas direkt med 503 när kön är full (om den inte kan
+    tränga undan en väntande request med lägre nivå) eller när den
+    uppskattade väntetiden överstiger max_wait. Varje användare får ha
+    högst per_user analyser i kö eller under körning.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, per_user: int,
+                 max_wait: float, initial_service_time: float = 30.0, sample_size: int = 256):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.max_wait = max_wait
+
+        self._running = 0
+        self._heap: List[Tuple[int, int, _Waiter]] = []
+        self._queued = 0
+        self._sequence = itertools.count()
+        self._in_flight: Dict[str, int] = {}
+        # Glidande medelvärde av körtiden, används för att uppskatta väntetid
+        self._service_time = initial_service_time
+
+        self._stats: Dict[str, Dict[str, Any]] = {
+            tier: {
+                "admitted": 0,
+                "completed": 0,
+                "rejected_queue_full": 0,
+                "rejected_wait": 0,
+                "rejected_user_limit": 0,
+                "shed": 0,
+                "timed_out": 0,
+                "running": 0,
+                "queued": 0,
+                "wait_ms": deque(maxlen=sample_size),
+            }
+            for tier in TIERS
+        }
+
+    def has_idle_capacity(self) -> bool:
+        """Lediga platser och tom kö; bakgrundsarbete får bara starta då."""
+        return self._running < self.max_concurrent and not self._queued
+
+    def _estimated_wait(self, ahead: int) -> float:
+        """Väntetid för en request med `ahead` köade före sig."""
+        if self._running + ahead < self.max_concurrent:
+            return 0.0
+        rounds = math.floor(ahead / self.max_concurrent) + 1
+        return rounds * self._service_time
+
+    def _queued_ahead(self, tier_index: int) -> int:
+        # Nya requests hamnar efter alla på samma eller högre nivå
+        return sum(1 for index, _, waiter in self._heap
+                   if index <= tier_index and not waiter.future.done())
+
+    def _reject(self, tier: str, reason: str, status_code: int, detail: str,
+                retry_after: float) -> AdmissionRejected:
+        self._stats[tier][f"rejected_{reason}"] += 1
+        logger.warning(f"❌ Analys avvisad ({tier}, {reason}): {detail}")
+        return AdmissionRejected(status_code, detail, max(1, math.ceil(retry_after)), reason)
+
+    def _shed_lowest(self, tier_index: int) -> bool:
+        """Tränger undan den senast köade requesten med lägst nivå, om den är lägre än tier_index."""
+        candidates = [entry for entry in self._heap if not entry[2].future.done()]
+        if not candidates:
+            return False
+        victim = max(candidates, key=lambda entry: (entry[0], entry[1]))
+        if victim[0] <= tier_index:
+            return False
+        waiter = victim[2]
+        self._stats[waiter.tier]["shed"] += 1
+        waiter.future.set_exception(AdmissionRejected(
+            503, "Servern är överbelastad, försök igen om en stund",
+            max(1, math.ceil(self._service_time)), "shed",
+        ))
+        return True
+
+    def _grant_next(self) -> None:
+        while self._heap and self._running < self.max_concurrent:
+            _, _, waiter = heapq.heappop(self._heap)
+            if waiter.future.done():
+                continue
+            self._running += 1
+            waiter.future.set_result(None)
+
+    def _forget_waiter(self, waiter: _Waiter) -> None:
+        self._queued -= 1
+        self._stats[waiter.tier]["queued"] -= 1
+
+    def _release_user(self, user_key: str) -> None:
+        remaining = self._in_flight.get(user_key, 1) - 1
+        if remaining > 0:
+            self._in_flight[user_key] = remaining
+        else:
+            self._in_flight.pop(user_key, None)
+
+    async def _acquire(self, user_key: str, tier: str, max_wait: Optional[float] = None) -> None:
+        stats = self._stats[tier]
+        tier_index = TIERS.index(tier)
+        # Requestens egen tidsbudget kan korta väntan men aldrig förlänga den
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+
+        if self._in_flight.get(user_key, 0) >= self.per_user:
+            raise self._reject(
+                tier, "user_limit", 429,
+                f"Max {self.per_user} samtidiga analyser per användare", self._service_time,
+            )
+
+        if self._running < self.max_concurrent and not self._queued:
+            self._running += 1
+            self._in_flight[user_key] = self._in_flight.get(user_key, 0) + 1
+            stats["admitted"] += 1
+            stats["wait_ms"].append(0.0)
+            return
+
+        estimated_wait = self._estimated_wait(self._queued_ahead(tier_index))
+        if estimated_wait > max_wait:
+            raise self._reject(
+                tier, "wait", 503,
+                f"Beräknad väntetid {estimated_wait:.1f}s överstiger {max_wait:.1f}s",
+                estimated_wait,
+            )
+        if self._queued >= self.max_queue and not self._shed_lowest(tier_index):
+            raise self._reject(tier, "queue_full", 503, "Analyskön är full", estimated_wait)
+
+        waiter = _Waiter(tier, user_key, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (tier_index, next(self._sequence), waiter))
+        self._queued += 1
+        stats["queued"] += 1
+        self._in_flight[user_key] = self._in_flight.get(user_key, 0) + 1
+        # Platser kan ha frigjorts medan tidigare beviljade väntare ännu inte vaknat
+        self._grant_next()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max_wait)
+        except asyncio.TimeoutError:
+            self._forget_waiter(waiter)
+            self._release_user(user_key)
+            if waiter.future.done() and waiter.future.exception() is None:
+                # Platsen beviljades precis när väntan löpte ut; lämna tillbaka den
+                self._running -= 1
+                self._grant_next()
+            else:
+                waiter.future.cancel()
+            stats["timed_out"] += 1
+            raise AdmissionRejected(503, "Väntetiden i analyskön löpte ut",
+                                    max(1, math.ceil(self._service_time)), "timed_out")
+        except BaseException:
+            # Undanträngd eller klienten kopplade ner
+            self._forget_waiter(waiter)
+            self._release_user(user_key)
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self._running -= 1
+                self._grant_next()
+            else:
+                waiter.future.cancel()
+            raise
+
+        self._forget_waiter(waiter)
+        stats["admitted"] += 1
+        stats["wait_ms"].append((time.monotonic() - waiter.queued_at) * 1000)
+
+    def _release(self, user_key: str, tier: str, elapsed: float) -> None:
+        self._running -= 1
+        self._release_user(user_key)
+        self._stats[tier]["completed"] += 1
+        self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        self._grant_next()
+
+    @asynccontextmanager
+    async def slot(self, user_key: str, tier: str, max_wait: Optional[float] = None):
+        """Väntar på en analysplats enligt prioritet; kastar AdmissionRejected vid överlast."""
+        await self._acquire(user_key, tier, max_wait)
+        self._stats[tier]["running"] += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._stats[tier]["running"] -= 1
+            self._release(user_key, tier, time.monotonic() - started)
+
+    def snapshot(self) -> Dict[str, Any]:
+        tiers = {}
+        for tier, stats in self._stats.items():
+            waits = sorted(stats["wait_ms"])
+
+            def percentile(p: float) -> float:
+                if not waits:
+                    return 0.0
+                return round(waits[min(int(p * len(waits)), len(waits) - 1)], 2)
+
+            tiers[tier] = {
+                **{key: value for key, value in stats.items() if key != "wait_ms"},
+                "queue_wait_ms": {"p50": percentile(0.50), "p95": percentile(0.95)},
+            }
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "per_user": self.per_user,
+            "max_wait_s": self.max_wait,
+            "running": self._running,
+            "queued": self._queued,
+            "estimated_service_s": round(self._service_time, 2),
+            "tiers": tiers,
+        }
+
+
+analysis_admission = AdmissionController(
+    max_concurrent=int(os.getenv("ANALYSIS_MAX_CONCURRENT", "4")),
+    max_queue=int(os.getenv("ANALYSIS_MAX_QUEUE", "32")),
+    per_user=int(os.getenv("ANALYSIS_MAX_PER_USER", "2")),
+    max_wait=float(os.getenv("ANALYSIS_MAX_QUEUE_WAIT_S", "60")),
+)
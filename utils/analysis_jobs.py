@@ -0,0 +1,332 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, or_, select, update
+
+from database import AnalysisJob, AnalysisJobItem, async_session_maker
+from models import Query
+from utils.admission import TIERS, AdmissionRejected, analysis_admission
+from utils.analysis_pipeline import run_analysis
+from utils.deadline import MIN_DEADLINE_SECONDS, deadline_for
+from utils.logging_utils import logger
+
+# Rader som inte är klara; running räknas bara om låset fortfarande gäller
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def job_status(counts: Dict[str, int]) -> str:
+    """Jobbets status härleds ur radernas status."""
+    total = sum(counts.values())
+    if counts.get("queued", 0) == total:
+        return "queued"
+    if counts.get("queued", 0) or counts.get("running", 0):
+        return "running"
+    return "done" if counts.get("done", 0) else "failed"
+
+
+class AnalysisJobWorker:
+    """
+    Workerpool för analysjobb. POST /analyses sparar jobbet och svarar
+    direkt; workers plockar rader i prioritetsordning och kör samma
+    pipeline som /get_suggestions, bakom samma antagningskontroll. Släpps
+    en rad inte in läggs den tillbaka i kön med fördröjning.
+
+    Jobben överlever omstarter: en rad som körs har ett lås som förnyas
+    medan analysen pågår. Vid en kontrollerad avstängning läggs raden
+    tillbaka i kön direkt; dör processen plockas raden upp igen när
+    låset löpt ut.
+    """
+
+    def __init__(self, concurrency: int = 2, poll_interval: float = 5.0,
+                 lease_seconds: float = 30.0, max_attempts: int = 3):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        # Long-polling väntar på dessa; ett event per jobb som någon väntar på
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._resumed = 0
+        self._deferred = 0
+
+    async def enqueue(self, owner: str, tier: str, query: str, urls: List[str],
+                      analysis_type: Optional[str] = None, is_competitor: bool = False,
+                      deadline_seconds: Optional[float] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        async with async_session_maker() as session:
+            session.add(AnalysisJob(
+                id=job_id, owner=owner, tier=tier, query=query, analysis_type=analysis_type,
+                is_competitor=is_competitor, deadline_seconds=deadline_seconds,
+                total=len(urls), created_at=now,
+            ))
+            session.add_all([
+                AnalysisJobItem(job_id=job_id, position=position, url=url,
+                                priority=TIERS.index(tier))
+                for position, url in enumerate(urls)
+            ])
+            await session.commit()
+        logger.info(f"✅ Analysjobb {job_id} köat med {len(urls)} URL:er ({tier})")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def pending_for(self, owner: str) -> int:
+        """Antal URL:er som ägaren har kvar i kön eller under körning."""
+        async with async_session_maker() as session:
+            return await session.scalar(
+                select(func.count())
+                .select_from(AnalysisJobItem)
+                .join(AnalysisJob, AnalysisJob.id == AnalysisJobItem.job_id)
+                .where(AnalysisJob.owner == owner, AnalysisJobItem.status.in_(ACTIVE_STATUSES))
+            )
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        async with async_session_maker() as session:
+            job = await session.get(AnalysisJob, job_id)
+            if job is None:
+                return None
+            items = (await session.scalars(
+                select(AnalysisJobItem)
+                .where(AnalysisJobItem.job_id == job_id)
+                .order_by(AnalysisJobItem.position)
+            )).all()
+
+        counts: Dict[str, int] = {}
+        for item in items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return {
+            "id": job.id,
+            "owner": job.owner,
+            "status": job_status(counts),
+            "total": job.total,
+            "counts": counts,
+            "created_at": job.created_at,
+            "items": [
+                {
+                    "position": item.position,
+                    "url": item.url,
+                    "status": item.status,
+                    "attempts": item.attempts,
+                    "result": item.result,
+                    "error": item.error,
+                    "started_at": item.started_at,
+                    "finished_at": item.finished_at,
+                }
+                for item in items
+            ],
+        }
+
+    async def wait_for_change(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Long-polling: returnerar jobbet när någon rad bytt status, när jobbet
+        är klart eller när timeout löpt ut. Databasen läses om minst var
+        poll_interval, så att ändringar från andra processer också syns.
+        """
+        loop = asyncio.get_running_loop()
+        wait_until = loop.time() + timeout
+        job = await self.get(job_id)
+        if job is None:
+            return None
+        initial = [item["status"] for item in job["items"]]
+        while job["status"] in ACTIVE_STATUSES:
+            remaining = wait_until - loop.time()
+            if remaining <= 0:
+                break
+            changed = self._changed.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(changed.wait(), min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+            job = await self.get(job_id)
+            if [item["status"] for item in job["items"]] != initial:
+                break
+        return job
+
+    def _notify(self, job_id: str) -> None:
+        changed = self._changed.pop(job_id, None)
+        if changed is not None:
+            changed.set()
+
+    async def _claim_next(self) -> Optional[Tuple[int, str, str, int]]:
+        """
+        Tar nästa rad (köad, eller körd med utgånget lås) genom en villkorad
+        update; misslyckas den hann en annan worker före och nästa prövas.
+        """
+        async with async_session_maker() as session:
+            while True:
+                now = datetime.utcnow()
+                claimable = or_(
+                    (AnalysisJobItem.status == "queued")
+                    & (AnalysisJobItem.not_before.is_(None) | (AnalysisJobItem.not_before <= now)),
+                    (AnalysisJobItem.status == "running") & (AnalysisJobItem.lease_until < now),
+                )
+                row = (await session.execute(
+                    select(AnalysisJobItem.id, AnalysisJobItem.job_id, AnalysisJobItem.url,
+                           AnalysisJobItem.status, AnalysisJobItem.attempts)
+                    .where(claimable)
+                    .order_by(AnalysisJobItem.priority, AnalysisJobItem.id)
+                    .limit(1)
+                )).first()
+                if row is None:
+                    return None
+
+                if row.attempts >= self.max_attempts:
+                    # Processen har dött mitt i den här raden för många gånger
+                    result = await session.execute(
+                        update(AnalysisJobItem)
+                        .where(AnalysisJobItem.id == row.id, claimable)
+                        .values(status="failed", lease_until=None, finished_at=now,
+                                error=f"Avbröts efter {row.attempts} försök")
+                    )
+                    await session.commit()
+                    if result.rowcount == 1:
+                        self._failed += 1
+                        self._notify(row.job_id)
+                    continue
+
+                result = await session.execute(
+                    update(AnalysisJobItem)
+                    .where(AnalysisJobItem.id == row.id, claimable)
+                    .values(status="running", attempts=AnalysisJobItem.attempts + 1,
+                            lease_until=now + timedelta(seconds=self.lease_seconds),
+                            not_before=None, started_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                await session.commit()
+                if result.rowcount == 1:
+                    if row.status == "running":
+                        self._resumed += 1
+                        logger.warning(f"⚠️ Återupptar analys {row.id} i jobb {row.job_id} (låset löpte ut)")
+                    self._notify(row.job_id)
+                    return row.id, row.job_id, row.url, row.attempts + 1
+
+    async def _heartbeat(self, item_id: int) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            async with async_session_maker() as session:
+                await session.execute(
+                    update(AnalysisJobItem)
+                    .where(AnalysisJobItem.id == item_id, AnalysisJobItem.status == "running")
+                    .values(lease_until=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+                )
+                await session.commit()
+
+    async def _finish(self, item_id: int, job_id: str, **values: Any) -> None:
+        async with async_session_maker() as session:
+            await session.execute(
+                update(AnalysisJobItem)
+                .where(AnalysisJobItem.id == item_id)
+                .values(lease_until=None, **values)
+            )
+            await session.commit()
+        self._notify(job_id)
+
+    async def _execute(self, item_id: int, job_id: str, url: str, attempts: int) -> None:
+        async with async_session_maker() as session:
+            job = await session.get(AnalysisJob, job_id)
+        query = Query(query=job.query, url=url, analysis_type=job.analysis_type,
+                      is_competitor=job.is_competitor, deadline_seconds=job.deadline_seconds)
+
+        logger.info(f"🔍 Kör analys {item_id} i jobb {job_id} (försök {attempts}): {url}")
+        self._running += 1
+        heartbeat = asyncio.create_task(self._heartbeat(item_id))
+        deadline = deadline_for(job.tier, job.deadline_seconds)
+        try:
+            # Samma kö som /get_suggestions: per-användargräns, plannivå och lastavvisning
+            async with analysis_admission.slot(
+                job.owner, job.tier, max_wait=max(deadline.remaining() - MIN_DEADLINE_SECONDS, 0.0)
+            ):
+                result = await run_analysis(query, deadline)
+        except AdmissionRejected as e:
+            # Inte ett misslyckat försök: tillbaka i kön tills retry_after passerat
+            self._deferred += 1
+            logger.info(f"Analys {item_id} i jobb {job_id} skjuts upp {e.retry_after}s ({e.reason})")
+            await self._finish(
+                item_id, job_id, status="queued", attempts=attempts - 1, started_at=None,
+                not_before=datetime.utcnow() + timedelta(seconds=e.retry_after),
+            )
+        except asyncio.CancelledError:
+            # Kontrollerad avstängning: tillbaka i kön utan att försöket räknas
+            await asyncio.shield(self._finish(
+                item_id, job_id, status="queued", attempts=attempts - 1, started_at=None
+            ))
+            raise
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            self._failed += 1
+            logger.error(f"❌ Analys {item_id} i jobb {job_id} misslyckades: {detail}")
+            await self._finish(item_id, job_id, status="failed", error=str(detail),
+                               finished_at=datetime.utcnow())
+        else:
+            self._completed += 1
+            await self._finish(item_id, job_id, status="done", result=result, error=None,
+                               finished_at=datetime.utcnow())
+        finally:
+            heartbeat.cancel()
+            self._running -= 1
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                claimed = await self._claim_next()
+            except Exception as e:
+                logger.error(f"❌ Analyskön kunde inte läsas: {e}", exc_info=True)
+                claimed = None
+            if claimed is not None:
+                await self._execute(*claimed)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # Köade rader från förra körningen plockas upp direkt
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def snapshot(self) -> Dict[str, Any]:
+        async with async_session_maker() as session:
+            rows = (await session.execute(
+                select(AnalysisJobItem.status, func.count()).group_by(AnalysisJobItem.status)
+            )).all()
+        return {
+            "items": {status: count for status, count in rows},
+            "workers": self.concurrency,
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "resumed": self._resumed,
+            "deferred": self._deferred,
+        }
+
+
+analysis_jobs = AnalysisJobWorker(
+    concurrency=int(os.getenv("ANALYSIS_JOB_CONCURRENCY", "2")),
+    poll_interval=float(os.getenv("ANALYSIS_JOB_POLL_INTERVAL_S", "5")),
+    lease_seconds=float(os.getenv("ANALYSIS_JOB_LEASE_S", "30")),
+    max_attempts=int(os.getenv("ANALYSIS_JOB_MAX_ATTEMPTS", "3")),
+)
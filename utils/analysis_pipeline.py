@@ -0,0 +1,531 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from fastapi import HTTPException
+
+from models import Query
+from utils.analysis_utils import (
+    complete_prompts,
+    extract_json,
+    generate_competitor_prompts,
+    generate_competitor_strengths_summary_prompt,
+    generate_design_prompt,
+    generate_prompts,
+    generate_recommendations_summary_prompt,
+    get_prompt_by_type,
+)
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.inflight import scrape_flights, visitor_flights
+from utils.logging_utils import logger
+from utils.near_duplicates import (
+    NEAR_DUPLICATE_ENABLED,
+    TemplateMatch,
+    near_duplicate_index,
+    page_signature,
+)
+from utils.page_audit import page_auditor
+from utils.prefetch import prefetcher
+from utils.visitor_utils import get_visitor_count
+from utils.web_scraper import scrape_dynamic_page
+
+SPECIALIZED_TYPES = ("landing_page", "product_page", "trust_check", "brand_analysis", "mobile_experience")
+# Specialiserade analyser som även får en designanalys
+DESIGN_SCORED_TYPES = ("landing_page", "product_page")
+
+SCRAPE_TIMEOUT_SECONDS = 30
+VISITOR_TIMEOUT_SECONDS = 10
+
+
+def _section_fallback() -> Dict[str, Any]:
+    return {"summary": "", "observations": [], "recommendations": ""}
+
+
+def _fingerprint(value: Any) -> str:
+    canonical = value if isinstance(value, str) else json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class PromptCache:
+    """
+    Svar från en tidigare körning av samma analys, nycklade på en hash av den
+    renderade prompten. Prompten byggs enbart av de extracted_data-fält den
+    använder (och URL:en), så hashen ändras bara när just de fälten ändras;
+    då skickas prompten, annars återanvänds det tidigare svaret.
+
+    `entries` är den här körningens svar (återanvända och nya) och sparas
+    till nästa körning. Misslyckade prompter sparas inte.
+    """
+
+    def __init__(self, previous: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.previous = previous or {}
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.fields: Dict[str, str] = {}
+        self.reused = 0
+        self.sent = 0
+        self.seconds_saved = 0.0
+
+    def observe(self, extracted_data: Dict[str, Any]) -> None:
+        """Fingeravtryck per extracted_data-fält, för att kunna redovisa vad som ändrats."""
+        self.fields = {field: _fingerprint(value) for field, value in extracted_data.items()}
+
+    def lookup(self, prompt: str) -> Tuple[str, Optional[str]]:
+        key = _fingerprint(prompt)
+        entry = self.previous.get(key)
+        if entry is None:
+            return key, None
+        self.reused += 1
+        self.seconds_saved += entry.get("seconds", 0.0)
+        self.entries[key] = entry
+        return key, entry["response"]
+
+    def store(self, key: str, response: str, seconds: float) -> None:
+        self.sent += 1
+        self.entries[key] = {"response": response, "seconds": round(seconds, 2)}
+
+
+class PipelineRun:
+    """
+    Tillstånd för en analyskörning: tidsbudget, mätningar och vilka
+    sektioner som inte blev klara i tid (eller alls).
+    """
+
+    def __init__(self, query: Query, deadline: Deadline, prompt_cache: Optional[PromptCache] = None,
+                 on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        self.query = query
+        self.on_event = on_event
+        self.deadline = deadline
+        self.prompt_cache = prompt_cache
+        # Nästan identisk, nyligen analyserad sida vars mallsvar kan återanvändas
+        self.template_match: Optional[TemplateMatch] = None
+        self.template_responses: Dict[str, str] = {}
+        self.reused_sections: List[str] = []
+        self.started_at = time.time()
+        self.metrics: Dict[str, float] = {}
+        self.missing: List[str] = []
+        # Fält som hunnit strömmas in per prompt, för prompter som inte blir klara
+        self.streamed: Dict[str, Dict[str, Any]] = {}
+        self.incomplete = 0
+        self.page_audit: Optional[Dict[str, Any]] = None
+
+    def emit(self, event: str, payload: Dict[str, Any]) -> None:
+        """Skickar ett delresultat till anroparen (t.ex. den strömmande routen) direkt."""
+        if self.on_event is not None:
+            self.on_event(event, payload)
+
+    def mark_missing(self, name: str) -> None:
+        if name not in self.missing:
+            self.missing.append(name)
+
+    async def timed(self, name: str, awaitable):
+        step_start = time.time()
+        try:
+            return await awaitable
+        finally:
+            self.metrics[name] = round(time.time() - step_start, 2)
+
+    def finish(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        total_time = time.time() - self.started_at
+        self.metrics["total_processing_time"] = round(total_time, 2)
+        self.metrics["deadline_seconds"] = round(self.deadline.budget, 2)
+        response["performance_metrics"] = self.metrics
+        if self.page_audit is not None:
+            response["page_audit"] = self.page_audit
+        response["partial"] = bool(self.missing) or self.incomplete > 0
+        response["missing_sections"] = self.missing
+        if self.incomplete:
+            response["incomplete_sections"] = self.incomplete
+        if self.reused_sections:
+            response["template_reuse"] = {
+                "url": self.template_match.url,
+                "similarity": self.template_match.similarity,
+                "sections": self.reused_sections,
+            }
+        if self.missing:
+            logger.warning(f"⏱️ Analys levererad delvis efter {total_time:.2f}s, saknas: {', '.join(self.missing)}")
+        return response
+
+
+async def scrape(url: str, deadline: Deadline) -> Dict[str, Any]:
+    """
+    Skrapar i en tråd så att event-loopen är fri; sidladdningen begränsas av
+    budgeten. Samtidiga skrapningar av samma URL delar på en körning, och en
+    färsk förhämtning (POST /prefetch) används direkt.
+    """
+    prefetched = prefetcher.take_scrape(url)
+    if prefetched is not None:
+        return prefetched
+    prefetcher.note_join(url)
+    page_timeout = deadline.timeout(SCRAPE_TIMEOUT_SECONDS)
+    return await deadline.run(scrape_flights.run(
+        url, lambda: asyncio.to_thread(scrape_dynamic_page, url, page_timeout)
+    ))
+
+
+async def lookup_visitors(domain: str, deadline: Deadline) -> Optional[str]:
+    """Besökaruppslag inom budgeten (delat per domän); None om det inte hann klart."""
+    prefetched = prefetcher.take_visitors(domain)
+    if prefetched is not None:
+        return prefetched
+    lookup_timeout = deadline.timeout(VISITOR_TIMEOUT_SECONDS)
+    try:
+        return await deadline.run(visitor_flights.run(
+            domain, lambda: asyncio.to_thread(get_visitor_count, domain, lookup_timeout)
+        ))
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        return None
+
+
+def parse_section(run: PipelineRun, name: str, raw: Optional[str]) -> Dict[str, Any]:
+    if raw is None:
+        run.mark_missing(name)
+        return _section_fallback()
+    try:
+        return json.loads(extract_json(raw))
+    except Exception as e:
+        logger.error(f"Fel vid tolkning av {name}: {e}")
+        return _section_fallback()
+
+
+def _loose_json(raw: str) -> str:
+    json_match = re.search(r'```json\s*(\{.*?\})\s*```', raw, re.DOTALL)
+    if json_match:
+        return json_match.group(1)
+    json_match = re.search(r'(\{.*?\})', raw, re.DOTALL)
+    if json_match:
+        return json_match.group(1)
+    raise ValueError("Ingen giltig JSON hittades")
+
+
+def parse_design(run: PipelineRun, raw: Optional[str], failure_comment: str,
+                 default_comment: Optional[str] = None, loose: bool = False) -> Dict[str, Any]:
+    fallback = {"usability": 0, "aesthetics": 0, "performance": 0, "comment": failure_comment}
+    if raw is None:
+        run.mark_missing("designScore")
+        return fallback
+    try:
+        design_score = json.loads(_loose_json(raw) if loose else extract_json(raw))
+        for key in ["usability", "aesthetics", "performance"]:
+            if key not in design_score:
+                design_score[key] = 0
+        if default_comment is not None and "comment" not in design_score:
+            design_score["comment"] = default_comment
+        return design_score
+    except Exception as e:
+        logger.error(f"Kunde inte tolka design score: {e}")
+        return fallback
+
+
+def parse_summary(run: PipelineRun, name: str, raw: Optional[str], keys: List[str],
+                  failure_key: str, failure_text: str, loose: bool = False) -> Dict[str, Any]:
+    fallback = {key: "" for key in keys}
+    fallback[failure_key] = failure_text
+    if raw is None:
+        run.mark_missing(name)
+        return fallback
+    try:
+        summary = json.loads(_loose_json(raw) if loose else extract_json(raw))
+        for key in keys:
+            if key not in summary:
+                summary[key] = ""
+        return summary
+    except Exception as e:
+        logger.error(f"Fel vid tolkning av {name}: {e}")
+        return fallback
+
+
+def _stream_into(run: PipelineRun, prompts: List[str]):
+    def on_partial(index: int, fields: Dict[str, Any]) -> None:
+        run.streamed[prompts[index]] = fields
+    return on_partial
+
+
+def _with_streamed(run: PipelineRun, prompts: List[str], responses: List[Optional[str]]) -> List[Optional[str]]:
+    """Prompter som inte blev klara ersätts med de fält som hann strömmas in."""
+    for index, prompt in enumerate(prompts):
+        if responses[index] is None and run.streamed.get(prompt):
+            responses[index] = json.dumps(run.streamed[prompt], ensure_ascii=False)
+            run.incomplete += 1
+    return responses
+
+
+async def _timed_prompt(run: PipelineRun, key: str, prompt: str, kind: str) -> Optional[str]:
+    prompt_start = time.time()
+    response = (await complete_prompts([prompt], run.deadline, kind, _stream_into(run, [prompt])))[0]
+    if response is not None:
+        run.prompt_cache.store(key, response, time.time() - prompt_start)
+    return response
+
+
+async def _prompts(run: PipelineRun, prompts: List[str], kind: str) -> List[Optional[str]]:
+    if run.prompt_cache is None:
+        if run.deadline.expired:
+            return [None] * len(prompts)
+        responses = await complete_prompts(prompts, run.deadline, kind, _stream_into(run, prompts))
+        return _with_streamed(run, prompts, responses)
+
+    # Bara prompter vars indata ändrats sedan förra körningen skickas
+    responses: List[Optional[str]] = []
+    pending = []
+    for index, prompt in enumerate(prompts):
+        key, cached = run.prompt_cache.lookup(prompt)
+        responses.append(cached)
+        if cached is None:
+            pending.append((index, key, prompt))
+    if pending and not run.deadline.expired:
+        sent = await asyncio.gather(*(_timed_prompt(run, key, prompt, kind) for _, key, prompt in pending))
+        for (index, _, _), response in zip(pending, sent):
+            responses[index] = response
+    return _with_streamed(run, prompts, responses)
+
+
+async def _sections_and_design(run: PipelineRun, section_prompts: List[str], design_prompt: Optional[str],
+                               ux_slot: Optional[str] = None) -> Tuple[List[Optional[str]], Optional[str]]:
+    """
+    Sektionsprompterna och designprompten är oberoende och körs samtidigt.
+
+    Finns en nästan identisk sida (run.template_match) återanvänds dess
+    UX-svar (sektion 1, nycklat på ux_slot) och designsvar; bara prompterna
+    för det som skiljer sidorna åt skickas.
+    """
+    reusable = run.template_match.responses if run.template_match is not None else {}
+    reused_ux = reusable.get(ux_slot) if ux_slot else None
+    reused_design = reusable.get("design") if design_prompt is not None else None
+
+    to_send = [prompt for index, prompt in enumerate(section_prompts)
+               if not (index == 1 and reused_ux is not None)]
+    if design_prompt is None or reused_design is not None:
+        sections = await run.timed("openai_analysis_time", _prompts(run, to_send, "section"))
+        design = reused_design
+    else:
+        sections, designs = await asyncio.gather(
+            run.timed("openai_analysis_time", _prompts(run, to_send, "section")),
+            run.timed("design_analysis_time", _prompts(run, [design_prompt], "design")),
+        )
+        design = designs[0]
+
+    if reused_ux is not None:
+        sections.insert(1, reused_ux)
+        run.reused_sections.append("ux_analysis")
+    elif ux_slot and sections[1] is not None:
+        run.template_responses[ux_slot] = sections[1]
+    if reused_design is not None:
+        run.reused_sections.append("designScore")
+    elif design is not None:
+        run.template_responses["design"] = design
+    return sections, design
+
+
+async def _visitors(run: PipelineRun, task: "asyncio.Task") -> str:
+    visitor_start = time.time()
+    try:
+        visitors = await task
+    finally:
+        run.metrics["visitor_lookup_time"] = round(time.time() - visitor_start, 2)
+    if visitors is None:
+        run.mark_missing("visitors_per_month")
+        return "N/A"
+    return visitors
+
+
+async def _competitor(run: PipelineRun, data: Optional[Dict[str, Any]], visitors_task) -> Dict[str, Any]:
+    url = run.query.url
+    if data is not None:
+        logger.info("Genererar promptar för konkurrentanalys")
+        section_prompts = list(generate_competitor_prompts(data, url, run.page_audit))
+        raw_sections, raw_design = await _sections_and_design(
+            run, section_prompts, generate_design_prompt(data, url), ux_slot="ux:competitor"
+        )
+    else:
+        raw_sections, raw_design = [None, None, None], None
+
+    seo_data = parse_section(run, "seo_analysis", raw_sections[0])
+    ux_data = parse_section(run, "ux_analysis", raw_sections[1])
+    content_data = parse_section(run, "content_analysis", raw_sections[2])
+    design_score = parse_design(run, raw_design, "Kunde inte tolka designanalys.")
+
+    raw_strengths = None
+    if any(raw is not None for raw in raw_sections):
+        logger.info("Genererar sammanfattning av konkurrentens styrkor")
+        strengths_prompt = generate_competitor_strengths_summary_prompt(
+            *(raw or "" for raw in raw_sections)
+        )
+        raw_strengths = (await run.timed("strengths_summary_time", _prompts(run, [strengths_prompt], "summary")))[0]
+    strengths_summary = parse_summary(
+        run, "strengths_summary", raw_strengths,
+        ["seo_strengths", "ux_strengths", "content_strengths", "overall_strengths"],
+        "overall_strengths", "Kunde inte sammanfatta styrkor.",
+    )
+
+    return {
+        "seo_analysis": seo_data,
+        "ux_analysis": ux_data,
+        "content_analysis": content_data,
+        "designScore": design_score,
+        "strengths_summary": strengths_summary,
+        "visitors_per_month": await _visitors(run, visitors_task),
+        "is_competitor": True,
+    }
+
+
+async def _specialized(run: PipelineRun, data: Optional[Dict[str, Any]], visitors_task) -> Dict[str, Any]:
+    url = run.query.url
+    analysis_type = run.query.analysis_type
+    raw_specialized, raw_design = None, None
+    if data is not None:
+        logger.info(f"Genererar prompt för analystyp: {analysis_type}")
+        design_prompt = (
+            generate_design_prompt(data, url) if analysis_type in DESIGN_SCORED_TYPES else None
+        )
+        raw_sections, raw_design = await _sections_and_design(
+            run, [get_prompt_by_type(analysis_type, data, url, run.page_audit)], design_prompt
+        )
+        raw_specialized = raw_sections[0]
+
+    if raw_specialized is None:
+        run.mark_missing("specialized_analysis")
+        specialized_analysis: Dict[str, Any] = {}
+    else:
+        # Ett svar som inte går att tolka är ett fel, inte en tidsfråga
+        try:
+            specialized_analysis = json.loads(extract_json(raw_specialized))
+        except Exception as e:
+            logger.error("Fel vid tolkning av AI-svaret: %s", str(e))
+            raise HTTPException(status_code=500, detail=f"Kunde inte tolka AI-svaret: {str(e)}")
+
+    response = {
+        "analysis_type": analysis_type,
+        "specialized_analysis": specialized_analysis,
+        "designScore": {
+            "usability": 0.5,  # Defaultvärden om ingen design score beräknas
+            "aesthetics": 0.5,
+            "performance": 0.5
+        },
+    }
+    if analysis_type in DESIGN_SCORED_TYPES:
+        if raw_design is None:
+            run.mark_missing("designScore")
+        else:
+            try:
+                response["designScore"] = json.loads(extract_json(raw_design))
+            except Exception as e:
+                logger.error("Fel vid tolkning av design score: %s", str(e))
+
+    response["visitors_per_month"] = await _visitors(run, visitors_task)
+    return response
+
+
+async def _standard(run: PipelineRun, data: Optional[Dict[str, Any]], visitors_task) -> Dict[str, Any]:
+    url = run.query.url
+    if data is not None:
+        logger.info("Genererar standardpromptar för SEO, UX och innehållsanalys")
+        section_prompts = list(generate_prompts(data, url, run.page_audit))
+        raw_sections, raw_design = await _sections_and_design(
+            run, section_prompts, generate_design_prompt(data, url), ux_slot="ux:standard"
+        )
+    else:
+        raw_sections, raw_design = [None, None, None], None
+
+    json_parse_start = time.time()
+    seo_data = parse_section(run, "seo_analysis", raw_sections[0])
+    ux_data = parse_section(run, "ux_analysis", raw_sections[1])
+    content_data = parse_section(run, "content_analysis", raw_sections[2])
+    run.metrics["json_parse_time"] = round(time.time() - json_parse_start, 2)
+    design_score = parse_design(
+        run, raw_design, "GPT svarade inte med giltigt JSON.", "Ingen kommentar från GPT.", loose=True
+    )
+
+    raw_summary = None
+    if any(raw is not None for raw in raw_sections):
+        logger.info("Genererar rekommendationssammanfattning")
+        summary_prompt = generate_recommendations_summary_prompt(
+            *(raw or "" for raw in raw_sections)
+        )
+        raw_summary = (await run.timed("recommendations_time", _prompts(run, [summary_prompt], "summary")))[0]
+    recommendations_summary = parse_summary(
+        run, "recommendations_summary", raw_summary,
+        ["seo_recommendations", "ux_recommendations", "content_recommendations", "overall_summary"],
+        "overall_summary", "Inga rekommendationer kunde genereras.", loose=True,
+    )
+
+    return {
+        "seo_analysis": seo_data,
+        "ux_analysis": ux_data,
+        "content_analysis": content_data,
+        "designScore": design_score,
+        "recommendations_summary": recommendations_summary,
+        "visitors_per_month": await _visitors(run, visitors_task),
+    }
+
+
+async def run_analysis(query: Query, deadline: Deadline,
+                       prompt_cache: Optional[PromptCache] = None,
+                       on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Kör hela analysen (scrape, promptrundor, besökaruppslag) inom tidsbudgeten.
+
+    Det som hinner klart returneras; sektioner som inte hann klart får
+    tomma standardvärden och listas i missing_sections. Besökaruppslaget
+    körs parallellt med skrapningen eftersom det bara behöver domänen.
+    Med prompt_cache återanvänds svar på prompter som inte ändrats.
+    Den regelbaserade granskningen körs direkt efter skrapningen och skickas
+    som händelsen "page_audit" till on_event innan några prompter körts.
+    """
+    run = PipelineRun(query, deadline, prompt_cache, on_event)
+    domain_only = urlparse(query.url).netloc
+    visitors_task = asyncio.create_task(lookup_visitors(domain_only, deadline))
+
+    logger.info("🔍 BACKEND: börjar scrape och analys")
+    data: Optional[Dict[str, Any]] = None
+    try:
+        data = await run.timed("scrape_time", scrape(query.url, deadline))
+        logger.info(f"✅ BACKEND: scraping klar på {run.metrics['scrape_time']:.2f}s")
+        if prompt_cache is not None:
+            prompt_cache.observe(data)
+        run.page_audit = page_auditor.audit(data, query.url)
+        run.emit("page_audit", run.page_audit)
+    except DeadlineExceeded:
+        logger.warning(f"⏱️ Tidsbudgeten tog slut under skrapningen av {query.url}")
+        run.mark_missing("extracted_data")
+    except BaseException:
+        visitors_task.cancel()
+        raise
+
+    # Bevakningar kräver exakt ändringsdetektering och använder inte mallindexet
+    signature: Optional[int] = None
+    if NEAR_DUPLICATE_ENABLED and data is not None and prompt_cache is None:
+        try:
+            signature = page_signature(data)
+            run.template_match = await near_duplicate_index.lookup(domain_only, signature)
+        except Exception as e:
+            logger.error(f"❌ Uppslag av liknande sidor misslyckades: {e}")
+        if run.template_match is not None:
+            logger.info(f"♻️ {query.url} liknar {run.template_match.url} "
+                        f"({run.template_match.similarity:.0%}); mallsvar återanvänds")
+
+    try:
+        if query.is_competitor:
+            response = await _competitor(run, data, visitors_task)
+        elif query.analysis_type and query.analysis_type in SPECIALIZED_TYPES:
+            response = await _specialized(run, data, visitors_task)
+        else:
+            response = await _standard(run, data, visitors_task)
+    finally:
+        if not visitors_task.done():
+            visitors_task.cancel()
+
+    # Nya mallsvar från kompletta analyser blir återanvändbara för liknande sidor;
+    # saknade träffen ett svar (t.ex. UX för konkurrentanalys) sparas de sammanslagna
+    if signature is not None and run.template_responses and not run.missing and not run.incomplete:
+        previous = run.template_match.responses if run.template_match is not None else {}
+        if set(run.template_responses) - set(previous):
+            await near_duplicate_index.record(
+                domain_only, query.url, signature, {**previous, **run.template_responses}
+            )
+
+    logger.info(f"🎉 Analys slutförd på totalt {time.time() - run.started_at:.2f}s")
+    return run.finish(response)
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+from httpx import AsyncClient, HTTPStatusError, Limits, TransportError
+
+from utils.logging_utils import logger
+
+
+class ManagementAPIError(Exception):
+    """Anrop mot Auth0 Management API misslyckades; retryable avgör om det är värt att försöka igen."""
+
+    def __init__(self, message: str, retryable: bool, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def _retry_after(response) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Auth0ManagementClient:
+    """
+    Klient mot Auth0 Management API med en delad anslutningspool och cachad
+    access token.
+
+    Token hämtas med client credentials (AUTH0_MGMT_CLIENT_ID/SECRET) och
+    återanvänds tills strax innan den går ut; saknas de används den statiska
+    AUTH0_API_TOKEN som tidigare.
+    """
+
+    def __init__(self, domain: Optional[str], client_id: Optional[str] = None,
+                 client_secret: Optional[str] = None, static_token: Optional[str] = None,
+                 timeout: float = 10.0):
+        self.domain = domain
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.static_token = static_token
+        self.timeout = timeout
+        self._client: Optional[AsyncClient] = None
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self.token_fetches = 0
+
+    @property
+    def client(self) -> AsyncClient:
+        if self._client is None:
+            self._client = AsyncClient(
+                base_url=f"https://{self.domain}",
+                timeout=self.timeout,
+                limits=Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _invalidate_token(self) -> None:
+        self._token = None
+        self._token_expires_at = 0.0
+
+    async def _access_token(self) -> str:
+        if not (self.client_id and self.client_secret):
+            if not self.static_token:
+                raise ManagementAPIError("Varken AUTH0_MGMT_CLIENT_ID/SECRET eller AUTH0_API_TOKEN är satt", False)
+            return self.static_token
+
+        if self._token and time.time() < self._token_expires_at:
+            return self._token
+        async with self._token_lock:
+            # En annan request kan ha hämtat token medan vi väntade på låset
+            if self._token and time.time() < self._token_expires_at:
+                return self._token
+            try:
+                response = await self.client.post("/oauth/token", json={
+                    "grant_type": "client_credentials",
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                    "audience": f"https://{self.domain}/api/v2/",
+                })
+            except TransportError as e:
+                raise ManagementAPIError(f"Kunde inte hämta Management API-token: {e}", True)
+            if response.status_code != 200:
+                raise ManagementAPIError(
+                    f"Tokenhämtning svarade {response.status_code}",
+                    response.status_code == 429 or response.status_code >= 500,
+                    _retry_after(response),
+                )
+            body = response.json()
+            self._token = body["access_token"]
+            # Förnya en minut innan Auth0 själv låter token gå ut
+            self._token_expires_at = time.time() + max(float(body.get("expires_in", 86400)) - 60, 0)
+            self.token_fetches += 1
+            logger.info("✅ Ny Auth0 Management API-token hämtad")
+            return self._token
+
+    async def _request(self, method: str, path: str, json: Dict[str, Any]) -> None:
+        for attempt in range(2):
+            token = await self._access_token()
+            try:
+                response = await self.client.request(
+                    method, path, json=json, headers={"Authorization": f"Bearer {token}"}
+                )
+            except TransportError as e:
+                raise ManagementAPIError(f"Nätverksfel mot Auth0: {e}", True)
+            if response.status_code == 401 and attempt == 0 and token != self.static_token:
+                # Token kan ha återkallats; hämta en ny och försök en gång till
+                self._invalidate_token()
+                continue
+            try:
+                response.raise_for_status()
+            except HTTPStatusError:
+                status = response.status_code
+                raise ManagementAPIError(
+                    f"Auth0 svarade {status} på {method} {path}",
+                    status == 429 or status >= 500,
+                    _retry_after(response),
+                )
+            return
+
+    async def update_user_plan(self, user_id: str, plan: str) -> None:
+        """Sätter app_metadata.plan för användaren."""
+        await self._request("PATCH", f"/api/v2/users/{user_id}", {"app_metadata": {"plan": plan}})
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "token_source": "client_credentials" if self.client_id and self.client_secret else "static",
+            "token_valid_for_s": round(max(self._token_expires_at - time.time(), 0), 0) if self._token else None,
+            "token_fetches": self.token_fetches,
+        }
+
+
+auth0_management = Auth0ManagementClient(
+    domain=os.getenv("AUTH0_DOMAIN"),
+    client_id=os.getenv("AUTH0_MGMT_CLIENT_ID"),
+    client_secret=os.getenv("AUTH0_MGMT_CLIENT_SECRET"),
+    static_token=os.getenv("AUTH0_API_TOKEN"),
+)
@@ -0,0 +1,140 @@
+"""
+Kompakterar befintliga rapporter: flyttar results-JSON från report-tabellen
+till komprimerade, innehållsadresserade blobbar och rapporterar hur mycket
+utrymme som frigjorts.
+
+Körs som:
+    python -m utils.compact_reports [--batch-size 200] [--dry-run] [--vacuum]
+"""
+import argparse
+import json
+import os
+from typing import Dict, Set
+
+from sqlalchemy import select, update
+from sqlmodel import SQLModel
+
+from database import engine, is_sqlite, Report, ResultBlob, insert_result_blob
+from utils.logging_utils import configure_logging, logger
+from utils.result_codec import encode_results
+
+
+def _database_file_size() -> int:
+    path = engine.url.database
+    if not is_sqlite or not path or not os.path.exists(path):
+        return 0
+    # WAL-filen innehåller skrivningar som ännu inte checkpointats
+    return sum(
+        os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p)
+    )
+
+
+def compact_reports(batch_size: int = 200, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Flyttar alla rader som fortfarande har results inline till ResultBlob.
+    Varje batch körs i en egen transaktion så att jobbet kan avbrytas och
+    återupptas. Returnerar statistik över antal rader och bytes.
+    """
+    SQLModel.metadata.create_all(engine)
+    stats = {
+        "reports": 0,
+        "json_bytes": 0,
+        "blobs_written": 0,
+        "blob_bytes": 0,
+        "deduplicated": 0,
+    }
+    seen: Set[str] = set()
+    last_id = 0
+
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(Report.id, Report.results)
+                .where(
+                    Report.id > last_id,
+                    Report.results_digest.is_(None),
+                    Report.results.is_not(None),
+                )
+                .order_by(Report.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            for report_id, results in rows:
+                last_id = report_id
+                if not results:
+                    continue
+                fields = encode_results(results)
+                stats["reports"] += 1
+                stats["json_bytes"] += len(json.dumps(results).encode("utf-8"))
+
+                if dry_run:
+                    is_new = fields["digest"] not in seen and connection.execute(
+                        select(ResultBlob.digest).where(ResultBlob.digest == fields["digest"])
+                    ).first() is None
+                    seen.add(fields["digest"])
+                else:
+                    is_new = insert_result_blob(connection, fields)
+                    connection.execute(
+                        update(Report)
+                        .where(Report.id == report_id)
+                        .values(results_digest=fields["digest"], results=None)
+                    )
+
+                if is_new:
+                    stats["blobs_written"] += 1
+                    stats["blob_bytes"] += fields["stored_size"]
+                else:
+                    stats["deduplicated"] += 1
+
+            if dry_run:
+                connection.rollback()
+
+        logger.info(f"Kompakterat {stats['reports']} rapporter hittills (senaste id {last_id})")
+
+    return stats
+
+
+def vacuum() -> None:
+    """Återlämnar frigjorda sidor till filsystemet (endast SQLite)."""
+    if not is_sqlite:
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection.exec_driver_sql("VACUUM")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Kompaktera rapportresultat till blobbar")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="Räkna bara, skriv inget")
+    parser.add_argument("--vacuum", action="store_true", help="Kör VACUUM efteråt (SQLite)")
+    args = parser.parse_args()
+
+    configure_logging()
+    size_before = _database_file_size()
+    stats = compact_reports(batch_size=args.batch_size, dry_run=args.dry_run)
+    if args.vacuum and not args.dry_run:
+        vacuum()
+    size_after = _database_file_size()
+
+    saved = stats["json_bytes"] - stats["blob_bytes"]
+    ratio = stats["blob_bytes"] / stats["json_bytes"] if stats["json_bytes"] else 0
+    logger.info(
+        f"✅ {'Torrkörning: ' if args.dry_run else ''}{stats['reports']} rapporter, "
+        f"{stats['blobs_written']} nya blobbar, {stats['deduplicated']} dubbletter"
+    )
+    logger.info(
+        f"JSON {stats['json_bytes']} B -> blobbar {stats['blob_bytes']} B "
+        f"(kvot {ratio:.2f}, {saved} B sparade)"
+    )
+    if size_before:
+        logger.info(
+            f"Databasfil {size_before} B -> {size_after} B "
+            f"({size_before - size_after} B återvunna)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from fastapi import HTTPException
+
+from models import Query
+from utils.admission import AdmissionRejected, analysis_admission
+from utils.analysis_pipeline import run_analysis
+from utils.deadline import MIN_DEADLINE_SECONDS, Deadline
+from utils.logging_utils import logger
+
+# Antal sajter som analyseras samtidigt i en jämförelse
+COMPARE_MAX_PARALLEL = int(os.getenv("COMPARE_MAX_PARALLEL", "4"))
+DESIGN_METRICS = ("usability", "aesthetics", "performance")
+
+
+def _score(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def _normalized(url: str) -> str:
+    parsed = urlparse(url.strip())
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(),
+                           path=parsed.path.rstrip("/") or "/").geturl()
+
+
+def unique_urls(urls: List[str]) -> List[str]:
+    """Tar bort dubbletter (samma URL med annan skiftläge/snedstreck) och behåller ordningen."""
+    seen = set()
+    unique = []
+    for url in urls:
+        key = _normalized(url)
+        if key not in seen:
+            seen.add(key)
+            unique.append(url)
+    return unique
+
+
+def build_matrix(urls: List[str], results: Dict[str, Dict[str, Any]],
+                 errors: Dict[str, str]) -> Dict[str, Any]:
+    """Sammanställer designpoäng, rangordning och styrkor per sajt; urls[0] är primär."""
+    primary_url = urls[0]
+    sites = []
+    matrix: Dict[str, Dict[str, Optional[float]]] = {metric: {} for metric in DESIGN_METRICS}
+    for url in urls:
+        result = results.get(url)
+        design_score = (result or {}).get("designScore") or {}
+        scores = {metric: _score(design_score.get(metric)) for metric in DESIGN_METRICS}
+        for metric, value in scores.items():
+            matrix[metric][url] = value
+        sites.append({
+            "url": url,
+            "role": "primary" if url == primary_url else "competitor",
+            "scores": scores,
+            "visitors_per_month": (result or {}).get("visitors_per_month", "N/A"),
+            "partial": bool((result or {}).get("partial")) or result is None,
+            "missing_sections": (result or {}).get("missing_sections", []),
+            "error": errors.get(url),
+        })
+
+    rankings = {
+        metric: [url for url, value in sorted(
+            ((url, value) for url, value in values.items() if value is not None),
+            key=lambda item: item[1], reverse=True,
+        )]
+        for metric, values in matrix.items()
+    }
+    strengths = {
+        url: result.get("strengths_summary")
+        for url, result in results.items()
+        if url != primary_url and result.get("strengths_summary") is not None
+    }
+    primary = results.get(primary_url) or {}
+    return {
+        "primary": primary_url,
+        "sites": sites,
+        "matrix": matrix,
+        "rankings": rankings,
+        "competitor_strengths": strengths,
+        "primary_recommendations": primary.get("recommendations_summary"),
+    }
+
+
+async def run_comparison(query: str, primary_url: str, competitor_urls: List[str],
+                         deadline: Deadline, user_key: str, tier: str,
+                         max_parallel: int = COMPARE_MAX_PARALLEL) -> Dict[str, Any]:
+    """
+    Analyserar primär-URL:en (standardanalys) och konkurrenterna
+    (konkurrentanalys) samtidigt under en gemensam tidsbudget. Dubbletter
+    analyseras en gång och besökaruppslag delas per domän, så totaltiden
+    blir nära den långsammaste sajtens i stället för summan.
+
+    Varje sajt tar en egen plats i analyskön under användarens nyckel och
+    nivå, så en jämförelse räknas som lika många analyser som den startar.
+    Parallelliteten hålls inom per-användargränsen; avvisas en sajt ändå
+    (överlast, undanträngd) avbryts resten och AdmissionRejected kastas.
+    """
+    compare_start = time.time()
+    competitors = [url for url in unique_urls([primary_url, *competitor_urls]) if url != primary_url]
+    semaphore = asyncio.Semaphore(max(min(max_parallel, analysis_admission.per_user), 1))
+    site_times: Dict[str, float] = {}
+    rejected: List[AdmissionRejected] = []
+    tasks: List[asyncio.Future] = []
+
+    async def analyse(url: str, is_competitor: bool) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                async with analysis_admission.slot(
+                    user_key, tier, max_wait=max(deadline.remaining() - MIN_DEADLINE_SECONDS, 0.0)
+                ):
+                    site_start = time.time()
+                    try:
+                        return await run_analysis(
+                            Query(query=query, url=url, is_competitor=is_competitor), deadline
+                        )
+                    finally:
+                        site_times[url] = round(time.time() - site_start, 2)
+            except AdmissionRejected as e:
+                if not rejected:
+                    rejected.append(e)
+                    for task in tasks:
+                        if task is not asyncio.current_task():
+                            task.cancel()
+                raise
+
+    urls = [primary_url, *competitors]
+    tasks.extend(asyncio.ensure_future(analyse(url, url != primary_url)) for url in urls)
+    outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+    if rejected:
+        raise rejected[0]
+    results: Dict[str, Dict[str, Any]] = {}
+    errors: Dict[str, str] = {}
+    for url, outcome in zip(urls, outcomes):
+        if isinstance(outcome, HTTPException):
+            errors[url] = str(outcome.detail)
+        elif isinstance(outcome, Exception):
+            logger.error(f"❌ Jämförelse: analysen av {url} misslyckades: {outcome}")
+            errors[url] = str(outcome)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            results[url] = outcome
+
+    response = build_matrix(urls, results, errors)
+    response["analyses"] = results
+    total_time = time.time() - compare_start
+    domains = {urlparse(url).netloc.lower() for url in urls}
+    response["performance_metrics"] = {
+        "total_processing_time": round(total_time, 2),
+        "slowest_site_time": max(site_times.values(), default=0.0),
+        "sum_of_site_times": round(sum(site_times.values()), 2),
+        "site_times": site_times,
+        "duplicate_urls_skipped": len(competitor_urls) + 1 - len(urls),
+        "shared_visitor_lookups": len(urls) - len(domains),
+        "deadline_seconds": round(deadline.budget, 2),
+    }
+    logger.info(
+        f"🎉 Jämförelse av {len(urls)} sajter klar på {total_time:.2f}s "
+        f"(summa per sajt {response['performance_metrics']['sum_of_site_times']:.2f}s)"
+    )
+    return response
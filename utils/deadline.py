@@ -0,0 +1,70 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+# Tak för en analys tidsbudget per prioritetsnivå (se utils.admission.TIERS);
+# klienten kan begära kortare men aldrig längre budget än sin nivås tak
+DEADLINE_CAPS: Dict[str, float] = {
+    "priority": float(os.getenv("DEADLINE_CAP_PRIORITY_S", "180")),
+    "standard": float(os.getenv("DEADLINE_CAP_STANDARD_S", "120")),
+    "free": float(os.getenv("DEADLINE_CAP_FREE_S", "60")),
+}
+# Under detta är det ingen idé att börja: scrape + en promptrunda hinns inte
+MIN_DEADLINE_SECONDS = 5.0
+
+
+class DeadlineExceeded(Exception):
+    """Requestens tidsbudget tog slut innan steget blev klart."""
+
+
+class Deadline:
+    """
+    Tidsbudget för en request som skickas vidare till varje steg. Stegen
+    använder timeout(cap) som sin egen timeout, så att inget steg väntar
+    längre än vad som finns kvar av budgeten.
+    """
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Återstående tid, högst cap sekunder."""
+        remaining = self.remaining()
+        return min(cap, remaining) if cap is not None else remaining
+
+    async def run(self, awaitable: Awaitable[Any], cap: Optional[float] = None) -> Any:
+        """
+        Väntar på awaitable inom budgeten. Avbryter den och kastar
+        DeadlineExceeded när budgeten tar slut; når den bara cap kastas
+        asyncio.TimeoutError som vanligt.
+        """
+        timeout = self.timeout(cap)
+        if timeout <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded("Tidsbudgeten är slut")
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            if self.expired:
+                raise DeadlineExceeded("Tidsbudgeten är slut")
+            raise
+
+
+def deadline_for(tier: str, requested: Optional[float] = None) -> Deadline:
+    cap = DEADLINE_CAPS.get(tier, DEADLINE_CAPS["free"])
+    seconds = cap if requested is None else min(max(requested, MIN_DEADLINE_SECONDS), cap)
+    return Deadline(seconds)
@@ -0,0 +1,169 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.logging_utils import logger
+
+# Nyckelordsvikter för calculate_design_score. Termerna tillämpas i listordning
+# (samma ordning som flyttalssummorna alltid gjorts i) så att resultaten är
+# identiska mellan versioner av koden; ändrade vikter kräver ny version.
+DEFAULT_KEYWORD_WEIGHTS: Dict[str, Any] = {
+    "version": 1,
+    "min": 0.05,
+    "max": 0.95,
+    "multiplier": {
+        "name": "first_impression", "base": 0.5, "min": 0.2, "max": 0.8,
+        "terms": [
+            *[[phrase, 0.2] for phrase in (
+                "stilren", "modern design", "professionell känsla", "attraktiv", "tilltalande", "ren layout",
+                "estetiskt behaglig", "harmonisk", "snygg", "inbjudande", "välkomnande", "imponerande",
+            )],
+            *[[phrase, -0.3] for phrase in (
+                "föråldrad", "rörig", "amatörmässig", "skräpig", "kaotisk", "ful design", "tråkig", "förvirrande",
+                "ostrukturerad", "skräckexempel", "brist på stil",
+            )],
+        ],
+    },
+    "metrics": {
+        "usability": {"base": 0.5, "terms": [
+            ["lätt att navigera", 0.15], ["intuitiv", 0.15], ["logisk layout", 0.15], ["användarvänlig", 0.15],
+            ["förvirrande", -0.2], ["dålig navigation", -0.2], ["rörigt gränssnitt", -0.2],
+        ]},
+        "aesthetics": {"base": 0.5, "terms": [
+            ["välstrukturerad design", 0.15], ["attraktiv layout", 0.15], ["harmonisk färgsättning", 0.15],
+            ["rörig design", -0.2], ["svår att läsa", -0.2], ["kaotisk struktur", -0.2],
+        ]},
+        "performance": {"base": 0.5, "terms": [
+            ["snabb laddningstid", 0.15], ["optimerad", 0.15], ["responsiv design", 0.15],
+            ["långsam laddning", -0.2], ["seg", -0.2], ["icke-responsiv design", -0.2],
+        ]},
+    },
+}
+
+Terms = Tuple[Tuple[int, float], ...]
+
+
+class KeywordScorer:
+    """
+    Förkompilerad nyckelordspoängsättning.
+
+    Fraserna dedupliceras och söks i längdordning. En fras som innehåller en
+    kortare fras (t.ex. "rörig design" och "rörig") söks bara om den kortare
+    hittats, så frånvarande ord stryker hela sin grupp. Vikterna kompileras
+    till (frasindex, delta)-tupler per mått.
+    """
+
+    def __init__(self, weights: Dict[str, Any]):
+        self.version = weights["version"]
+        self.low, self.high = weights["min"], weights["max"]
+        phrases: List[str] = []
+        index: Dict[str, int] = {}
+
+        def compile_terms(terms: Sequence[Sequence[Any]]) -> Terms:
+            compiled = []
+            for phrase, delta in terms:
+                phrase = phrase.lower()
+                if phrase not in index:
+                    index[phrase] = len(phrases)
+                    phrases.append(phrase)
+                compiled.append((index[phrase], float(delta)))
+            return tuple(compiled)
+
+        multiplier = weights["multiplier"]
+        self.multiplier_name = multiplier["name"]
+        self.multiplier = (multiplier["base"], multiplier["min"], multiplier["max"],
+                           compile_terms(multiplier["terms"]))
+        self.metrics: Dict[str, Tuple[float, Terms]] = {
+            name: (metric["base"], compile_terms(metric["terms"]))
+            for name, metric in weights["metrics"].items()
+        }
+        self.phrases = phrases
+
+        # Sökordning: korta fraser först; längre fraser kräver sin längsta delfras
+        order = sorted(range(len(phrases)), key=lambda i: len(phrases[i]))
+        self._scan: List[Tuple[int, str, Optional[int]]] = []
+        for position, i in enumerate(order):
+            contained = [j for j in order[:position] if phrases[j] in phrases[i]]
+            required = max(contained, key=lambda j: len(phrases[j])) if contained else None
+            self._scan.append((i, phrases[i], required))
+
+    def matches(self, text: str) -> List[bool]:
+        """Vilka fraser som förekommer i (den redan gemena) texten, per frasindex."""
+        present = [False] * len(self.phrases)
+        for i, phrase, required in self._scan:
+            if required is None or present[required]:
+                present[i] = phrase in text
+        return present
+
+    def _from_matches(self, present: List[bool]) -> Dict[str, float]:
+        base, low, high, terms = self.multiplier
+        multiplier = base
+        for i, delta in terms:
+            if present[i]:
+                multiplier += delta
+        multiplier = min(max(multiplier, low), high)
+
+        scores = {}
+        for name, (value, metric_terms) in self.metrics.items():
+            for i, delta in metric_terms:
+                if present[i]:
+                    value += delta
+            value *= multiplier
+            scores[name] = round(min(max(value, self.low), self.high), 2)
+        scores[self.multiplier_name] = round(multiplier, 2)
+        return scores
+
+    def score_text(self, text: str) -> Dict[str, float]:
+        return self._from_matches(self.matches(text.lower()))
+
+    def score(self, analysis_results: Sequence[str]) -> Dict[str, float]:
+        """Samma resultat som calculate_design_score för samma analystexter."""
+        return self.score_text(" ".join(analysis_results))
+
+    def score_many(self, batch: Sequence[Sequence[str]]) -> List[Dict[str, float]]:
+        """
+        Poängsätter många analyser på en gång, t.ex. lagrade rapporter. Träffarna
+        samlas i en matris och vikterna läggs på kolumnvis för hela batchen, i
+        samma ordning som score() så att flyttalen blir identiska.
+        """
+        if not batch:
+            return []
+        # NumPy laddas först när en batch poängsätts, inte vid varje uppstart
+        import numpy as np
+
+        present = np.array([self.matches(" ".join(texts).lower()) for texts in batch], dtype=bool)
+        present = present.reshape(len(batch), len(self.phrases))
+
+        def accumulate(base: float, terms: Terms) -> "np.ndarray":
+            values = np.full(len(batch), base)
+            for i, delta in terms:
+                values = values + np.where(present[:, i], delta, 0.0)
+            return values
+
+        base, low, high, terms = self.multiplier
+        multiplier = np.minimum(np.maximum(accumulate(base, terms), low), high)
+        columns = {}
+        for name, (value, metric_terms) in self.metrics.items():
+            values = accumulate(value, metric_terms) * multiplier
+            columns[name] = np.minimum(np.maximum(values, self.low), self.high).tolist()
+        columns[self.multiplier_name] = multiplier.tolist()
+        # Pythons round() avrundar korrekt; np.round kan skilja sig i sista decimalen
+        return [
+            {name: round(values[row], 2) for name, values in columns.items()}
+            for row in range(len(batch))
+        ]
+
+
+def _load_weights() -> Dict[str, Any]:
+    path = os.getenv("DESIGN_KEYWORDS_PATH")
+    if not path:
+        return DEFAULT_KEYWORD_WEIGHTS
+    try:
+        with open(path, encoding="utf-8") as weights_file:
+            return json.load(weights_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Kunde inte läsa nyckelordsvikter från {path}, använder standardvikter: {e}")
+        return DEFAULT_KEYWORD_WEIGHTS
+
+
+design_scorer = KeywordScorer(_load_weights())
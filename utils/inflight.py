@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Slår ihop samtidiga anrop med samma nyckel: det första startar arbetet,
+    övriga väntar på samma resultat. Arbetet körs som en egen task och
+    avbryts inte när en enskild väntare ger upp (t.ex. vid slut på
+    tidsbudget); nästa anrop efter att det blivit klart startar nytt.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.started = 0
+        self.joined = 0
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Hämta ut felet så att en task utan kvarvarande väntare inte varnar
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.started += 1
+        else:
+            self.joined += 1
+        return await asyncio.shield(task)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._inflight), "started": self.started, "joined": self.joined}
+
+
+# Pågående skrapningar (per URL) och besökaruppslag (per domän) delas mellan requests
+scrape_flights = SingleFlight("scrape")
+visitor_flights = SingleFlight("visitors")
@@ -0,0 +1,88 @@
+import json
+from typing import Any, Dict, Optional
+
+
+class IncrementalJSONObject:
+    """
+    Inkrementell tolkare för ett JSON-objekt som strömmas i bitar.
+
+    Text före första "{" (t.ex. ```json) ignoreras. Tolkaren håller reda på
+    djup och strängar tecken för tecken, så att `complete` blir sant så fort
+    toppnivåobjektet stängts och är giltig JSON; text efter det (avslutande
+    prosa) behöver inte genereras. `fields` innehåller de toppnivåfält som
+    hittills tagits emot i sin helhet.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._start: Optional[int] = None
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.fields: Dict[str, Any] = {}
+        self.value: Optional[Dict[str, Any]] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.value is not None
+
+    @property
+    def text(self) -> str:
+        """Mottagen text; när objektet är komplett bara själva objektet."""
+        if self.value is not None:
+            return self._text[self._start:self._scanned]
+        return self._text
+
+    def _fields_until(self, end: int) -> None:
+        # Stänger det hittills mottagna objektet vid ett komma på toppnivå
+        try:
+            fields = json.loads(self._text[self._start:end] + "}")
+        except ValueError:
+            return
+        if isinstance(fields, dict):
+            self.fields = fields
+
+    def feed(self, chunk: str) -> bool:
+        """Lägger till en bit; returnerar True när objektet är komplett."""
+        if self.value is not None:
+            return True
+        self._text += chunk
+        text = self._text
+        position = self._scanned
+        while position < len(text):
+            char = text[position]
+            position += 1
+            if self._start is None:
+                if char == "{":
+                    self._start = position - 1
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        value = json.loads(text[self._start:position])
+                    except ValueError:
+                        # Ogiltigt trots balanserade klamrar: börja om vid nästa "{"
+                        self._start = None
+                        continue
+                    if isinstance(value, dict):
+                        self._scanned = position
+                        self.value = self.fields = value
+                        return True
+            elif char == "," and self._depth == 1:
+                self._fields_until(position - 1)
+        self._scanned = position
+        return False
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from utils.logging_utils import logger
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """Ett steg i en reservkedja: modell och valfri egen endpoint."""
+    model: str
+    base_url: Optional[str] = None
+    api_key_env: Optional[str] = None
+    # Tid för steget innan nästa modell provas; standard attempt_timeout
+    timeout: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}@{self.base_url}" if self.base_url else self.model
+
+
+# send(route, prompt, timeout) -> (svarstext, förbrukade tokens)
+SendFn = Callable[[ModelRoute, str, float], Awaitable[Tuple[str, int]]]
+
+
+def load_chains(raw: Optional[str], default_models: List[str]) -> Dict[str, List[ModelRoute]]:
+    """
+    Läser reservkedjor per prompttyp från JSON, t.ex.
+    {"design": ["gpt-4o-mini", {"model": "gpt-3.5-turbo", "base_url": "https://..."}]}.
+    Prompttyper utan egen kedja använder "default".
+    """
+    chains = {"default": [ModelRoute(model) for model in default_models]}
+    for kind, entries in (json.loads(raw) if raw else {}).items():
+        routes = []
+        for entry in entries:
+            routes.append(ModelRoute(entry) if isinstance(entry, str) else ModelRoute(**entry))
+        if not routes:
+            raise ValueError(f"Tom reservkedja för prompttyp {kind}")
+        chains[kind] = routes
+    return chains
+
+
+class _RouteStats:
+    def __init__(self, sample_size: int):
+        self.latencies: Deque[float] = deque(maxlen=sample_size)
+        self.requests = 0
+        self.errors = 0
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+
+class HedgedCompleter:
+    """
+    Skickar en prompt längs prompttypens reservkedja med hedging.
+
+    När ett anrop tagit längre än hedge_percentile av modellens uppmätta
+    svarstider skickas en dubblett; första godkända svaret vinner och det
+    andra avbryts. Andelen hedgade anrop bland de senaste `window` hålls
+    under max_hedge_rate. Vid fel eller timeout provas nästa steg i kedjan
+    med den tid som återstår.
+    """
+
+    def __init__(self, chains: Dict[str, List[ModelRoute]], hedge_percentile: float = 0.95,
+                 max_hedge_rate: float = 0.1, min_samples: int = 20, min_hedge_delay: float = 0.5,
+                 attempt_timeout: float = 20.0, window: int = 200, sample_size: int = 256,
+                 enabled: bool = True):
+        if not 0.0 < hedge_percentile < 1.0:
+            raise ValueError(f"Ogiltig LLM_HEDGE_PERCENTILE: {hedge_percentile}")
+        self.chains = chains
+        self.hedge_percentile = hedge_percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.min_samples = min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.attempt_timeout = attempt_timeout
+        self.enabled = enabled
+        self.sample_size = sample_size
+        self._routes: Dict[str, _RouteStats] = {}
+        # En flagga per nyligen skickad prompt: True om den hedgades
+        self._recent: Deque[List[bool]] = deque(maxlen=window)
+        self._requests = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._cancelled = 0
+        self._fallbacks = 0
+        self._failures = 0
+        self._tokens = {"primary": 0, "hedge": 0}
+        self._completions = 0
+
+    def chain_for(self, kind: str, model: Optional[str] = None) -> List[ModelRoute]:
+        chain = self.chains.get(kind) or self.chains["default"]
+        if model is None:
+            return chain
+        # En mall med egen modell provar den först och behåller kedjan som reserv
+        return [ModelRoute(model), *(route for route in chain if route != ModelRoute(model))]
+
+    def _stats(self, route: ModelRoute) -> _RouteStats:
+        stats = self._routes.get(route.name)
+        if stats is None:
+            stats = self._routes[route.name] = _RouteStats(self.sample_size)
+        return stats
+
+    def _hedge_delay(self, route: ModelRoute) -> Optional[float]:
+        stats = self._stats(route)
+        if not self.enabled or len(stats.latencies) < self.min_samples:
+            return None
+        return max(stats.percentile(self.hedge_percentile), self.min_hedge_delay)
+
+    def _hedge_allowed(self) -> bool:
+        hedged = sum(1 for flag in self._recent if flag[0])
+        return (hedged + 1) / max(len(self._recent), 1) <= self.max_hedge_rate
+
+    async def _attempt(self, send: SendFn, route: ModelRoute, prompt: str,
+                       timeout: float, hedge: bool) -> str:
+        stats = self._stats(route)
+        stats.requests += 1
+        started = time.monotonic()
+        try:
+            content, tokens = await asyncio.wait_for(send(route, prompt, timeout), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            # Avbrutna och för långsamma anrop tog minst så här lång tid; utan
+            # dem i urvalet skulle hedge-fördröjningen glida nedåt
+            stats.latencies.append(time.monotonic() - started)
+            if isinstance(e, asyncio.TimeoutError):
+                stats.errors += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        if not content:
+            stats.errors += 1
+            raise ValueError(f"Tomt svar från {route.name}")
+        stats.latencies.append(time.monotonic() - started)
+        self._tokens["hedge" if hedge else "primary"] += tokens
+        self._completions += 1
+        return content
+
+    async def _hedged(self, send: SendFn, route: ModelRoute, prompt: str, timeout: float) -> str:
+        flag = [False]
+        self._recent.append(flag)
+        loop = asyncio.get_running_loop()
+        primary = loop.create_task(self._attempt(send, route, prompt, timeout, hedge=False))
+        pending = {primary}
+        hedge: Optional[asyncio.Task] = None
+        try:
+            delay = self._hedge_delay(route)
+            if delay is not None and delay < timeout:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if not done and self._hedge_allowed():
+                    flag[0] = True
+                    self._hedges += 1
+                    logger.info(f"Hedgar prompt mot {route.name} efter {delay:.2f}s")
+                    hedge = loop.create_task(
+                        self._attempt(send, route, prompt, timeout - delay, hedge=True)
+                    )
+                    pending.add(hedge)
+                pending |= done
+
+            last_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._hedge_wins += 1
+                        # Förloraren avbryts nedan; räknas som hedgingens kostnad
+                        self._cancelled += len(pending)
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def complete(self, send: SendFn, prompt: str, kind: str, timeout: float,
+                       model: Optional[str] = None) -> str:
+        """Första godkända svaret längs kedjan; sista felet om alla steg misslyckas."""
+        self._requests += 1
+        chain = self.chain_for(kind, model)
+        end = time.monotonic() + timeout
+        last_error: Optional[BaseException] = None
+        for position, route in enumerate(chain):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            if position < len(chain) - 1:
+                remaining = min(route.timeout or self.attempt_timeout, remaining)
+            if position > 0:
+                self._fallbacks += 1
+                logger.warning(f"⚠️ Faller tillbaka till {route.name} för {kind}-prompt: {last_error!r}")
+            try:
+                return await self._hedged(send, route, prompt, remaining)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+        self._failures += 1
+        raise last_error if last_error is not None else asyncio.TimeoutError()
+
+    def snapshot(self) -> Dict[str, Any]:
+        completions = max(self._completions, 1)
+        avg_tokens = (self._tokens["primary"] + self._tokens["hedge"]) / completions
+        routes = {}
+        for name, stats in self._routes.items():
+            routes[name] = {
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "p50_s": _rounded(stats.percentile(0.5)),
+                "p99_s": _rounded(stats.percentile(0.99)),
+                "hedge_after_s": _rounded(stats.percentile(self.hedge_percentile))
+                if len(stats.latencies) >= self.min_samples else None,
+            }
+        return {
+            "enabled": self.enabled,
+            "requests": self._requests,
+            "hedges": self._hedges,
+            "hedge_rate": round(self._hedges / self._requests, 3) if self._requests else None,
+            "max_hedge_rate": self.max_hedge_rate,
+            "hedge_wins": self._hedge_wins,
+            "cancelled_requests": self._cancelled,
+            "fallbacks": self._fallbacks,
+            "failures": self._failures,
+            "tokens": dict(self._tokens),
+            # Varje hedge kostar ett avbrutet anrop, som ofta debiteras ändå;
+            # uppskattas med snittet per svar
+            "estimated_extra_tokens": round(self._cancelled * avg_tokens),
+            "routes": routes,
+        }
+
+
+def _rounded(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+llm_completer = HedgedCompleter(
+    chains=load_chains(
+        os.getenv("LLM_MODEL_CHAINS"),
+        # En modell som standard: den får hela tidsbudgeten. Reservmodeller
+        # (och tidsgränsen per steg) gäller bara när de konfigurerats.
+        [model.strip() for model in os.getenv("OPENAI_MODELS", "gpt-3.5-turbo").split(",")
+         if model.strip()],
+    ),
+    hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95")),
+    max_hedge_rate=float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1")),
+    min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+    attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT_S", "20")),
+    enabled=os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes"),
+)
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from utils.logging_utils import logger
+
+# Histogramgränser för loop-lag i millisekunder (sista hinken är "+Inf")
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Ramar från dessa filer är själva mätverktygen och pekar aldrig ut en bov
+_IGNORED_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(_PROJECT_ROOT, "utils", "logging_utils.py"),
+}
+
+
+def _is_project_frame(filename: str) -> bool:
+    path = os.path.abspath(filename)
+    if path in _IGNORED_FILES or not path.startswith(_PROJECT_ROOT + os.sep):
+        return False
+    return "site-packages" not in path and os.sep + "." not in path[len(_PROJECT_ROOT):]
+
+
+class EventLoopMonitor:
+    """
+    Watchdog som kontinuerligt mäter hur länge event-loopen är blockerad.
+
+    En heartbeat-task sover `interval` sekunder och mäter hur mycket senare den
+    faktiskt vaknar (loop-lag). En separat tråd bevakar heartbeaten; om den inte
+    har slagit på `stall_threshold` sekunder fångas loop-trådens stack så att
+    det blockerande anropet (t.ex. `scrape_dynamic_page`) kan pekas ut.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        stall_threshold: float = 0.25,
+        sample_size: int = 2048,
+        max_call_sites: int = 50,
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.max_call_sites = max_call_sites
+
+        self._lock = threading.Lock()
+        self._samples: Deque[float] = deque(maxlen=sample_size)
+        self._bucket_counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self._lag_count = 0
+        self._lag_sum_ms = 0.0
+        self._lag_max_ms = 0.0
+        self._stall_count = 0
+        self._call_sites: Dict[str, Dict[str, Any]] = {}
+
+        self._last_beat = time.monotonic()
+        self._pending_site: Optional[str] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        """Startar heartbeat och watchdog-tråd. Ska anropas inifrån event-loopen."""
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watchdog, name="loop-lag-watchdog", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"✅ Loop-lag-monitor startad (intervall {self.interval * 1000:.0f} ms, "
+            f"tröskel {self.stall_threshold * 1000:.0f} ms)"
+        )
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+            self._record_lag(max(now - expected, 0.0) * 1000)
+
+    def _record_lag(self, lag_ms: float) -> None:
+        with self._lock:
+            self._samples.append(lag_ms)
+            self._lag_count += 1
+            self._lag_sum_ms += lag_ms
+            self._lag_max_ms = max(self._lag_max_ms, lag_ms)
+            for i, bound in enumerate(LAG_BUCKETS_MS):
+                if lag_ms <= bound:
+                    self._bucket_counts[i] += 1
+                    break
+            else:
+                self._bucket_counts[-1] += 1
+
+            # Tillskriv stallens totala längd till anropsplatsen som watchdogen fångade
+            site = self._pending_site
+            self._pending_site = None
+        if site is not None:
+            self._finish_stall(site, lag_ms)
+
+    def _watchdog(self) -> None:
+        poll = min(self.interval, self.stall_threshold) / 2
+        while not self._stop.wait(poll):
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for < self.stall_threshold or self._pending_site is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            self._begin_stall(stack, stalled_for * 1000)
+
+    def _begin_stall(self, stack: List[traceback.FrameSummary], stalled_ms: float) -> None:
+        site_frame = next(
+            (f for f in reversed(stack) if _is_project_frame(f.filename)), stack[-1]
+        )
+        site = (
+            f"{site_frame.name} "
+            f"({os.path.relpath(site_frame.filename, _PROJECT_ROOT)}:{site_frame.lineno})"
+        )
+        formatted = "".join(traceback.format_list(stack[-15:]))
+        with self._lock:
+            self._stall_count += 1
+            self._pending_site = site
+            entry = self._call_sites.get(site)
+            if entry is None:
+                if len(self._call_sites) >= self.max_call_sites:
+                    # Släng den minst förekommande anropsplatsen
+                    weakest = min(self._call_sites, key=lambda k: self._call_sites[k]["count"])
+                    del self._call_sites[weakest]
+                entry = self._call_sites[site] = {
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "last_stack": "",
+                }
+            entry["count"] += 1
+            entry["last_stack"] = formatted
+        logger.warning(
+            f"⚠️ Event-loopen blockerad i {stalled_ms:.0f} ms av {site}\n{formatted}"
+        )
+
+    def _finish_stall(self, site: str, lag_ms: float) -> None:
+        with self._lock:
+            entry = self._call_sites.get(site)
+            if entry is not None:
+                entry["total_ms"] += lag_ms
+                entry["max_ms"] = max(entry["max_ms"], lag_ms)
+
+    def snapshot(self, top: int = 10) -> Dict[str, Any]:
+        """Returnerar lag-histogram, percentiler och de värsta anropsplatserna."""
+        with self._lock:
+            samples = sorted(self._samples)
+            buckets = {}
+            cumulative = 0
+            for bound, count in zip(list(LAG_BUCKETS_MS) + ["+Inf"], self._bucket_counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            sites = sorted(
+                self._call_sites.items(), key=lambda kv: kv[1]["total_ms"], reverse=True
+            )[:top]
+            top_sites = [
+                {
+                    "call_site": site,
+                    "stalls": entry["count"],
+                    "total_ms": round(entry["total_ms"], 1),
+                    "max_ms": round(entry["max_ms"], 1),
+                    "last_stack": entry["last_stack"],
+                }
+                for site, entry in sites
+            ]
+            count, lag_sum, lag_max, stalls = (
+                self._lag_count, self._lag_sum_ms, self._lag_max_ms, self._stall_count
+            )
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(int(p * len(samples)), len(samples) - 1)], 2)
+
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "stall_threshold_ms": self.stall_threshold * 1000,
+            "lag_ms": {
+                "count": count,
+                "sum": round(lag_sum, 2),
+                "max": round(lag_max, 2),
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "buckets": buckets,
+            },
+            "stalls": stalls,
+            "top_call_sites": top_sites,
+        }
+
+
+loop_monitor = EventLoopMonitor(
+    interval=float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")) / 1000,
+    stall_threshold=float(os.getenv("LOOP_STALL_THRESHOLD_MS", "250")) / 1000,
+)
+
+
+async def start_loop_monitor() -> None:
+    if os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes"):
+        await loop_monitor.start()
+
+
+async def stop_loop_monitor() -> None:
+    await loop_monitor.stop()
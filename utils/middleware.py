@@ -0,0 +1,192 @@
+import json
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+from utils.logging_utils import logger
+from utils.responses import response_timings
+
+try:
+    import brotli
+except ImportError:  # Utan brotli förhandlas bara gzip
+    brotli = None
+
+# Innehåll som redan är komprimerat eller inte tjänar på det
+_SKIP_CONTENT_TYPES = ("image/", "video/", "audio/", "application/gzip", "application/zip",
+                       "text/event-stream")
+
+
+class ErrorLoggingMiddleware:
+    """
+    Fångar och loggar oväntade fel. Ren ASGI-middleware: svaret skickas
+    vidare meddelande för meddelande, så strömmade svar buffras aldrig.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            logger.error(f"Uncaught exception: {str(e)}", exc_info=True)
+            if response_started:
+                # Headers är redan skickade; det enda vi kan göra är att avbryta svaret
+                raise
+            body = json.dumps({"detail": f"Server error: {str(e)}"}).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 500,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+
+
+def _accepted_encodings(scope) -> List[Tuple[str, float]]:
+    for name, value in scope["headers"]:
+        if name == b"accept-encoding":
+            accepted = []
+            for part in value.decode("latin-1").split(","):
+                token, _, params = part.strip().partition(";")
+                quality = 1.0
+                if params.strip().startswith("q="):
+                    try:
+                        quality = float(params.strip()[2:])
+                    except ValueError:
+                        quality = 0.0
+                accepted.append((token.strip().lower(), quality))
+            return accepted
+    return []
+
+
+def negotiate_encoding(scope) -> Optional[str]:
+    """Väljer br före gzip om klienten accepterar båda (och brotli finns installerat)."""
+    accepted = {token: quality for token, quality in _accepted_encodings(scope) if quality > 0}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=min(level, 11))
+        else:
+            self._impl = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress_chunk(self, data: bytes, last: bool) -> bytes:
+        """Komprimerar en del; delar mitt i en ström flushas så att klienten får dem direkt."""
+        if self.encoding == "br":
+            return self._impl.process(data) + (self._impl.finish() if last else self._impl.flush())
+        return self._impl.compress(data) + self._impl.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """
+    Komprimerar svar med gzip eller brotli enligt Accept-Encoding när de är
+    större än minimum_size. Svar i ett meddelande komprimeras i ett svep;
+    strömmade svar komprimeras bit för bit utan att buffras. Tiden läggs i
+    Server-Timing (när headers inte redan skickats) och i /metrics.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        level = self.brotli_quality if encoding == "br" else self.gzip_level
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+        raw_size = 0
+        compressed_size = 0
+        compress_seconds = 0.0
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough, raw_size, compressed_size, compress_seconds
+
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in headers or content_type.startswith(_SKIP_CONTENT_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Vänta med headers tills vi vet om första body-delen ska komprimeras
+                    start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding, level)
+                compress_start = time.perf_counter()
+                data = compressor.compress_chunk(body, last=not more_body)
+                compress_seconds += time.perf_counter() - compress_start
+                raw_size += len(body)
+                compressed_size += len(data)
+
+                headers = [
+                    (name, value) for name, value in start_message.get("headers", [])
+                    if name.lower() != b"content-length"
+                ]
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+                headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body:
+                    headers.append((b"content-length", str(len(data)).encode("latin-1")))
+                    headers.append((b"server-timing",
+                                    f"compress;dur={compress_seconds * 1000:.3f}".encode("latin-1")))
+                await send({**start_message, "headers": headers})
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+            else:
+                compress_start = time.perf_counter()
+                data = compressor.compress_chunk(body, last=not more_body)
+                compress_seconds += time.perf_counter() - compress_start
+                raw_size += len(body)
+                compressed_size += len(data)
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+            if not more_body:
+                response_timings.record("compress", compress_seconds)
+                response_timings.record_compression(encoding, raw_size, compressed_size)
+
+        await self.app(scope, receive, send_wrapper)
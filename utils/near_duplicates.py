@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import math
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, select
+
+from database import PageSignature, async_session_maker
+from utils.logging_utils import logger
+
+SIGNATURE_BITS = 64
+
+
+def template_features(extracted_data: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Mallnivåns drag ur extracted_data: navigation, knappar, typsnitt, färger,
+    säkerhetsmärkning och sidans grova form. Titel, metabeskrivning, rubriker
+    och priser skiljer sidor från samma mall åt och är medvetet utelämnade.
+    """
+    features: Dict[str, float] = defaultdict(float)
+    for item in extracted_data.get("navigation") or []:
+        features[f"nav:{str(item).strip().lower()}"] += 1.0
+    for item in extracted_data.get("buttons") or []:
+        features[f"button:{str(item).strip().lower()}"] += 1.0
+    design_summary = extracted_data.get("design_summary") or {}
+    for font in design_summary.get("fonts") or []:
+        features[f"font:{str(font).strip().lower()}"] += 2.0
+    for color in design_summary.get("colors") or []:
+        features[f"color:{str(color).strip().lower()}"] += 2.0
+    security = extracted_data.get("security_elements") or {}
+    features[f"ssl:{bool(security.get('ssl'))}"] += 1.0
+    for method in security.get("payment_methods") or []:
+        features[f"payment:{str(method).strip().lower()}"] += 1.0
+    for certification in security.get("certifications") or []:
+        features[f"cert:{str(certification).strip().lower()}"] += 1.0
+    # Antal i logaritmiska hinkar: 12 och 14 bilder är samma mall, 2 och 40 inte
+    headings = extracted_data.get("headings") or {}
+    for name, value in (("images", extracted_data.get("images")),
+                        ("h1", headings.get("h1")), ("h2", headings.get("h2"))):
+        features[f"{name}:{int(math.log2(len(value or []) + 1))}"] += 1.0
+    features[f"prices:{bool(extracted_data.get('prices'))}"] += 1.0
+    return dict(features)
+
+
+def _token_hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(features: Dict[str, float]) -> int:
+    """64-bitars SimHash; liknande viktade dragmängder ger få skilda bitar."""
+    totals = [0.0] * SIGNATURE_BITS
+    for token, weight in features.items():
+        token_bits = _token_hash(token)
+        for bit in range(SIGNATURE_BITS):
+            totals[bit] += weight if token_bits >> bit & 1 else -weight
+    return sum(1 << bit for bit, total in enumerate(totals) if total > 0)
+
+
+def page_signature(extracted_data: Dict[str, Any]) -> int:
+    return simhash(template_features(extracted_data))
+
+
+def similarity(a: int, b: int) -> float:
+    return 1.0 - bin(a ^ b).count("1") / SIGNATURE_BITS
+
+
+def _to_signed(value: int) -> int:
+    # Databasens BIGINT är 64 bitar med tecken
+    return value - (1 << SIGNATURE_BITS) if value >= 1 << (SIGNATURE_BITS - 1) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << SIGNATURE_BITS) if value < 0 else value
+
+
+@dataclass(frozen=True)
+class TemplateMatch:
+    url: str
+    similarity: float
+    # Återanvändbara råsvar, t.ex. "design" och "ux:standard"
+    responses: Dict[str, str]
+
+
+@dataclass
+class _Entry:
+    id: int
+    domain: str
+    url: str
+    signature: int
+    responses: Dict[str, str]
+    created_at: datetime
+
+
+class NearDuplicateIndex:
+    """
+    Index över signaturer för nyligen analyserade sidor, per domän.
+
+    Signaturen delas i `bands` lika stora band (LSH). Två signaturer som
+    skiljer sig i högst max_distance bitar har enligt lådprincipen minst
+    ett band gemensamt när bands = max_distance + 1, så uppslaget jämför
+    bara kandidater som delar ett band men missar ingen träff.
+
+    Signaturerna sparas i databasen och läses in i minnet; rader från andra
+    processer läses in var refresh_interval sekund.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_age_hours: float = 168.0,
+                 refresh_interval: float = 30.0):
+        if not 0.5 <= threshold <= 1.0:
+            raise ValueError(f"Ogiltig NEAR_DUPLICATE_THRESHOLD: {threshold}")
+        self.threshold = threshold
+        self.max_age = timedelta(hours=max_age_hours)
+        self.refresh_interval = refresh_interval
+        self.max_distance = int((1.0 - threshold) * SIGNATURE_BITS + 1e-9)
+        self.bands = self.max_distance + 1
+        self._entries: Dict[int, _Entry] = {}
+        self._buckets: Dict[Tuple[str, int, int], Set[int]] = defaultdict(set)
+        self._last_id = 0
+        self._refreshed_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._lookups = 0
+        self._hits = 0
+
+    def _band_keys(self, domain: str, signature: int) -> List[Tuple[str, int, int]]:
+        keys = []
+        start = 0
+        for band in range(self.bands):
+            end = SIGNATURE_BITS * (band + 1) // self.bands
+            keys.append((domain, band, signature >> start & ((1 << (end - start)) - 1)))
+            start = end
+        return keys
+
+    def _add(self, entry: _Entry) -> None:
+        self._entries[entry.id] = entry
+        for key in self._band_keys(entry.domain, entry.signature):
+            self._buckets[key].add(entry.id)
+        self._last_id = max(self._last_id, entry.id)
+
+    def _evict(self, cutoff: datetime) -> None:
+        for entry in [entry for entry in self._entries.values() if entry.created_at < cutoff]:
+            del self._entries[entry.id]
+            for key in self._band_keys(entry.domain, entry.signature):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(entry.id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    async def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+            return
+        async with self._lock:
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+                return
+            cutoff = datetime.utcnow() - self.max_age
+            async with async_session_maker() as session:
+                rows = (await session.execute(
+                    select(PageSignature)
+                    .where(PageSignature.id > self._last_id, PageSignature.created_at >= cutoff)
+                    .order_by(PageSignature.id)
+                )).scalars().all()
+                if self._refreshed_at is None:
+                    # Gamla signaturer rensas vid första inläsningen i varje process
+                    await session.execute(delete(PageSignature).where(PageSignature.created_at < cutoff))
+                    await session.commit()
+            for row in rows:
+                self._add(_Entry(row.id, row.domain, row.url, _to_unsigned(row.signature),
+                                 row.responses or {}, row.created_at))
+            self._evict(cutoff)
+            self._refreshed_at = time.monotonic()
+
+    async def lookup(self, domain: str, signature: int) -> Optional[TemplateMatch]:
+        """Mest lika sidan på samma domän över tröskeln, eller None."""
+        await self.refresh()
+        self._lookups += 1
+        candidates: Set[int] = set()
+        for key in self._band_keys(domain, signature):
+            candidates |= self._buckets.get(key, set())
+        cutoff = datetime.utcnow() - self.max_age
+        best: Optional[_Entry] = None
+        best_similarity = 0.0
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if entry.created_at < cutoff:
+                continue
+            entry_similarity = similarity(signature, entry.signature)
+            # Vid lika likhet vinner den nyaste analysen
+            if entry_similarity >= self.threshold and (
+                entry_similarity > best_similarity
+                or (entry_similarity == best_similarity and best is not None and entry.id > best.id)
+            ):
+                best, best_similarity = entry, entry_similarity
+        if best is None:
+            return None
+        self._hits += 1
+        return TemplateMatch(url=best.url, similarity=round(best_similarity, 3), responses=best.responses)
+
+    async def record(self, domain: str, url: str, signature: int, responses: Dict[str, str]) -> None:
+        created_at = datetime.utcnow()
+        try:
+            async with async_session_maker() as session:
+                row = PageSignature(domain=domain, url=url, signature=_to_signed(signature),
+                                    responses=responses, created_at=created_at)
+                session.add(row)
+                await session.commit()
+        except Exception as e:
+            # Indexet är en optimering; en analys ska aldrig fallera på det
+            logger.error(f"❌ Kunde inte spara sidsignatur för {url}: {e}")
+            return
+        self._add(_Entry(row.id, domain, url, signature, responses, created_at))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "max_distance_bits": self.max_distance,
+            "bands": self.bands,
+            "entries": len(self._entries),
+            "lookups": self._lookups,
+            "hits": self._hits,
+            "hit_rate": round(self._hits / self._lookups, 3) if self._lookups else None,
+        }
+
+
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+near_duplicate_index = NearDuplicateIndex(
+    threshold=float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.95")),
+    max_age_hours=float(os.getenv("NEAR_DUPLICATE_MAX_AGE_H", "168")),
+    refresh_interval=float(os.getenv("NEAR_DUPLICATE_REFRESH_S", "30")),
+)
@@ -0,0 +1,205 @@
+import os
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.logging_utils import logger
+
+AUDIT_VERSION = 1
+
+# Skrapans standardtexter när titel eller metabeskrivning saknas
+MISSING_TITLE = "Ingen titel hittades"
+MISSING_META = "Ingen meta-beskrivning hittades"
+
+
+@dataclass(frozen=True)
+class AuditFinding:
+    rule: str
+    status: str  # pass, warn, fail eller info
+    message: str
+    # Kompakt fakta som skickas med i prompterna
+    fact: str
+    value: Any = None
+
+
+AuditRule = Callable[[Dict[str, Any], str], Optional[AuditFinding]]
+
+
+class PageAuditor:
+    """
+    Regelbaserad granskning av extracted_data. Varje regel är en funktion
+    (extracted_data, url) -> AuditFinding eller None (regeln gäller inte,
+    t.ex. när skrapningen saknar fältet). Fler regler läggs till med
+    `register`; regler kan stängas av per namn (PAGE_AUDIT_DISABLED_RULES).
+    """
+
+    def __init__(self, rules: Optional[Dict[str, AuditRule]] = None, disabled: Optional[List[str]] = None):
+        self._rules: Dict[str, AuditRule] = dict(rules or {})
+        self.disabled = set(disabled or [])
+
+    def register(self, name: str, rule: AuditRule) -> None:
+        self._rules[name] = rule
+
+    def run(self, extracted_data: Dict[str, Any], url: str) -> List[AuditFinding]:
+        findings = []
+        for name, func in self._rules.items():
+            if name in self.disabled:
+                continue
+            try:
+                finding = func(extracted_data, url)
+            except Exception as e:
+                # En trasig regel får inte stoppa analysen
+                logger.error(f"❌ Granskningsregel {name} misslyckades: {e}")
+                continue
+            if finding is not None:
+                findings.append(finding)
+        return findings
+
+    def audit(self, extracted_data: Dict[str, Any], url: str) -> Dict[str, Any]:
+        """Granskningen som den returneras i analyssvaret."""
+        audit_start = time.perf_counter()
+        findings = self.run(extracted_data, url)
+        counts = Counter(finding.status for finding in findings)
+        return {
+            "version": AUDIT_VERSION,
+            "findings": [asdict(finding) for finding in findings],
+            "passed": counts["pass"],
+            "warnings": counts["warn"],
+            "failed": counts["fail"],
+            "duration_ms": round((time.perf_counter() - audit_start) * 1000, 3),
+        }
+
+    def facts(self, extracted_data: Dict[str, Any], url: str) -> str:
+        """Fynden som en kompakt rad för prompterna."""
+        return "; ".join(finding.fact for finding in self.run(extracted_data, url))
+
+
+def audit_facts(audit: Dict[str, Any]) -> str:
+    """Samma rad som PageAuditor.facts, ur en redan körd granskning."""
+    return "; ".join(finding["fact"] for finding in audit["findings"])
+
+
+def _text(value: Any, missing: str) -> str:
+    text = (value or "").strip()
+    return "" if text == missing else text
+
+
+def _length_finding(rule: str, label: str, text: str, low: int, high: int) -> AuditFinding:
+    if not text:
+        return AuditFinding(rule, "fail", f"{label} saknas", f"{label.lower()} saknas", 0)
+    length = len(text)
+    if length < low:
+        return AuditFinding(rule, "warn", f"{label} är kort ({length} tecken, rekommenderat {low}–{high})",
+                            f"{label.lower()} {length} tecken (kort)", length)
+    if length > high:
+        return AuditFinding(rule, "warn", f"{label} är lång ({length} tecken, rekommenderat {low}–{high})",
+                            f"{label.lower()} {length} tecken (lång)", length)
+    return AuditFinding(rule, "pass", f"{label} har bra längd ({length} tecken)",
+                        f"{label.lower()} {length} tecken (ok)", length)
+
+
+def _title_length(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    return _length_finding("title_length", "Titel", _text(data.get("title"), MISSING_TITLE), 30, 60)
+
+
+def _meta_description_length(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    return _length_finding("meta_description_length", "Meta-beskrivning",
+                           _text(data.get("meta_description"), MISSING_META), 70, 160)
+
+
+def _h1_count(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    h1 = (data.get("headings") or {}).get("h1")
+    if h1 is None:
+        return None
+    count = len(h1)
+    if count == 0:
+        return AuditFinding("h1_count", "fail", "Sidan saknar H1-rubrik", "ingen H1", 0)
+    if count > 1:
+        return AuditFinding("h1_count", "warn", f"Sidan har {count} H1-rubriker (bör vara en)",
+                            f"{count} H1 (bör vara 1)", count)
+    return AuditFinding("h1_count", "pass", "Sidan har exakt en H1-rubrik", "1 H1 (ok)", 1)
+
+
+def _empty_headings(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    headings = data.get("headings")
+    if headings is None:
+        return None
+    empty = sum(1 for level in ("h1", "h2") for text in headings.get(level) or [] if not text.strip())
+    if empty:
+        return AuditFinding("empty_headings", "warn", f"{empty} rubriker saknar text",
+                            f"{empty} tomma rubriker", empty)
+    return AuditFinding("empty_headings", "pass", "Inga tomma rubriker", "inga tomma rubriker", 0)
+
+
+def _duplicate_headings(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    headings = data.get("headings")
+    if headings is None:
+        return None
+    texts = Counter(
+        text.strip().lower() for level in ("h1", "h2") for text in headings.get(level) or [] if text.strip()
+    )
+    duplicates = sorted(text for text, count in texts.items() if count > 1)
+    if duplicates:
+        return AuditFinding("duplicate_headings", "warn",
+                            f"{len(duplicates)} rubriker förekommer flera gånger: {', '.join(duplicates[:5])}",
+                            f"{len(duplicates)} dubblerade rubriker", duplicates)
+    return AuditFinding("duplicate_headings", "pass", "Inga dubblerade rubriker", "inga dubblerade rubriker", [])
+
+
+def _https(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    ssl = (data.get("security_elements") or {}).get("ssl")
+    if ssl is None:
+        ssl = url.startswith("https://")
+    if ssl:
+        return AuditFinding("https", "pass", "Sidan använder HTTPS", "HTTPS ja", True)
+    return AuditFinding("https", "fail", "Sidan använder inte HTTPS", "HTTPS saknas", False)
+
+
+def _image_count(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    images = data.get("images")
+    if images is None:
+        return None
+    if not images:
+        return AuditFinding("image_count", "warn", "Inga bilder hittades", "0 bilder", 0)
+    return AuditFinding("image_count", "info", f"{len(images)} bilder hittades", f"{len(images)} bilder",
+                        len(images))
+
+
+def _image_alt_text(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    missing = data.get("images_without_alt")
+    if missing is None or not data.get("images"):
+        return None
+    if missing:
+        status = "fail" if missing * 2 > len(data["images"]) else "warn"
+        return AuditFinding("image_alt_text", status, f"{missing} av {len(data['images'])} bilder saknar alt-attribut",
+                            f"{missing} bilder utan alt-text", missing)
+    return AuditFinding("image_alt_text", "pass", "Alla bilder har alt-text", "alla bilder har alt-text", 0)
+
+
+def _price_presence(data: Dict[str, Any], url: str) -> Optional[AuditFinding]:
+    prices = data.get("prices")
+    if prices is None:
+        return None
+    if prices:
+        return AuditFinding("price_presence", "info", f"{len(prices)} priser hittades", f"{len(prices)} priser",
+                            len(prices))
+    return AuditFinding("price_presence", "info", "Inga priser hittades", "inga priser", 0)
+
+
+DEFAULT_RULES: Dict[str, AuditRule] = {
+    "title_length": _title_length,
+    "meta_description_length": _meta_description_length,
+    "h1_count": _h1_count,
+    "empty_headings": _empty_headings,
+    "duplicate_headings": _duplicate_headings,
+    "https": _https,
+    "image_count": _image_count,
+    "image_alt_text": _image_alt_text,
+    "price_presence": _price_presence,
+}
+
+page_auditor = PageAuditor(
+    rules=DEFAULT_RULES,
+    disabled=[name.strip() for name in os.getenv("PAGE_AUDIT_DISABLED_RULES", "").split(",") if name.strip()],
+)
@@ -0,0 +1,271 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import urlparse
+
+from utils.admission import analysis_admission
+from utils.inflight import scrape_flights, visitor_flights
+from utils.logging_utils import logger
+from utils.visitor_utils import get_visitor_count
+from utils.web_scraper import browser_pool, scrape_dynamic_page
+
+# Tillstånd där förhämtningen fortfarande arbetar
+ACTIVE_STATES = ("queued", "running")
+
+
+class PrefetchRejected(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"För många förhämtningar, försök igen om {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _NoIdleBrowser(Exception):
+    """Den lediga webbläsaren hann lånas av någon annan; förhämtningen väntar vidare."""
+
+
+@dataclass
+class _Prefetch:
+    url: str
+    domain: str
+    owner: str
+    submitted_at: float
+    status: str = "queued"  # queued, running, done, failed, cancelled, expired
+    task: Optional[asyncio.Task] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    scrape_seconds: float = 0.0
+    data: Optional[Dict[str, Any]] = None
+    visitors: Optional[str] = None
+    converted: bool = False
+
+
+class Prefetcher:
+    """
+    Förhämtar skrapning och besökaruppslag för en URL innan användaren
+    startar analysen.
+
+    Arbetet delar SingleFlight med riktiga analyser, så en analys som
+    startar medan förhämtningen pågår ansluter till samma skrapning i
+    stället för att starta en ny. Förhämtningar startar bara när
+    analyskön har lediga platser och högst max_concurrent åt gången. De
+    skrapar bara med en redan ledig webbläsare ur poolen och startar aldrig
+    en egen, så de tar inga webbläsare utöver max_concurrent lediga.
+    Färdiga resultat ligger kvar i ttl sekunder och plockas upp av
+    analysens scrape/lookup_visitors. Sparad tid räknas en gång per
+    förhämtning.
+    """
+
+    def __init__(self, ttl: float = 120.0, max_concurrent: int = 1, per_minute: int = 10,
+                 max_pending_per_user: int = 2, scrape_timeout: float = 30.0,
+                 visitor_timeout: float = 10.0, idle_poll: float = 0.5):
+        self.ttl = ttl
+        self.per_minute = per_minute
+        self.max_pending_per_user = max_pending_per_user
+        self.scrape_timeout = scrape_timeout
+        self.visitor_timeout = visitor_timeout
+        self.idle_poll = idle_poll
+        self._semaphore = asyncio.Semaphore(max(max_concurrent, 1))
+        self._entries: Dict[str, _Prefetch] = {}
+        self._requests: Dict[str, Deque[float]] = {}
+        self._counts = {
+            "submitted": 0, "deduplicated": 0, "rejected": 0, "completed": 0,
+            "failed": 0, "cancelled": 0, "expired": 0,
+        }
+        self._conversions = 0
+        self._hits = 0
+        self._joins = 0
+        self._seconds_saved = 0.0
+
+    def _fresh(self, entry: _Prefetch) -> bool:
+        if entry.status in ACTIVE_STATES:
+            return True
+        return entry.finished_at is not None and time.monotonic() - entry.finished_at < self.ttl
+
+    def _purge(self) -> None:
+        for url in [url for url, entry in self._entries.items() if not self._fresh(entry)]:
+            del self._entries[url]
+        cutoff = time.monotonic() - 60
+        for owner in list(self._requests):
+            timestamps = self._requests[owner]
+            while timestamps and timestamps[0] < cutoff:
+                timestamps.popleft()
+            if not timestamps:
+                del self._requests[owner]
+
+    def _check_rate(self, owner: str) -> None:
+        timestamps = self._requests.setdefault(owner, deque())
+        if len(timestamps) >= self.per_minute:
+            self._counts["rejected"] += 1
+            raise PrefetchRejected(max(int(timestamps[0] + 60 - time.monotonic()) + 1, 1))
+        timestamps.append(time.monotonic())
+
+    def _finish(self, entry: _Prefetch, status: str) -> None:
+        entry.status = status
+        entry.finished_at = time.monotonic()
+        self._counts["completed" if status == "done" else status] += 1
+
+    async def submit(self, owner: str, url: str) -> Dict[str, Any]:
+        """Startar en förhämtning, eller pekar på den som redan finns för URL:en."""
+        self._purge()
+        entry = self._entries.get(url)
+        if entry is not None and entry.status in (*ACTIVE_STATES, "done"):
+            self._counts["deduplicated"] += 1
+            return {"url": url, "status": "cached" if entry.status == "done" else entry.status}
+        if scrape_flights.in_flight(url):
+            # En riktig analys skrapar redan sidan
+            self._counts["deduplicated"] += 1
+            return {"url": url, "status": "in_flight"}
+
+        self._check_rate(owner)
+        # Användaren har bytt URL: den äldsta väntande förhämtningen är inaktuell
+        pending = sorted(
+            (entry for entry in self._entries.values()
+             if entry.owner == owner and entry.status in ACTIVE_STATES),
+            key=lambda entry: entry.submitted_at,
+        )
+        for stale in pending[:max(len(pending) - self.max_pending_per_user + 1, 0)]:
+            self.cancel(owner, stale.url)
+
+        entry = _Prefetch(url=url, domain=urlparse(url).netloc, owner=owner,
+                          submitted_at=time.monotonic())
+        entry.task = asyncio.get_running_loop().create_task(self._run(entry))
+        self._entries[url] = entry
+        self._counts["submitted"] += 1
+        return {"url": url, "status": "queued"}
+
+    def _start_scrape(self, url: str):
+        # Körs synkront i SingleFlight.run: utan ledig webbläsare registreras
+        # ingen skrapning, så ingen analys hinner ansluta till ett misslyckat försök
+        driver = browser_pool.try_acquire()
+        if driver is None:
+            raise _NoIdleBrowser()
+        return asyncio.to_thread(scrape_dynamic_page, url, self.scrape_timeout, driver)
+
+    async def _wait_until_idle(self, entry: _Prefetch) -> bool:
+        """Väntar på ledig analysplats och ledig webbläsare; False om förhämtningen hann bli inaktuell."""
+        while not (analysis_admission.has_idle_capacity() and browser_pool.idle > 0):
+            if time.monotonic() - entry.submitted_at >= self.ttl:
+                self._finish(entry, "expired")
+                return False
+            await asyncio.sleep(self.idle_poll)
+        return True
+
+    async def _run(self, entry: _Prefetch) -> None:
+        visitors_task: Optional[asyncio.Task] = None
+        try:
+            async with self._semaphore:
+                while True:
+                    if not await self._wait_until_idle(entry):
+                        if visitors_task is not None:
+                            visitors_task.cancel()
+                        return
+                    if visitors_task is None:
+                        entry.status = "running"
+                        entry.started_at = time.monotonic()
+                        visitor_timeout = self.visitor_timeout
+                        visitors_task = asyncio.ensure_future(visitor_flights.run(
+                            entry.domain, lambda: asyncio.to_thread(
+                                get_visitor_count, entry.domain, visitor_timeout)))
+                    try:
+                        data = await scrape_flights.run(entry.url, lambda: self._start_scrape(entry.url))
+                    except _NoIdleBrowser:
+                        continue
+                    except Exception as e:
+                        data = e
+                    break
+                visitors = (await asyncio.gather(visitors_task, return_exceptions=True))[0]
+                entry.scrape_seconds = time.monotonic() - entry.started_at
+                if not isinstance(visitors, BaseException):
+                    entry.visitors = visitors
+                if isinstance(data, BaseException):
+                    logger.error(f"❌ Förhämtning av {entry.url} misslyckades: {data}")
+                    self._finish(entry, "failed")
+                    return
+                entry.data = data
+                self._finish(entry, "done")
+                logger.info(f"✅ Förhämtade {entry.url} på {entry.scrape_seconds:.2f}s")
+        except asyncio.CancelledError:
+            # Den delade skrapningen fortsätter om en analys väntar på den
+            if visitors_task is not None:
+                visitors_task.cancel()
+            if entry.status in ACTIVE_STATES:
+                self._finish(entry, "cancelled")
+            raise
+
+    def cancel(self, owner: str, url: str) -> bool:
+        entry = self._entries.get(url)
+        if entry is None or entry.owner != owner or entry.status not in ACTIVE_STATES:
+            return False
+        self._finish(entry, "cancelled")
+        if entry.task is not None:
+            entry.task.cancel()
+        return True
+
+    def _convert(self, entry: _Prefetch, saved: float) -> None:
+        # Bara första analysen som använder förhämtningen sparar tid tack vare
+        # den; senare träffar hade ändå fått skrapningen från cache/SingleFlight
+        if not entry.converted:
+            entry.converted = True
+            self._conversions += 1
+            self._seconds_saved += saved
+
+    def take_scrape(self, url: str) -> Optional[Dict[str, Any]]:
+        """Förhämtad skrapning av URL:en om den finns och är färsk."""
+        entry = self._entries.get(url)
+        if entry is None or entry.status != "done" or not self._fresh(entry):
+            return None
+        self._hits += 1
+        self._convert(entry, entry.scrape_seconds)
+        return entry.data
+
+    def note_join(self, url: str) -> None:
+        """Analysen ansluter till en pågående förhämtning; tiden den redan gått räknas som sparad."""
+        entry = self._entries.get(url)
+        if entry is not None and entry.status == "running" and scrape_flights.in_flight(url):
+            self._joins += 1
+            self._convert(entry, time.monotonic() - entry.started_at)
+
+    def take_visitors(self, domain: str) -> Optional[str]:
+        for entry in self._entries.values():
+            if (entry.domain == domain and entry.visitors is not None
+                    and entry.finished_at is not None and self._fresh(entry)):
+                return entry.visitors
+        return None
+
+    async def stop(self) -> None:
+        tasks: List[asyncio.Task] = [
+            entry.task for entry in self._entries.values()
+            if entry.task is not None and not entry.task.done()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._purge()
+        states = [entry.status for entry in self._entries.values()]
+        completed = self._counts["completed"]
+        return {
+            "queued": states.count("queued"),
+            "running": states.count("running"),
+            "cached": states.count("done"),
+            **self._counts,
+            "conversions": self._conversions,
+            "conversion_rate": round(self._conversions / completed, 3) if completed else None,
+            "cache_hits": self._hits,
+            "joined_in_flight": self._joins,
+            "seconds_saved": round(self._seconds_saved, 2),
+            "avg_seconds_saved": round(self._seconds_saved / self._conversions, 2)
+            if self._conversions else None,
+        }
+
+
+prefetcher = Prefetcher(
+    ttl=float(os.getenv("PREFETCH_TTL_S", "120")),
+    max_concurrent=int(os.getenv("PREFETCH_MAX_CONCURRENT", "1")),
+    per_minute=int(os.getenv("PREFETCH_PER_MINUTE", "10")),
+    max_pending_per_user=int(os.getenv("PREFETCH_MAX_PENDING_PER_USER", "2")),
+)
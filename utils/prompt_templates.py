@@ -0,0 +1,536 @@
+import json
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from string import Formatter
+from typing import Any, Deque, Dict, FrozenSet, Optional
+
+from utils.logging_utils import logger
+from utils.page_audit import audit_facts, page_auditor
+
+JSON_ONLY = (
+    "Svara ENDAST med ett JSON-objekt i exakt det format som anges nedan. "
+    "Inkludera inga andra förklaringar, kommentarer eller markörer utanför JSON-objektet. "
+    "Svara på svenska."
+)
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """
+    En versionerad prompt. `instructions` är statisk och ligger först så att
+    leverantörens prefix-cache kan återanvända den mellan sidor; allt som
+    varierar (URL, skrapad data, tidigare svar) fylls i `data` sist.
+    """
+    name: str
+    version: int
+    instructions: str
+    data: str
+    max_tokens: int = 1000
+    temperature: float = 0.7
+    # None: modellkedjan för prompttypen avgör (utils.llm_hedging)
+    model: Optional[str] = None
+    fields: FrozenSet[str] = field(init=False)
+
+    def __post_init__(self):
+        # Platshållarna kontrolleras en gång vid registrering, inte per anrop
+        names = frozenset(name for _, name, _, _ in Formatter().parse(self.data) if name)
+        object.__setattr__(self, "fields", names)
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, values: Dict[str, Any]) -> "RenderedPrompt":
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Mall {self.key} saknar värden för: {', '.join(sorted(missing))}")
+        return RenderedPrompt(f"{self.instructions}\n\n{self.data.format_map(values)}", self)
+
+
+class RenderedPrompt(str):
+    """Färdig prompttext som bär med sig mallen (modell, max_tokens, temperatur)."""
+
+    template: PromptTemplate
+
+    def __new__(cls, text: str, template: PromptTemplate):
+        prompt = super().__new__(cls, text)
+        prompt.template = template
+        return prompt
+
+
+class _TemplateStats:
+    def __init__(self, sample_size: int = 256):
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Strömmar som stängts direkt efter JSON-objektet
+        self.early_stops = 0
+        self.latencies: Deque[float] = deque(maxlen=sample_size)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return round(ordered[min(int(p * len(ordered)), len(ordered) - 1)], 3)
+
+
+class PromptRegistry:
+    """
+    Alla promptmallar per namn och version. Den aktiva versionen är den
+    högsta registrerade, om den inte låsts via `pinned` (PROMPT_TEMPLATE_VERSIONS).
+    Förbrukning och svarstid registreras per mallversion.
+    """
+
+    def __init__(self, pinned: Optional[Dict[str, int]] = None):
+        self._templates: Dict[str, Dict[int, PromptTemplate]] = {}
+        self._pinned = pinned or {}
+        self._stats: Dict[str, _TemplateStats] = {}
+
+    def register(self, template: PromptTemplate) -> PromptTemplate:
+        versions = self._templates.setdefault(template.name, {})
+        if template.version in versions:
+            raise ValueError(f"Mallen {template.key} är redan registrerad")
+        versions[template.version] = template
+        return template
+
+    def get(self, name: str, version: Optional[int] = None) -> PromptTemplate:
+        versions = self._templates[name]
+        version = version or self._pinned.get(name)
+        # En låst version som inte finns faller tillbaka till den senaste
+        return versions.get(version) or versions[max(versions)]
+
+    def render(self, name: str, values: Dict[str, Any]) -> RenderedPrompt:
+        return self.get(name).render(values)
+
+    def record(self, template: PromptTemplate, latency: float, usage: Optional[Dict[str, Any]] = None,
+               error: bool = False, early_stop: bool = False) -> None:
+        stats = self._stats.get(template.key)
+        if stats is None:
+            stats = self._stats[template.key] = _TemplateStats()
+        stats.requests += 1
+        if error:
+            stats.errors += 1
+            return
+        stats.latencies.append(latency)
+        stats.early_stops += early_stop
+        stats.prompt_tokens += (usage or {}).get("prompt_tokens", 0)
+        stats.completion_tokens += (usage or {}).get("completion_tokens", 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        templates = {}
+        for name in sorted(self._templates):
+            active = self.get(name)
+            templates[name] = {"active": active.key, "versions": sorted(self._templates[name])}
+        usage = {}
+        for key, stats in sorted(self._stats.items()):
+            succeeded = max(stats.requests - stats.errors, 1)
+            usage[key] = {
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "prompt_tokens": stats.prompt_tokens,
+                "completion_tokens": stats.completion_tokens,
+                "avg_completion_tokens": round(stats.completion_tokens / succeeded, 1),
+                "early_stops": stats.early_stops,
+                "p50_s": stats.percentile(0.5),
+                "p95_s": stats.percentile(0.95),
+            }
+        return {"templates": templates, "usage": usage}
+
+
+def _joined(values) -> str:
+    return ", ".join(values)
+
+
+class _AuditFacts:
+    """Granskningsfakta som körs först när en mall faktiskt använder {audit_facts}."""
+
+    def __init__(self, extracted_data: Dict[str, Any], url: str):
+        self._extracted_data = extracted_data
+        self._url = url
+        self._text: Optional[str] = None
+
+    def __format__(self, spec: str) -> str:
+        if self._text is None:
+            self._text = page_auditor.facts(self._extracted_data, self._url)
+        return format(self._text, spec)
+
+
+def page_values(extracted_data: Dict[str, Any], url: str,
+                audit: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Värden ur skrapningen som sidmallarna fyller i sist i prompten. audit är
+    analysens redan körda granskning; utan den körs reglerna bara om en mall
+    använder fakta.
+    """
+    security = extracted_data["security_elements"]
+    return {
+        "url": url,
+        "title": extracted_data["title"],
+        "meta_description": extracted_data["meta_description"],
+        "h1": _joined(extracted_data["headings"]["h1"]),
+        "h2": _joined(extracted_data["headings"]["h2"]),
+        "buttons": _joined(extracted_data["buttons"]),
+        "navigation": _joined(extracted_data["navigation"]),
+        "colors": _joined(extracted_data["design_summary"]["colors"]),
+        "fonts": _joined(extracted_data["design_summary"]["fonts"]),
+        "image_count": len(extracted_data["images"]),
+        "prices": _joined(extracted_data["prices"]) if extracted_data["prices"] else "Ingen pris hittad",
+        "ssl": "Ja" if security["ssl"] else "Nej",
+        "certifications": _joined(security["certifications"]) or "Inga hittade",
+        "payment_methods": _joined(security["payment_methods"]) or "Inga hittade",
+        # Regelbaserade kontroller (utils.page_audit) som modellen inte behöver härleda
+        "audit_facts": audit_facts(audit) if audit is not None else _AuditFacts(extracted_data, url),
+    }
+
+
+SECTION_FORMAT = """{{
+  "summary": "{summary}",
+  "observations": [
+    "{item} 1",
+    "{item} 2"
+  ],
+  "recommendations": "{recommendations}"
+}}"""
+
+
+def _section_format(summary: str, item: str, recommendations: str) -> str:
+    return SECTION_FORMAT.format(summary=summary, item=item, recommendations=recommendations)
+
+
+def _specialized_format(fields: Dict[str, str]) -> str:
+    return json.dumps(fields, ensure_ascii=False, indent=2)
+
+
+PAGE_DATA = """Webbplats: {url}
+- Titel: {title}
+- Meta-beskrivning: {meta_description}"""
+
+HEADINGS_DATA = """
+- H1-rubriker: {h1}
+- H2-rubriker: {h2}"""
+
+AUDIT_DATA = """
+- Fakta (automatiska kontroller): {audit_facts}"""
+
+# Gemensam instruktion för mallar som får granskningens fakta
+AUDIT_NOTE = ("Raden Fakta innehåller automatiska kontroller som redan är gjorda och korrekta "
+              "(längder, antal, HTTPS, alt-text). Upprepa dem inte; bygg vidare på dem.")
+
+SUMMARY_DATA = """SEO-analys:
+{seo_analysis}
+
+UX-analys:
+{ux_analysis}
+
+Innehållsanalys:
+{content_analysis}"""
+
+
+def _register_defaults(registry: PromptRegistry) -> None:
+    register = registry.register
+
+    register(PromptTemplate("seo", 1, instructions=f"""Du är en erfaren SEO-specialist. Analysera webbplatsen som beskrivs i datan längst ned.
+
+Analysera:
+1. Användning av relevanta sökord.
+2. Kvalitet och effektivitet i titel och meta-beskrivning.
+3. Eventuella tekniska SEO-problem.
+
+Ge en övergripande bedömning, lista några tydliga observationer (gärna i punktform) och ange konkreta rekommendationer.
+
+{JSON_ONLY}
+{_section_format("Övergripande bedömning av SEO.", "Observation", "Dina konkreta rekommendationer för SEO.")}""",
+        data=PAGE_DATA + HEADINGS_DATA))
+
+    register(PromptTemplate("ux", 1, instructions=f"""Du är en senior UX-designer. Analysera webbplatsen som anges längst ned med fokus på användarupplevelsen. Utgå ifrån:
+- Layout, färgschema och typografi.
+- Navigering och användarvänlighet.
+- Användarflöde och konvertering.
+
+Ge en övergripande bedömning, lista specifika observationer (gärna i punktform) och ge konkreta förbättringsförslag.
+
+{JSON_ONLY}
+{_section_format("Övergripande bedömning av UX.", "Observation", "Dina konkreta UX-rekommendationer.")}""",
+        data="Webbplats: {url}"))
+
+    register(PromptTemplate("content", 1, instructions=f"""Du är en erfaren innehållsstrateg och copywriter. Analysera webbplatsen som anges längst ned utifrån:
+- Tydlighet och relevans i innehållet.
+- Struktur och läsbarhet.
+- Hur väl innehållet kommunicerar webbplatsens syfte.
+
+Ge en övergripande bedömning, lista tydliga observationer (gärna i punktform) samt konkreta rekommendationer för att förbättra innehållet.
+
+{JSON_ONLY}
+{_section_format("Övergripande bedömning av innehållet.", "Observation", "Dina konkreta innehållsrekommendationer.")}""",
+        data="Webbplats: {url}"))
+
+    register(PromptTemplate("competitor_seo", 1, instructions=f"""Du är en erfaren SEO-specialist med fokus på konkurrentanalys. Analysera webbplatsen som beskrivs i datan längst ned.
+
+Analysera:
+1. Användning av relevanta sökord.
+2. Kvalitet och effektivitet i titel och meta-beskrivning.
+3. Teknik och struktur som ger dem fördelar i sökresultaten.
+
+Identifiera ENDAST deras styrkor inom SEO - fokusera inte på svagheter eller förbättringsförslag.
+Ge en övergripande bedömning, lista några tydliga styrkor (gärna i punktform) och identifiera vad som gör deras SEO-strategi framgångsrik.
+
+{JSON_ONLY}
+{_section_format("Övergripande bedömning av konkurrentens SEO-styrkor.", "Styrka", "Vilka strategier som gör deras SEO framgångsrik.")}""",
+        data=PAGE_DATA + HEADINGS_DATA))
+
+    register(PromptTemplate("competitor_ux", 1, instructions=f"""Du är en senior UX-designer med fokus på konkurrentanalys. Analysera webbplatsen som anges längst ned med fokus på användarupplevelsen. Utgå ifrån:
+- Layout, färgschema och typografi.
+- Navigering och användarvänlighet.
+- Användarflöde och konvertering.
+
+Identifiera ENDAST deras styrkor inom UX/UI - fokusera inte på brister eller förbättringsområden.
+Ge en övergripande bedömning, lista specifika positiva observationer (gärna i punktform) och beskriv varför deras UX-strategi är effektiv.
+
+{JSON_ONLY}
+{_section_format("Övergripande bedömning av konkurrentens UX-styrkor.", "Styrka", "Varför deras UX-strategi är effektiv.")}""",
+        data="Webbplats: {url}"))
+
+    register(PromptTemplate("competitor_content", 1, instructions=f"""Du är en erfaren innehållsstrateg och copywriter med fokus på konkurrentanalys. Analysera webbplatsen som anges längst ned utifrån:
+- Tydlighet och relevans i innehållet.
+- Struktur och läsbarhet.
+- Hur väl innehållet kommunicerar webbplatsens syfte.
+
+Identifiera ENDAST deras styrkor i innehållsstrategin - fokusera inte på svagheter eller förbättringsområden.
+Ge en övergripande bedömning, lista tydliga innehållsstyrkor (gärna i punktform) samt förklara varför innehållet är effektivt för deras målgrupp.
+
+{JSON_ONLY}
+{_section_format("Övergripande bedömning av konkurrentens innehållsstyrkor.", "Styrka", "Vad som gör deras innehållsstrategi framgångsrik.")}""",
+        data="Webbplats: {url}"))
+
+    # v2: granskningens fakta ersätter det modellen tidigare själv fick räkna ut
+    register(PromptTemplate("seo", 2, instructions=f"""Du är en erfaren SEO-specialist. Analysera webbplatsen som beskrivs i datan längst ned.
+
+Analysera:
+1. Användning av relevanta sökord i titel, meta-beskrivning och rubriker.
+2. Hur väl titel och meta-beskrivning säljer in sidan i sökresultaten.
+3. Tekniska SEO-problem utöver kontrollerna i Fakta.
+
+{AUDIT_NOTE}
+Ge en övergripande bedömning, lista några tydliga observationer (gärna i punktform) och ange konkreta rekommendationer.
+
+{JSON_ONLY}
+{_section_format("Övergripande bedömning av SEO.", "Observation", "Dina konkreta rekommendationer för SEO.")}""",
+        data=PAGE_DATA + HEADINGS_DATA + AUDIT_DATA))
+
+    register(PromptTemplate("competitor_seo", 2, instructions=f"""Du är en erfaren SEO-specialist med fokus på konkurrentanalys. Analysera webbplatsen som beskrivs i datan längst ned.
+
+Analysera:
+1. Användning av relevanta sökord i titel, meta-beskrivning och rubriker.
+2. Teknik och struktur som ger dem fördelar i sökresultaten.
+
+{AUDIT_NOTE}
+Identifiera ENDAST deras styrkor inom SEO - fokusera inte på svagheter eller förbättringsförslag.
+Ge en övergripande bedömning, lista några tydliga styrkor (gärna i punktform) och identifiera vad som gör deras SEO-strategi framgångsrik.
+
+{JSON_ONLY}
+{_section_format("Övergripande bedömning av konkurrentens SEO-styrkor.", "Styrka", "Vilka strategier som gör deras SEO framgångsrik.")}""",
+        data=PAGE_DATA + HEADINGS_DATA + AUDIT_DATA))
+
+    register(PromptTemplate("landing_page", 1, instructions=f"""Du är en expert på konverteringsoptimering och landningssidor. Analysera webbsidan som beskrivs i datan längst ned.
+
+Analysera:
+1. Tydlighet i budskapet och "call-to-action"
+2. Hur väl landningssidan kan konvertera besökare
+3. Struktur och informationsarrangemang
+4. Övertalningsförmåga och säljargument
+
+{JSON_ONLY}
+{_specialized_format({
+    "summary": "Övergripande bedömning av landningssidan",
+    "clarity": "Analys av budskapets tydlighet",
+    "conversion_potential": "Bedömning av konverteringspotential",
+    "structure": "Bedömning av sidans struktur",
+    "persuasiveness": "Analys av övertalningsförmåga",
+    "recommendations": "Dina konkreta rekommendationer för förbättring",
+})}""",
+        data=PAGE_DATA + HEADINGS_DATA + "\n- Knappar: {buttons}"))
+
+    register(PromptTemplate("product_page", 1, instructions=f"""Du är en expert på e-handel och copywriting. Analysera produktsidan som beskrivs i datan längst ned.
+
+Analysera:
+1. Hur tydlig och säljande produktbeskrivningen är
+2. Om målgruppen nås effektivt
+3. Hur SEO-optimerat innehållet är
+4. Vad som kan förbättras för att öka konverteringar
+
+{JSON_ONLY}
+{_specialized_format({
+    "summary": "Övergripande bedömning av produktsidan",
+    "targeting": "Hur väl kommunikationen matchar målgruppen",
+    "seo": "SEO-analys av produktsidan",
+    "persuasiveness": "Analys av produktbeskrivningens övertygande kraft",
+    "recommendations": "Konkreta förbättringsförslag",
+})}""",
+        data=PAGE_DATA + HEADINGS_DATA + "\n- Bilder: {image_count} bilder hittades\n- Priser: {prices}"))
+
+    register(PromptTemplate("trust_check", 1, instructions=f"""Du är en expert på digitalt förtroende och säkerhet. Analysera webbplatsen som beskrivs i datan längst ned från ett pålitlighetsperspektiv.
+
+Analysera:
+1. Professionalism och förtroendeingivande design
+2. Säkerhetsindikatorer
+3. Transparens kring företaget/verksamheten
+4. Riskindikatorer (eller avsaknad därav)
+
+{JSON_ONLY}
+{_specialized_format({
+    "summary": "Övergripande bedömning av webbplatsens pålitlighet",
+    "professionalism": "Analys av design och professionellt intryck",
+    "security_indicators": "Analys av säkerhetsindikatorer",
+    "transparency": "Bedömning av transparens kring verksamheten",
+    "risk_assessment": "Bedömning av eventuella riskfaktorer",
+    "recommendations": "Förslag på förbättringar för ökat förtroende",
+})}""",
+        data=PAGE_DATA + "\n- SSL-säkerhet: {ssl}\n- Certifieringar: {certifications}"
+                         "\n- Betalningsmetoder: {payment_methods}"))
+
+    register(PromptTemplate("trust_check", 2, instructions=f"""Du är en expert på digitalt förtroende och säkerhet. Analysera webbplatsen som beskrivs i datan längst ned från ett pålitlighetsperspektiv.
+
+Analysera:
+1. Professionalism och förtroendeingivande design
+2. Säkerhetsindikatorer utöver HTTPS
+3. Transparens kring företaget/verksamheten
+4. Riskindikatorer (eller avsaknad därav)
+
+{AUDIT_NOTE}
+
+{JSON_ONLY}
+{_specialized_format({
+    "summary": "Övergripande bedömning av webbplatsens pålitlighet",
+    "professionalism": "Analys av design och professionellt intryck",
+    "security_indicators": "Analys av säkerhetsindikatorer",
+    "transparency": "Bedömning av transparens kring verksamheten",
+    "risk_assessment": "Bedömning av eventuella riskfaktorer",
+    "recommendations": "Förslag på förbättringar för ökat förtroende",
+})}""",
+        data=PAGE_DATA + "\n- Certifieringar: {certifications}\n- Betalningsmetoder: {payment_methods}" + AUDIT_DATA))
+
+    register(PromptTemplate("brand_analysis", 1, instructions=f"""Du är en varumärkesexpert med djup förståelse för digital positionering. Analysera webbplatsen som beskrivs i datan längst ned från ett varumärkesperspektiv.
+
+Analysera:
+1. Varumärkets positionering och löfte
+2. Tonalitet och kommunikationsstil
+3. Visuell identitet och konsekvens
+4. Hur målgruppen tilltalas
+
+{JSON_ONLY}
+{_specialized_format({
+    "summary": "Övergripande analys av varumärket",
+    "positioning": "Bedömning av varumärkets positionering",
+    "tone_of_voice": "Analys av tonalitet och kommunikationsstil",
+    "visual_identity": "Bedömning av visuell identitet",
+    "audience_appeal": "Hur effektivt varumärket tilltalar sin målgrupp",
+    "recommendations": "Förslag på förbättringar för tydligare varumärkeskommunikation",
+})}""",
+        data=PAGE_DATA + "\n- Färger: {colors}\n- Typsnitt: {fonts}\n- H1-rubriker: {h1}"))
+
+    register(PromptTemplate("mobile_experience", 1, instructions=f"""Du är en expert på mobilanvändarvänlighet och responsiv design. Analysera webbplatsen som beskrivs i datan längst ned från ett mobilperspektiv.
+
+För denna analys, föreställ dig att du tittar på webbplatsen på en mobil enhet. Analysera:
+1. Mobilanpassning och responsiv design
+2. Lättnavigerad på liten skärm
+3. Laddningstider och prestanda för mobila enheter
+4. Touch-vänlighet och användbarhet
+
+{JSON_ONLY}
+{_specialized_format({
+    "summary": "Övergripande bedömning av mobilupplevelsen",
+    "responsiveness": "Analys av responsiv design",
+    "navigation": "Bedömning av navigationen på mobil",
+    "performance": "Prestanda och laddningstider för mobil",
+    "usability": "Touch-vänlighet och mobilanpassad användbarhet",
+    "recommendations": "Förslag på förbättringar för mobilupplevelsen",
+})}""",
+        data=PAGE_DATA + "\n- Navigation: {navigation}"))
+
+    # Designbetyget är fyra korta fält; lägre temperatur ger stabilare poäng
+    register(PromptTemplate("design", 1, max_tokens=250, temperature=0.3,
+        instructions=f"""Du är en extremt kritisk och professionell UX- och designexpert med mycket höga krav.
+Analysera webbsidan som beskrivs i datan längst ned noggrant utifrån dess designelement.
+
+Ge ett kritiskt och mycket strängt betyg enligt nedanstående skala (0.0 mycket dåligt, 1.0 perfekt):
+
+1. Usability (användarvänlighet)
+2. Aesthetics (visuell estetik)
+3. Performance (teknisk prestanda)
+
+Svara ENDAST med exakt följande JSON-format:
+{{
+  "usability": 0.xx,
+  "aesthetics": 0.xx,
+  "performance": 0.xx,
+  "comment": "Kort, mycket kritisk och professionell motivering"
+}}""",
+        data="""Webbplats: {url}
+
+Titel på sidan:
+{title}
+
+Använda färger:
+{colors}
+
+Typografi:
+{fonts}
+
+Huvudrubriker (H1):
+{h1}
+
+Underrubriker (H2):
+{h2}
+
+Navigationsstruktur:
+{navigation}
+
+Knapptexter:
+{buttons}"""))
+
+    register(PromptTemplate("recommendations_summary", 1, max_tokens=800, instructions=f"""Du är en expert på webbanalys. Baserat på analyserna längst ned, ge en sammanfattning och konkreta rekommendationer.
+
+Returnera ENDAST ett JSON-objekt i detta format:
+
+{_specialized_format({
+    "seo_recommendations": "Förbättringsförslag relaterade till SEO.",
+    "ux_recommendations": "Förbättringsförslag relaterade till användarupplevelsen.",
+    "content_recommendations": "Förbättringsförslag relaterade till innehållet.",
+    "overall_summary": "En sammanfattning av de största förbättringsområdena på sidan.",
+})}""",
+        data=SUMMARY_DATA))
+
+    register(PromptTemplate("competitor_strengths_summary", 1, max_tokens=800, instructions=f"""Du är en expert inom konkurrentanalys för e-handel och digitala tjänster. Längst ned finns resultaten från tre professionella analyser av en konkurrents webbsida.
+
+Sammanfatta de viktigaste styrkorna och framgångsfaktorerna från dessa analyser. Dela in ditt svar i tre sektioner:
+1. SEO-styrkor
+2. UX-styrkor
+3. Innehållsstyrkor
+
+Ge också en övergripande sammanfattning av deras huvudsakliga konkurrensfördelar.
+
+Svara ENDAST med ett JSON-objekt i exakt följande format:
+{_specialized_format({
+    "seo_strengths": "text",
+    "ux_strengths": "text",
+    "content_strengths": "text",
+    "overall_strengths": "text",
+})}""",
+        data=SUMMARY_DATA))
+
+
+def _pinned_versions() -> Dict[str, int]:
+    raw = os.getenv("PROMPT_TEMPLATE_VERSIONS")
+    if not raw:
+        return {}
+    try:
+        return {name: int(version) for name, version in json.loads(raw).items()}
+    except (ValueError, AttributeError) as e:
+        logger.error(f"❌ Ogiltig PROMPT_TEMPLATE_VERSIONS, använder senaste versionerna: {e}")
+        return {}
+
+
+prompt_registry = PromptRegistry(pinned=_pinned_versions())
+_register_defaults(prompt_registry)
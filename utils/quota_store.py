@@ -0,0 +1,402 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from utils.logging_utils import logger
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Redis är valfritt; SQLite används som standard
+    redis_asyncio = None
+
+DAY_SECONDS = 24 * 60 * 60
+TRIAL_DAYS = 3
+
+
+@dataclass(frozen=True)
+class QuotaRule:
+    limit: int
+    window_seconds: int
+
+
+# Glidande fönster per plan; planer som saknas här och inte är obegränsade
+# faller tillbaka på "free" (gratis/provperiod: 3 analyser per dygn)
+QUOTA_RULES: Dict[str, QuotaRule] = {
+    "basic": QuotaRule(limit=10, window_seconds=7 * DAY_SECONDS),
+    "free": QuotaRule(limit=3, window_seconds=DAY_SECONDS),
+}
+UNLIMITED_PLANS = ("pro",)
+# Händelser äldre än det längsta fönstret behövs aldrig mer
+MAX_WINDOW_SECONDS = max(rule.window_seconds for rule in QUOTA_RULES.values())
+
+
+@dataclass
+class UserState:
+    plan: Optional[str] = None
+    is_admin: bool = False
+    trial_start: Optional[float] = None
+    trial_started_now: bool = False
+
+
+@dataclass
+class QuotaStatus:
+    quota_plan: str
+    unlimited: bool
+    allowed: bool
+    used: int = 0
+    limit: Optional[int] = None
+
+    @property
+    def remaining(self) -> Optional[int]:
+        if self.unlimited:
+            return None
+        return max(self.limit - self.used, 0)
+
+
+def quota_plan(plan: Optional[str], is_admin: bool) -> str:
+    if is_admin:
+        return "admin"
+    if plan in UNLIMITED_PLANS or plan in QUOTA_RULES:
+        return plan
+    return "free"
+
+
+def _status(plan: Optional[str], is_admin: bool, used: int, allowed: bool) -> QuotaStatus:
+    resolved = quota_plan(plan, is_admin)
+    rule = QUOTA_RULES.get(resolved)
+    if rule is None:
+        return QuotaStatus(quota_plan=resolved, unlimited=True, allowed=True)
+    return QuotaStatus(quota_plan=resolved, unlimited=False, allowed=allowed,
+                       used=used, limit=rule.limit)
+
+
+class QuotaBackend(ABC):
+    """
+    Gränssnitt för delad kvot- och planlagring. Varje metod är en enda
+    atomär operation (en transaktion respektive ett skriptanrop) så att flera
+    workers kan dela samma lagring utan kapplöpningar.
+    """
+
+    @abstractmethod
+    async def get_user(self, user_id: str) -> UserState:
+        ...
+
+    @abstractmethod
+    async def ensure_user(self, user_id: str, email: Optional[str], now: float) -> UserState:
+        """Returnerar användarens tillstånd och startar provperioden om användaren är ny."""
+
+    @abstractmethod
+    async def set_plan(self, user_id: str, plan: str) -> None:
+        ...
+
+    @abstractmethod
+    async def set_admin(self, user_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def check(self, user_id: str, now: float) -> QuotaStatus:
+        """Läser kvarvarande kvot utan att förbruka något."""
+
+    @abstractmethod
+    async def consume(self, user_id: str, now: float) -> QuotaStatus:
+        """Atomär increment-and-check: förbrukar en analys om kvoten tillåter."""
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteQuotaBackend(QuotaBackend):
+    """
+    Kvoter i en SQLite-fil (WAL) som alla workers på samma värd delar.
+    Förbrukning lagras som tidsstämplade händelser; fönstret glider och
+    utgångna händelser rensas per användare vid varje förbrukning samt
+    globalt med jämna mellanrum.
+    """
+
+    _PURGE_EVERY = 500
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        # Skyddar räknaren och listan över trådarnas anslutningar
+        self._lock = threading.Lock()
+        self._operations = 0
+        self._connections: List[sqlite3.Connection] = []
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS quota_user ("
+                "user_id TEXT PRIMARY KEY, plan TEXT, is_admin INTEGER NOT NULL DEFAULT 0, "
+                "trial_start REAL, email TEXT)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS quota_event (user_id TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_quota_event_user_ts ON quota_event (user_id, ts)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Varje tråd använder bara sin egen anslutning; close() stänger
+            # dem från event-loopens tråd vid avstängning
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    class _Transaction:
+        def __init__(self, connection: sqlite3.Connection, write: bool):
+            self.connection = connection
+            self.write = write
+
+        def __enter__(self) -> sqlite3.Connection:
+            # IMMEDIATE tar skrivlåset direkt så att läs-räkna-skriv blir atomärt;
+            # rena läsningar tar inget skrivlås och köar inte bakom förbrukningar
+            self.connection.execute("BEGIN IMMEDIATE" if self.write else "BEGIN DEFERRED")
+            return self.connection
+
+        def __exit__(self, exc_type, exc, tb) -> None:
+            self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+    def _transaction(self, write: bool = True) -> "_Transaction":
+        return self._Transaction(self._connection(), write)
+
+    def _user_row(self, connection, user_id: str):
+        return connection.execute(
+            "SELECT plan, is_admin, trial_start FROM quota_user WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+    def _get_user(self, user_id: str) -> UserState:
+        row = self._user_row(self._connection(), user_id)
+        if row is None:
+            return UserState()
+        return UserState(plan=row[0], is_admin=bool(row[1]), trial_start=row[2])
+
+    def _ensure_user(self, user_id: str, email: Optional[str], now: float) -> UserState:
+        with self._transaction() as connection:
+            created = connection.execute(
+                "INSERT OR IGNORE INTO quota_user (user_id, trial_start, email) VALUES (?, ?, ?)",
+                (user_id, now, email),
+            ).rowcount
+            row = connection.execute(
+                "SELECT plan, is_admin, trial_start FROM quota_user WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row[2] is None and not row[0] and not row[1]:
+                # Användaren fanns (t.ex. via checkout) men har aldrig haft provperiod
+                connection.execute(
+                    "UPDATE quota_user SET trial_start = ?, email = COALESCE(email, ?) "
+                    "WHERE user_id = ?", (now, email, user_id)
+                )
+                row, created = (row[0], row[1], now), 1
+        return UserState(plan=row[0], is_admin=bool(row[1]), trial_start=row[2],
+                         trial_started_now=bool(created))
+
+    def _set_plan(self, user_id: str, plan: str) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO quota_user (user_id, plan) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET plan = excluded.plan",
+                (user_id, plan),
+            )
+
+    def _set_admin(self, user_id: str) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO quota_user (user_id, is_admin) VALUES (?, 1) "
+                "ON CONFLICT (user_id) DO UPDATE SET is_admin = 1",
+                (user_id,),
+            )
+
+    def _check_or_consume(self, user_id: str, now: float, consume: bool) -> QuotaStatus:
+        with self._transaction(write=consume) as connection:
+            row = self._user_row(connection, user_id)
+            plan, is_admin = (row[0], bool(row[1])) if row else (None, False)
+            rule = QUOTA_RULES.get(quota_plan(plan, is_admin))
+            if rule is None:
+                return _status(plan, is_admin, 0, True)
+
+            cutoff = now - rule.window_seconds
+            if consume:
+                connection.execute(
+                    "DELETE FROM quota_event WHERE user_id = ? AND ts <= ?", (user_id, cutoff)
+                )
+            used = connection.execute(
+                "SELECT COUNT(*) FROM quota_event WHERE user_id = ? AND ts > ?", (user_id, cutoff)
+            ).fetchone()[0]
+            allowed = used < rule.limit
+            if consume and allowed:
+                connection.execute(
+                    "INSERT INTO quota_event (user_id, ts) VALUES (?, ?)", (user_id, now)
+                )
+                used += 1
+            if consume:
+                with self._lock:
+                    self._operations += 1
+                    purge = self._operations % self._PURGE_EVERY == 0
+                if purge:
+                    connection.execute(
+                        "DELETE FROM quota_event WHERE ts <= ?", (now - MAX_WINDOW_SECONDS,)
+                    )
+        return _status(plan, is_admin, used, allowed)
+
+    async def get_user(self, user_id):
+        return await asyncio.to_thread(self._get_user, user_id)
+
+    async def ensure_user(self, user_id, email, now):
+        return await asyncio.to_thread(self._ensure_user, user_id, email, now)
+
+    async def set_plan(self, user_id, plan):
+        await asyncio.to_thread(self._set_plan, user_id, plan)
+
+    async def set_admin(self, user_id):
+        await asyncio.to_thread(self._set_admin, user_id)
+
+    async def check(self, user_id, now):
+        return await asyncio.to_thread(self._check_or_consume, user_id, now, False)
+
+    async def consume(self, user_id, now):
+        return await asyncio.to_thread(self._check_or_consume, user_id, now, True)
+
+    async def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+
+# Hela kontrollen körs i Redis så att räkna-och-öka blir atomärt och bara
+# kostar en rundresa. Förbrukningen ligger i en sorted set per användare med
+# tidsstämpeln som score; nyckeln får TTL = fönstret så att inaktiva
+# användare försvinner av sig själva.
+_REDIS_QUOTA_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'plan', 'is_admin')
+local plan = state[1] or ''
+local is_admin = state[2] == '1'
+local rules = cjson.decode(ARGV[4])
+local unlimited = cjson.decode(ARGV[5])
+local resolved = 'free'
+if is_admin then
+  resolved = 'admin'
+elseif unlimited[plan] or rules[plan] then
+  resolved = plan
+end
+local rule = rules[resolved]
+if not rule then
+  return {plan, state[2] or '0', -1, 1}
+end
+local now = tonumber(ARGV[1])
+local cutoff = now - rule[2]
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', cutoff)
+local used = redis.call('ZCARD', KEYS[2])
+local allowed = used < rule[1]
+if ARGV[3] == '1' and allowed then
+  redis.call('ZADD', KEYS[2], now, ARGV[2])
+  redis.call('EXPIRE', KEYS[2], rule[2])
+  used = used + 1
+end
+return {plan, state[2] or '0', used, allowed and 1 or 0}
+"""
+
+_REDIS_ENSURE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'plan', 'is_admin', 'trial_start')
+if not state[3] and not state[1] and state[2] ~= '1' then
+  redis.call('HSET', KEYS[1], 'trial_start', ARGV[1], 'email', ARGV[2])
+  return {state[1] or '', state[2] or '0', ARGV[1], 1}
+end
+return {state[1] or '', state[2] or '0', state[3] or '', 0}
+"""
+
+
+class RedisQuotaBackend(QuotaBackend):
+    """Kvoter i Redis (eller kompatibel server, t.ex. Valkey/KeyDB) via Lua-skript."""
+
+    def __init__(self, url: str, prefix: str = "quota"):
+        if redis_asyncio is None:
+            raise RuntimeError("QUOTA_BACKEND=redis kräver paketet redis")
+        self.prefix = prefix
+        self._client = redis_asyncio.from_url(url, decode_responses=True)
+        self._quota = self._client.register_script(_REDIS_QUOTA_SCRIPT)
+        self._ensure = self._client.register_script(_REDIS_ENSURE_SCRIPT)
+        self._rules = json.dumps({plan: [rule.limit, rule.window_seconds]
+                                  for plan, rule in QUOTA_RULES.items()})
+        self._unlimited = json.dumps({plan: True for plan in UNLIMITED_PLANS})
+
+    def _user_key(self, user_id: str) -> str:
+        return f"{self.prefix}:user:{user_id}"
+
+    def _events_key(self, user_id: str) -> str:
+        return f"{self.prefix}:events:{user_id}"
+
+    async def get_user(self, user_id):
+        plan, is_admin, trial_start = await self._client.hmget(
+            self._user_key(user_id), "plan", "is_admin", "trial_start"
+        )
+        return UserState(plan=plan or None, is_admin=is_admin == "1",
+                         trial_start=float(trial_start) if trial_start else None)
+
+    async def ensure_user(self, user_id, email, now):
+        plan, is_admin, trial_start, created = await self._ensure(
+            keys=[self._user_key(user_id)], args=[now, email or ""]
+        )
+        return UserState(plan=plan or None, is_admin=is_admin == "1",
+                         trial_start=float(trial_start) if trial_start else None,
+                         trial_started_now=bool(created))
+
+    async def set_plan(self, user_id, plan):
+        await self._client.hset(self._user_key(user_id), "plan", plan)
+
+    async def set_admin(self, user_id):
+        await self._client.hset(self._user_key(user_id), "is_admin", "1")
+
+    async def _run_quota(self, user_id: str, now: float, consume: bool) -> QuotaStatus:
+        plan, is_admin, used, allowed = await self._quota(
+            keys=[self._user_key(user_id), self._events_key(user_id)],
+            args=[now, f"{now}:{uuid.uuid4().hex[:8]}", "1" if consume else "0",
+                  self._rules, self._unlimited],
+        )
+        return _status(plan or None, is_admin == "1", max(int(used), 0), bool(allowed))
+
+    async def check(self, user_id, now):
+        return await self._run_quota(user_id, now, False)
+
+    async def consume(self, user_id, now):
+        return await self._run_quota(user_id, now, True)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def _default_sqlite_path() -> str:
+    database_url = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+    if database_url.startswith("sqlite:///"):
+        # Samma fil som övrig data; tabellerna heter quota_* och krockar inte
+        return database_url[len("sqlite:///"):]
+    return "./quota.db"
+
+
+def create_quota_backend() -> QuotaBackend:
+    backend = os.getenv("QUOTA_BACKEND", "sqlite")
+    if backend == "redis":
+        url = os.getenv("QUOTA_REDIS_URL", "redis://localhost:6379/0")
+        logger.info(f"✅ Kvoter lagras i Redis ({url.split('@')[-1]})")
+        return RedisQuotaBackend(url, prefix=os.getenv("QUOTA_REDIS_PREFIX", "quota"))
+    if backend != "sqlite":
+        raise ValueError(f"Okänt QUOTA_BACKEND: {backend}")
+    path = os.getenv("QUOTA_DB_PATH") or _default_sqlite_path()
+    logger.info(f"✅ Kvoter lagras i SQLite ({path})")
+    return SQLiteQuotaBackend(path, busy_timeout_ms=int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")))
+
+
+quota_store = create_quota_backend()
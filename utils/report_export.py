@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+import zlib
+from typing import Any, AsyncIterator, Dict, List
+
+# Samla rader till ungefär så här stora bitar innan de skickas till klienten
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+CSV_COLUMNS = [
+    "id",
+    "analysis_type",
+    "url",
+    "created_at",
+    "usability",
+    "aesthetics",
+    "performance",
+    "seo_summary",
+    "ux_summary",
+    "content_summary",
+    "overall_summary",
+    "results",
+]
+
+
+def _section_summary(results: Dict[str, Any], key: str) -> str:
+    section = results.get(key)
+    return section.get("summary", "") if isinstance(section, dict) else ""
+
+
+def ndjson_line(row: Dict[str, Any]) -> bytes:
+    return (json.dumps(row, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def csv_header() -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(CSV_COLUMNS)
+    return buffer.getvalue().encode("utf-8")
+
+
+def csv_line(row: Dict[str, Any]) -> bytes:
+    """En rapport som en CSV-rad: de vanligaste fälten platt plus hela results som JSON."""
+    results = row.get("results") or {}
+    design_score = results.get("designScore") or {}
+    summary = results.get("recommendations_summary") or results.get("strengths_summary") or {}
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow([
+        row["id"],
+        row["analysis_type"],
+        row["url"],
+        row["created_at"],
+        design_score.get("usability", ""),
+        design_score.get("aesthetics", ""),
+        design_score.get("performance", ""),
+        _section_summary(results, "seo_analysis"),
+        _section_summary(results, "ux_analysis"),
+        _section_summary(results, "content_analysis"),
+        summary.get("overall_summary") or summary.get("overall_strengths", ""),
+        json.dumps(results, ensure_ascii=False),
+    ])
+    return buffer.getvalue().encode("utf-8")
+
+
+async def chunked(lines: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Slår ihop små rader till större bitar så att varje write inte blir ett eget paket."""
+    pending: List[bytes] = []
+    size = 0
+    async for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b"".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b"".join(pending)
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Komprimerar en ström inkrementellt till gzip-format utan att buffra allt."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
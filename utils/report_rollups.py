@@ -0,0 +1,148 @@
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Percentiler som trend-API:t redovisar för varje designmått
+TREND_PERCENTILES = (25, 50, 75, 90)
+# Toppnivånycklar i results som räknas som analyssektioner
+_SECTION_SUFFIXES = ("_analysis", "_summary")
+
+
+def _design_values(results: Dict[str, Any]) -> Dict[str, float]:
+    design_score = results.get("designScore") or {}
+    if not isinstance(design_score, dict):
+        return {}
+    return {
+        key: float(value)
+        for key, value in design_score.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+
+def _section_observations(results: Dict[str, Any]) -> Dict[str, int]:
+    sections = {}
+    for key, value in results.items():
+        if key.endswith(_SECTION_SUFFIXES) and isinstance(value, dict):
+            observations = value.get("observations")
+            sections[key] = len(observations) if isinstance(observations, list) else 0
+    return sections
+
+
+def accumulate_rollup(
+    design_stats: Optional[Dict[str, List[float]]],
+    section_stats: Optional[Dict[str, List[int]]],
+    results: Optional[Dict[str, Any]],
+) -> Tuple[Dict[str, List[float]], Dict[str, List[int]]]:
+    """
+    Lägger till en rapports värden i en dags aggregat.
+
+    design_stats: mått -> [antal, summa, min, max]
+    section_stats: sektion -> [antal rapporter med sektionen, antal observationer]
+    """
+    design = {key: list(value) for key, value in (design_stats or {}).items()}
+    sections = {key: list(value) for key, value in (section_stats or {}).items()}
+    results = results or {}
+
+    for key, value in _design_values(results).items():
+        if key in design:
+            count, total, low, high = design[key]
+            design[key] = [count + 1, total + value, min(low, value), max(high, value)]
+        else:
+            design[key] = [1, value, value, value]
+
+    for key, observations in _section_observations(results).items():
+        reports, total = sections.get(key, [0, 0])
+        sections[key] = [reports + 1, total + observations]
+
+    return design, sections
+
+
+def _clean(value: float) -> Optional[float]:
+    return None if math.isnan(value) else round(float(value), 4)
+
+
+def rollup_trends(rows: Sequence[Any]) -> Dict[str, Any]:
+    """
+    Beräknar dagsserie, percentiler och förändringar från rollup-rader för en
+    URL (sorterade på dag). Kostnaden beror på antal dagar, inte antal rapporter.
+    """
+    if not rows:
+        return {"reports": 0, "series": [], "metrics": {}, "sections": {}}
+
+    # NumPy laddas först när trender efterfrågas, inte vid varje uppstart
+    import numpy as np
+
+    metrics = sorted({key for row in rows for key in (row.design_stats or {})})
+    counts = np.zeros((len(rows), len(metrics)))
+    sums = np.zeros((len(rows), len(metrics)))
+    lows = np.full((len(rows), len(metrics)), np.nan)
+    highs = np.full((len(rows), len(metrics)), np.nan)
+    for i, row in enumerate(rows):
+        for j, key in enumerate(metrics):
+            stats = (row.design_stats or {}).get(key)
+            if stats:
+                counts[i, j], sums[i, j], lows[i, j], highs[i, j] = stats
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        daily_means = np.where(counts > 0, sums / counts, np.nan)
+        overall_means = sums.sum(axis=0) / counts.sum(axis=0)
+
+    has_values = ~np.isnan(daily_means)
+    # Index för senaste, näst senaste och första dagen med värden per mått
+    day_index = np.arange(len(rows))[:, None]
+    latest_idx = np.where(has_values, day_index, -1).max(axis=0)
+    first_idx = np.where(has_values, day_index, len(rows)).min(axis=0)
+    previous_idx = np.where(has_values & (day_index < latest_idx), day_index, -1).max(axis=0)
+
+    def pick(indices: np.ndarray) -> np.ndarray:
+        valid = (indices >= 0) & (indices < len(rows))
+        picked = daily_means[np.clip(indices, 0, len(rows) - 1), np.arange(len(metrics))]
+        return np.where(valid, picked, np.nan)
+
+    latest, previous, first = pick(latest_idx), pick(previous_idx), pick(first_idx)
+    percentiles = (
+        np.nanpercentile(daily_means, TREND_PERCENTILES, axis=0)
+        if metrics and has_values.any() else np.full((len(TREND_PERCENTILES), len(metrics)), np.nan)
+    )
+
+    metric_summary = {}
+    for j, key in enumerate(metrics):
+        if not has_values[:, j].any():
+            continue
+        metric_summary[key] = {
+            "mean": _clean(overall_means[j]),
+            "min": _clean(np.nanmin(lows[:, j])),
+            "max": _clean(np.nanmax(highs[:, j])),
+            **{f"p{p}": _clean(percentiles[k, j]) for k, p in enumerate(TREND_PERCENTILES)},
+            "latest": _clean(latest[j]),
+            "delta_previous": _clean(latest[j] - previous[j]),
+            "delta_window": _clean(latest[j] - first[j]),
+        }
+
+    section_totals: Dict[str, List[int]] = {}
+    for row in rows:
+        for key, (reports, observations) in (row.section_stats or {}).items():
+            totals = section_totals.setdefault(key, [0, 0])
+            totals[0] += reports
+            totals[1] += observations
+
+    series = [
+        {
+            "day": row.day.isoformat(),
+            "reports": row.report_count,
+            **{key: _clean(daily_means[i, j]) for j, key in enumerate(metrics)},
+        }
+        for i, row in enumerate(rows)
+    ]
+
+    return {
+        "reports": int(sum(row.report_count for row in rows)),
+        "series": series,
+        "metrics": metric_summary,
+        "sections": {
+            key: {
+                "reports": reports,
+                "avg_observations": round(observations / reports, 2) if reports else 0,
+            }
+            for key, (reports, observations) in sorted(section_totals.items())
+        },
+    }
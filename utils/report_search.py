@@ -0,0 +1,201 @@
+import hashlib
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from utils.logging_utils import logger
+
+# Fält i results som inte är analystext och inte ska vara sökbara
+_SKIPPED_KEYS = {"performance_metrics", "designScore"}
+_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def extract_search_text(results: Optional[Dict[str, Any]]) -> str:
+    """Samlar alla textvärden i results (rekursivt) till ett sökbart dokument."""
+    parts: List[str] = []
+
+    def walk(value: Any) -> None:
+        if isinstance(value, str):
+            if value.strip():
+                parts.append(value.strip())
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if key not in _SKIPPED_KEYS:
+                    walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    walk(results or {})
+    return "\n".join(parts)
+
+
+def query_terms(query: str) -> List[str]:
+    return _TERM_PATTERN.findall(query.lower())
+
+
+class SearchIndex(ABC):
+    """
+    Gränssnitt för fulltextindex över rapporter. index_report anropas med en
+    synkron connection inifrån ORM-flushen, search med en AsyncSession.
+    """
+
+    # SQL som listar id för rapporter som saknas i indexet (används av backfill)
+    _missing_ids_sql: str
+
+    @abstractmethod
+    def create(self, connection) -> None:
+        ...
+
+    @abstractmethod
+    def index_report(self, connection, report_id: int, user_id: str, url: str,
+                     results: Optional[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    async def search(self, session, user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+        ...
+
+    def backfill(self, connection) -> int:
+        """Indexerar rapporter som saknas i indexet; returnerar antalet."""
+        from sqlmodel import Session, select
+        from database import Report
+
+        missing = connection.execute(text(self._missing_ids_sql)).scalars().all()
+        if not missing:
+            return 0
+        session = Session(bind=connection)
+        for start in range(0, len(missing), 200):
+            batch = missing[start:start + 200]
+            for report in session.exec(select(Report).where(Report.id.in_(batch))).all():
+                self.index_report(connection, report.id, report.user_id, report.url, report.results)
+            session.expunge_all()
+        logger.info(f"✅ Sökindex: indexerade {len(missing)} befintliga rapporter")
+        return len(missing)
+
+
+class SQLiteSearchIndex(SearchIndex):
+    """
+    FTS5-tabell med rowid = report.id. Ägaren lagras som en hashad token så
+    att MATCH kan begränsa sökningen till en användares rapporter via indexet.
+    """
+
+    _missing_ids_sql = (
+        "SELECT id FROM report WHERE id NOT IN (SELECT rowid FROM report_fts)"
+    )
+
+    @staticmethod
+    def _owner_token(user_id: str) -> str:
+        return "u" + hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:20]
+
+    def create(self, connection) -> None:
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS report_fts USING fts5("
+            "owner, url, body, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+
+    def index_report(self, connection, report_id, user_id, url, results) -> None:
+        connection.execute(
+            text("INSERT OR REPLACE INTO report_fts (rowid, owner, url, body) "
+                 "VALUES (:id, :owner, :url, :body)"),
+            {
+                "id": report_id,
+                "owner": self._owner_token(user_id),
+                "url": url,
+                "body": extract_search_text(results),
+            },
+        )
+
+    async def search(self, session, user_id, query, limit):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        # Citera varje term så att användarens inmatning aldrig tolkas som FTS5-syntax;
+        # sista termen prefixmatchas så att sökning medan man skriver fungerar
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += "*"
+        match = f"owner:{self._owner_token(user_id)} AND ({' '.join(quoted)})"
+        rows = await session.execute(
+            text(
+                "SELECT r.id, r.url, r.analysis_type, r.created_at, "
+                "snippet(report_fts, 2, '<mark>', '</mark>', '…', 16) AS snippet, "
+                "bm25(report_fts, 0.0, 2.0, 1.0) AS score "
+                "FROM report_fts JOIN report r ON r.id = report_fts.rowid "
+                "WHERE report_fts MATCH :match AND r.user_id = :user_id "
+                "ORDER BY score LIMIT :limit"
+            ),
+            {"match": match, "user_id": user_id, "limit": limit},
+        )
+        # bm25 är negativ (lägre är bättre); vänd tecknet så att högre är bättre
+        return [dict(row._mapping, score=-row.score) for row in rows]
+
+
+class PostgresSearchIndex(SearchIndex):
+    """tsvector-tabell med GIN-index, begränsad per user_id via ett btree-index."""
+
+    _missing_ids_sql = (
+        "SELECT id FROM report WHERE id NOT IN (SELECT report_id FROM report_search)"
+    )
+
+    def __init__(self, config: str = "swedish"):
+        self.config = config
+
+    def create(self, connection) -> None:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS report_search ("
+            "report_id INTEGER PRIMARY KEY REFERENCES report(id) ON DELETE CASCADE, "
+            "user_id TEXT NOT NULL, body TEXT NOT NULL, document TSVECTOR NOT NULL)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_report_search_document "
+            "ON report_search USING GIN (document)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_report_search_user_id ON report_search (user_id)"
+        ))
+
+    def index_report(self, connection, report_id, user_id, url, results) -> None:
+        connection.execute(
+            text(
+                "INSERT INTO report_search (report_id, user_id, body, document) "
+                "VALUES (:id, :user_id, :body, "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :url), 'A') || "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :body), 'B')) "
+                "ON CONFLICT (report_id) DO UPDATE SET body = EXCLUDED.body, "
+                "document = EXCLUDED.document"
+            ),
+            {
+                "id": report_id,
+                "user_id": user_id,
+                "url": url,
+                "body": extract_search_text(results),
+                "config": self.config,
+            },
+        )
+
+    async def search(self, session, user_id, query, limit):
+        if not query_terms(query):
+            return []
+        rows = await session.execute(
+            text(
+                "SELECT r.id, r.url, r.analysis_type, r.created_at, "
+                "ts_headline(CAST(:config AS regconfig), s.body, q, "
+                "'StartSel=<mark>, StopSel=</mark>, MaxFragments=2') AS snippet, "
+                "ts_rank(s.document, q) AS score "
+                "FROM report_search s JOIN report r ON r.id = s.report_id, "
+                "websearch_to_tsquery(CAST(:config AS regconfig), :query) AS q "
+                "WHERE s.user_id = :user_id AND s.document @@ q "
+                "ORDER BY score DESC LIMIT :limit"
+            ),
+            {"config": self.config, "query": query, "user_id": user_id, "limit": limit},
+        )
+        return [dict(row._mapping) for row in rows]
+
+
+def create_search_index(database_url: str) -> SearchIndex:
+    if database_url.startswith(("postgres://", "postgresql")):
+        return PostgresSearchIndex(config=os.getenv("SEARCH_TS_CONFIG", "swedish"))
+    return SQLiteSearchIndex()
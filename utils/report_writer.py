@@ -0,0 +1,186 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from database import async_session_maker
+from utils.logging_utils import logger
+
+# Hållbarhetsnivåer för nya rapporter:
+#   sync  - varje request committar sina rader själv innan svaret (standard)
+#   group - rader från samtidiga requests samlas i en transaktion; svaret väntar på commit
+#   async - svaret skickas direkt när raderna är köade; de committas strax efter
+#           (kan förloras om processen dör innan flush)
+WRITE_MODES = ("sync", "group", "async")
+
+
+class ReportWriteBuffer:
+    """
+    Write-behind-buffert som slår ihop inserts från samtidiga requests till en
+    transaktion, antingen efter `flush_interval` sekunder eller när `max_batch`
+    rader har samlats.
+    """
+
+    def __init__(self, mode: str = "sync", flush_interval: float = 0.05,
+                 max_batch: int = 200, sample_size: int = 512):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Okänt REPORT_WRITE_MODE: {mode}")
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self._pending: List[Tuple[Any, Optional[asyncio.Future]]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self._flush_latencies: Deque[float] = deque(maxlen=sample_size)
+        self._flushes = 0
+        self._rows_written = 0
+        self._failed_rows = 0
+        self._largest_batch = 0
+
+    @property
+    def buffered(self) -> bool:
+        return self.mode != "sync"
+
+    async def start(self) -> None:
+        if not self.buffered or self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(
+            f"✅ Write-behind för rapporter startad (läge {self.mode}, "
+            f"{self.flush_interval * 1000:.0f} ms / {self.max_batch} rader)"
+        )
+
+    async def stop(self) -> None:
+        """Stoppar flushern och skriver det som fortfarande ligger i bufferten."""
+        if self._task is None:
+            return
+        # Ingen cancel: en pågående commit får gå klart och resten av bufferten
+        # skrivs innan flushern avslutas
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await self._task
+        finally:
+            self._task = None
+            self._stopping = False
+        while self._pending:
+            await self._flush()
+
+    async def save(self, reports: List[Any], session) -> List[Any]:
+        """
+        Sparar rapporterna enligt konfigurerad hållbarhetsnivå. I läge "async"
+        returneras rapporterna innan de fått id.
+        """
+        if not self.buffered or self._task is None:
+            flush_start = time.perf_counter()
+            session.add_all(reports)
+            await session.commit()
+            self._record_flush(len(reports), time.perf_counter() - flush_start)
+            return reports
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for report in reports:
+            future = loop.create_future() if self.mode == "group" else None
+            if future is None:
+                # Svaret serialiseras medan flushern skriver; ge flushern en egen kopia
+                report = type(report)(**report.model_dump(exclude={"id"}))
+            self._pending.append((report, future))
+            if future is not None:
+                futures.append(future)
+        self._wakeup.set()
+        if futures:
+            await asyncio.gather(*futures)
+        return reports
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Vänta in fler rader tills tiden gått ut eller batchen är full
+            deadline = time.monotonic() + self.flush_interval
+            while not self._stopping and len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                    self._wakeup.clear()
+                except asyncio.TimeoutError:
+                    break
+            while self._pending:
+                await self._flush()
+            if self._stopping:
+                return
+
+    async def _flush(self) -> None:
+        batch = self._pending[:self.max_batch]
+        del self._pending[:len(batch)]
+        flush_start = time.perf_counter()
+        try:
+            async with async_session_maker() as session:
+                session.add_all([report for report, _ in batch])
+                await session.commit()
+        except asyncio.CancelledError:
+            # Avbruten mitt i (t.ex. när event-loopen stängs): raderna läggs
+            # tillbaka så att de inte försvinner och väntande requests besvaras
+            self._pending[:0] = batch
+            raise
+        except Exception as e:
+            self._failed_rows += len(batch)
+            logger.error(f"❌ Kunde inte skriva {len(batch)} rapporter: {e}", exc_info=True)
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - flush_start
+        self._record_flush(len(batch), elapsed)
+        logger.info(f"✅ Skrev {len(batch)} rapporter i en transaktion på {elapsed:.3f}s")
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    def _record_flush(self, rows: int, elapsed: float) -> None:
+        self._flush_latencies.append(elapsed * 1000)
+        self._flushes += 1
+        self._rows_written += rows
+        self._largest_batch = max(self._largest_batch, rows)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self._flush_latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(int(p * len(latencies)), len(latencies) - 1)], 2)
+
+        return {
+            "mode": self.mode,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "max_batch": self.max_batch,
+            "pending": len(self._pending),
+            "flushes": self._flushes,
+            "rows_written": self._rows_written,
+            "failed_rows": self._failed_rows,
+            "largest_batch": self._largest_batch,
+            "avg_batch": round(self._rows_written / self._flushes, 2) if self._flushes else 0,
+            "flush_latency_ms": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1], 2) if latencies else 0.0,
+            },
+        }
+
+
+report_writer = ReportWriteBuffer(
+    mode=os.getenv("REPORT_WRITE_MODE", "sync"),
+    flush_interval=float(os.getenv("REPORT_FLUSH_INTERVAL_MS", "50")) / 1000,
+    max_batch=int(os.getenv("REPORT_FLUSH_MAX_BATCH", "200")),
+)
@@ -0,0 +1,85 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict
+
+from fastapi.responses import JSONResponse
+
+from utils.logging_utils import performance_metrics
+
+try:
+    import orjson
+except ImportError:  # Standardbibliotekets json används om orjson saknas
+    orjson = None
+
+
+class ResponseTimings:
+    """Glidande urval av serialiserings- och komprimeringstider per svar."""
+
+    def __init__(self, sample_size: int = 1024):
+        self._samples: Dict[str, Deque[float]] = {
+            "serialize": deque(maxlen=sample_size),
+            "compress": deque(maxlen=sample_size),
+        }
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compressed = {"gzip": 0, "br": 0}
+
+    def record(self, kind: str, elapsed: float) -> None:
+        self._samples[kind].append(elapsed * 1000)
+        # Senaste värdet syns även bland övriga tidsmätningar i /metrics
+        performance_metrics[f"response_{kind}"] = elapsed
+
+    def record_compression(self, encoding: str, raw_size: int, compressed_size: int) -> None:
+        self.compressed[encoding] += 1
+        self.bytes_in += raw_size
+        self.bytes_out += compressed_size
+
+    def snapshot(self) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {}
+        for kind, samples in self._samples.items():
+            values = sorted(samples)
+
+            def percentile(p: float) -> float:
+                if not values:
+                    return 0.0
+                return round(values[min(int(p * len(values)), len(values) - 1)], 3)
+
+            summary[f"{kind}_ms"] = {
+                "count": len(values),
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "max": round(values[-1], 3) if values else 0.0,
+            }
+        summary["compressed_responses"] = dict(self.compressed)
+        summary["compression_ratio"] = (
+            round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None
+        )
+        return summary
+
+
+response_timings = ResponseTimings()
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Standardsvar för API:t: serialiserar med orjson (faller tillbaka på
+    JSONResponse utan orjson) och redovisar tiden i Server-Timing.
+    """
+
+    def render(self, content: Any) -> bytes:
+        serialize_start = time.perf_counter()
+        if orjson is not None:
+            body = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        else:
+            body = super().render(content)
+        self._serialize_seconds = time.perf_counter() - serialize_start
+        response_timings.record("serialize", self._serialize_seconds)
+        return body
+
+    def init_headers(self, headers=None) -> None:
+        super().init_headers(headers)
+        elapsed = getattr(self, "_serialize_seconds", None)
+        if elapsed is not None:
+            self.raw_headers.append(
+                (b"server-timing", f"serialize;dur={elapsed * 1000:.3f}".encode("latin-1"))
+            )
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import zlib
+from typing import Any, Dict, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstd är valfritt; zlib finns alltid
+    zstandard = None
+
+# Föredragen codec för nya blobbar; faller tillbaka till zlib om zstandard saknas
+RESULTS_CODEC = os.getenv("RESULTS_CODEC", "zstd" if zstandard else "zlib")
+ZSTD_LEVEL = int(os.getenv("RESULTS_ZSTD_LEVEL", "10"))
+ZLIB_LEVEL = int(os.getenv("RESULTS_ZLIB_LEVEL", "6"))
+
+
+def canonical_json(payload: Dict[str, Any]) -> bytes:
+    """
+    Serialiserar payload deterministiskt så att samma innehåll alltid ger
+    samma bytes (och därmed samma hash), oavsett nyckelordning.
+    """
+    return json.dumps(
+        payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+
+
+def compress(raw: bytes, codec: str = RESULTS_CODEC) -> Tuple[str, bytes]:
+    if codec == "zstd" and zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Blobben är zstd-komprimerad men paketet zstandard saknas")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Okänd codec för rapportresultat: {codec}")
+
+
+def encode_results(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returnerar fälten för en innehållsadresserad blob: sha256 av den
+    kanoniska JSON:en, vald codec, komprimerad data och storlekar.
+    """
+    raw = canonical_json(payload)
+    codec, data = compress(raw)
+    return {
+        "digest": hashlib.sha256(raw).hexdigest(),
+        "codec": codec,
+        "data": data,
+        "raw_size": len(raw),
+        "stored_size": len(data),
+    }
+
+
+def decode_results(codec: str, data: bytes) -> Dict[str, Any]:
+    return json.loads(decompress(codec, data))
@@ -0,0 +1,246 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, select, update
+
+from database import Report, TrackedUrl, async_session_maker
+from models import Query
+from utils.admission import AdmissionRejected, analysis_admission
+from utils.analysis_pipeline import PromptCache, run_analysis
+from utils.deadline import Deadline
+from utils.logging_utils import logger
+from utils.report_writer import report_writer
+
+# Bevakningar körs på lägsta prioritet så att interaktiva analyser går först
+MONITOR_TIER = "free"
+
+
+def report_analysis_type(tracked: TrackedUrl) -> str:
+    if tracked.is_competitor:
+        return "competitor"
+    return tracked.analysis_type or "standard"
+
+
+class UrlMonitor:
+    """
+    Schemaläggare som analyserar bevakade URL:er med jämna mellanrum.
+
+    Varje körning skrapar sidan på nytt men skickar bara de prompter vars
+    indata ändrats (se PromptCache); övriga sektioner återanvänds från
+    förra körningen. En ny Report sparas bara när något faktiskt ändrats.
+    """
+
+    def __init__(self, poll_interval: float = 60.0, batch_size: int = 5,
+                 concurrency: int = 1, deadline_seconds: float = 180.0,
+                 retry_seconds: float = 900.0):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.deadline_seconds = deadline_seconds
+        self.retry_seconds = retry_seconds
+        # Låset måste räcka för kö, tidsbudget och att spara resultatet
+        self.lease_seconds = deadline_seconds + analysis_admission.max_wait + 60
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._runs = 0
+        self._changed = 0
+        self._unchanged = 0
+        self._failed = 0
+        self._prompts_sent = 0
+        self._prompts_reused = 0
+        self._seconds_saved = 0.0
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _claim(self, session, tracked_id: int, next_run_at: datetime) -> bool:
+        result = await session.execute(
+            update(TrackedUrl)
+            .where(TrackedUrl.id == tracked_id, TrackedUrl.next_run_at == next_run_at)
+            .values(next_run_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+        )
+        await session.commit()
+        return result.rowcount == 1
+
+    async def _reschedule(self, tracked_id: int, delay: float, **values: Any) -> None:
+        async with async_session_maker() as session:
+            await session.execute(
+                update(TrackedUrl)
+                .where(TrackedUrl.id == tracked_id)
+                .values(next_run_at=datetime.utcnow() + timedelta(seconds=delay), **values)
+            )
+            await session.commit()
+
+    async def run_once(self, tracked_id: int) -> Optional[Dict[str, Any]]:
+        """Kör en bevakning och returnerar körningens utfall (None om den inte fanns)."""
+        async with async_session_maker() as session:
+            tracked = await session.get(TrackedUrl, tracked_id)
+        if tracked is None:
+            return None
+
+        cache = PromptCache(tracked.prompt_cache)
+        query = Query(query=tracked.query, url=tracked.url, analysis_type=tracked.analysis_type,
+                      is_competitor=tracked.is_competitor)
+        run_start = time.time()
+        try:
+            async with analysis_admission.slot(f"monitor:{tracked.id}", MONITOR_TIER):
+                result = await run_analysis(query, Deadline(self.deadline_seconds), cache)
+        except AdmissionRejected as e:
+            logger.info(f"Bevakning {tracked.id} skjuts upp {e.retry_after}s ({e.reason})")
+            await self._reschedule(tracked.id, e.retry_after)
+            return None
+        except Exception as e:
+            self._failed += 1
+            detail = getattr(e, "detail", None) or str(e)
+            logger.error(f"❌ Bevakning {tracked.id} av {tracked.url} misslyckades: {detail}")
+            last_run = {"at": datetime.utcnow().isoformat(), "status": "failed", "error": str(detail)}
+            await self._reschedule(tracked.id, self.retry_seconds, last_run=last_run)
+            return last_run
+
+        changed = cache.sent > 0
+        partial = bool(result.get("partial"))
+        previous_fields = tracked.field_fingerprints or {}
+        changed_fields = sorted(
+            field for field, digest in cache.fields.items() if previous_fields.get(field) != digest
+        )
+
+        report_id = None
+        if changed and not partial:
+            report = Report(user_id=tracked.user_id, analysis_type=report_analysis_type(tracked),
+                            url=tracked.url, results=result)
+            async with async_session_maker() as session:
+                await report_writer.save([report], session)
+            report_id = report.id
+
+        duration = time.time() - run_start
+        last_run = {
+            "at": datetime.utcnow().isoformat(),
+            "status": "partial" if partial else ("changed" if changed else "unchanged"),
+            "report_id": report_id,
+            "changed_fields": changed_fields,
+            "prompts_sent": cache.sent,
+            "prompts_reused": cache.reused,
+            "estimated_seconds_saved": round(cache.seconds_saved, 2),
+            "duration_seconds": round(duration, 2),
+        }
+
+        self._runs += 1
+        self._prompts_sent += cache.sent
+        self._prompts_reused += cache.reused
+        self._seconds_saved += cache.seconds_saved
+        if changed:
+            self._changed += 1
+        else:
+            self._unchanged += 1
+        logger.info(
+            f"✅ Bevakning {tracked.id} ({tracked.url}): {last_run['status']}, "
+            f"{cache.sent} prompter skickade, {cache.reused} återanvända "
+            f"(~{cache.seconds_saved:.1f}s sparat) på {duration:.2f}s"
+        )
+
+        # Delvisa körningar görs om tidigare; det som hann klart ligger i cachen
+        delay = self.retry_seconds if partial else tracked.interval_hours * 3600
+        values: Dict[str, Any] = {
+            "prompt_cache": cache.entries,
+            "field_fingerprints": cache.fields or previous_fields,
+            "last_run_at": datetime.utcnow(),
+            "last_run": last_run,
+            "runs": TrackedUrl.runs + 1,
+            "changed_runs": TrackedUrl.changed_runs + (1 if changed else 0),
+            "prompts_reused": TrackedUrl.prompts_reused + cache.reused,
+            "seconds_saved": TrackedUrl.seconds_saved + round(cache.seconds_saved, 2),
+        }
+        if report_id is not None:
+            values["last_report_id"] = report_id
+        await self._reschedule(tracked.id, delay, **values)
+        return last_run
+
+    async def _run_guarded(self, tracked_id: int) -> None:
+        async with self._semaphore:
+            await self.run_once(tracked_id)
+
+    async def process_due(self) -> int:
+        """Startar förfallna bevakningar; returnerar antalet som plockades."""
+        async with async_session_maker() as session:
+            due = (await session.execute(
+                select(TrackedUrl.id, TrackedUrl.next_run_at)
+                .where(TrackedUrl.next_run_at <= datetime.utcnow())
+                .order_by(TrackedUrl.next_run_at)
+                .limit(self.batch_size)
+            )).all()
+            claimed: List[int] = []
+            for tracked_id, next_run_at in due:
+                if await self._claim(session, tracked_id, next_run_at):
+                    claimed.append(tracked_id)
+
+        if claimed:
+            await asyncio.gather(*(self._run_guarded(tracked_id) for tracked_id in claimed))
+        return len(claimed)
+
+    async def _next_due_in(self) -> float:
+        async with async_session_maker() as session:
+            next_at = await session.scalar(select(func.min(TrackedUrl.next_run_at)))
+        if next_at is None:
+            return self.poll_interval
+        return min(max((next_at - datetime.utcnow()).total_seconds(), 0.0), self.poll_interval)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                while await self.process_due() == self.batch_size:
+                    pass
+                delay = await self._next_due_in()
+            except Exception as e:
+                logger.error(f"❌ Bevakningar kunde inte köras: {e}", exc_info=True)
+                delay = self.poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def snapshot(self) -> Dict[str, Any]:
+        async with async_session_maker() as session:
+            tracked, due = (await session.execute(
+                select(func.count(),
+                       func.count().filter(TrackedUrl.next_run_at <= datetime.utcnow()))
+                .select_from(TrackedUrl)
+            )).one()
+        return {
+            "tracked": tracked,
+            "due": due,
+            "runs": self._runs,
+            "changed": self._changed,
+            "unchanged": self._unchanged,
+            "failed": self._failed,
+            "prompts_sent": self._prompts_sent,
+            "prompts_reused": self._prompts_reused,
+            "seconds_saved": round(self._seconds_saved, 2),
+        }
+
+
+url_monitor = UrlMonitor(
+    poll_interval=float(os.getenv("MONITOR_POLL_INTERVAL_S", "60")),
+    concurrency=int(os.getenv("MONITOR_CONCURRENCY", "1")),
+    deadline_seconds=float(os.getenv("MONITOR_DEADLINE_S", "180")),
+    retry_seconds=float(os.getenv("MONITOR_RETRY_S", "900")),
+)
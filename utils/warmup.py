@@ -0,0 +1,121 @@
+import asyncio
+import importlib
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.logging_utils import logger
+
+# Moduler som laddas lazy i request-vägen men som värms upp här i bakgrunden
+WARMUP_MODULES = ("bs4", "requests", "numpy", "stripe")
+
+
+class Warmup:
+    """
+    Uppvärmningsfas efter startup: varje steg körs parallellt och tidmäts.
+    Instansen räknas som redo när alla steg är klara, även om något steg
+    misslyckades (felet redovisas i status); ett misslyckat steg betyder bara
+    att första requesten betalar kostnaden i stället.
+    """
+
+    def __init__(self):
+        self._steps: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self.status: Dict[str, Dict[str, Any]] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add_step(self, name: str, step: Callable[[], Awaitable[Any]]) -> None:
+        self._steps.append((name, step))
+        self.status[name] = {"status": "pending"}
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[Any]]) -> None:
+        self.status[name] = {"status": "running"}
+        step_start = time.perf_counter()
+        try:
+            result = await step()
+        except Exception as e:
+            elapsed = time.perf_counter() - step_start
+            self.status[name] = {"status": "failed", "duration_ms": round(elapsed * 1000, 1),
+                                 "error": str(e)}
+            logger.error(f"❌ Warmup-steg {name} misslyckades efter {elapsed:.2f}s: {e}")
+            return
+        elapsed = time.perf_counter() - step_start
+        self.status[name] = {"status": "done", "duration_ms": round(elapsed * 1000, 1)}
+        if result is not None:
+            self.status[name]["result"] = result
+        logger.info(f"✅ Warmup-steg {name} klart på {elapsed:.2f}s")
+
+    async def _run(self) -> None:
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self._steps))
+        self.finished_at = time.monotonic()
+        logger.info(f"🎉 Warmup klar på {self.finished_at - self.started_at:.2f}s, instansen är redo")
+
+    async def start(self) -> None:
+        """Startar uppvärmningen i bakgrunden så att servern kan svara på /ready under tiden."""
+        if self._task is not None:
+            return
+        self.started_at = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def wait(self) -> None:
+        if self._task is not None:
+            await self._task
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return {
+            "ready": self.ready,
+            "elapsed_ms": round(elapsed * 1000, 1) if elapsed is not None else None,
+            "steps": self.status,
+        }
+
+
+async def _import_modules() -> List[str]:
+    def load() -> List[str]:
+        loaded = []
+        for name in WARMUP_MODULES:
+            try:
+                importlib.import_module(name)
+                loaded.append(name)
+            except ImportError as e:
+                logger.error(f"❌ Kunde inte förladda {name}: {e}")
+        return loaded
+
+    return await asyncio.to_thread(load)
+
+
+def create_warmup() -> Warmup:
+    from auth import jwks_cache
+    from utils.analysis_utils import preconnect_openai
+    from utils.web_scraper import browser_pool
+
+    async def prefetch_jwks() -> int:
+        # start() loggar men sväljer fel från Auth0; stegets status ska ändå visa det
+        await jwks_cache.start()
+        keys = jwks_cache.snapshot()["keys"]
+        if not keys:
+            raise RuntimeError("Inga JWKS-nycklar kunde hämtas")
+        return len(keys)
+
+    warmup = Warmup()
+    warmup.add_step("imports", _import_modules)
+    warmup.add_step("jwks", prefetch_jwks)
+    if os.getenv("WARMUP_OPENAI", "true").lower() in ("1", "true", "yes"):
+        warmup.add_step("openai", preconnect_openai)
+    if os.getenv("WARMUP_BROWSERS", "true").lower() in ("1", "true", "yes"):
+        warmup.add_step("browsers", lambda: asyncio.to_thread(browser_pool.warm))
+    return warmup
+
+
+warmup = create_warmup()
@@ -1,51 +1,175 @@
 
 import logging
+import os
+import queue
+import threading
 import time
-from typing import Dict, Any
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
+from typing import Dict, Any, Optional
 from fastapi import HTTPException
 
 from utils.logging_utils import log_timing, TimingContext, logger
 
+# Selenium, webdriver_manager och BeautifulSoup importeras först när en
+# webbläsare startas eller en sida tolkas, så att appen startar snabbt
+
+# Antal förstartade webbläsare och hur många sidor var och en får ladda innan den byts ut
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", "20"))
+
+_driver_path: Optional[str] = None
+_driver_path_lock = threading.Lock()
+
+def _chromedriver_path() -> str:
+    """Kör webdriver_managers nedladdnings-/versionskontroll en gång per process."""
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            from webdriver_manager.chrome import ChromeDriverManager
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
 @log_timing
 def initialize_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+
     options = Options()
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
     options.page_load_strategy = 'eager'
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    driver = webdriver.Chrome(service=Service(_chromedriver_path()), options=options)
     driver.set_page_load_timeout(30)
     return driver
 
+class BrowserPool:
+    """
+    Pool av förstartade headless-webbläsare. En skrapning lånar en
+    webbläsare och lämnar tillbaka den rensad; trasiga eller uttjänta
+    webbläsare stängs och ersätts vid behov.
+    """
+
+    def __init__(self, size: int, max_uses: int):
+        self.size = size
+        self.max_uses = max_uses
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._uses: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.launched = 0
+        self.reused = 0
+
+    def _launch(self):
+        driver = initialize_driver()
+        with self._lock:
+            self._uses[id(driver)] = 0
+            self.launched += 1
+        return driver
+
+    def _quit(self, driver) -> None:
+        with self._lock:
+            self._uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.error(f"❌ Kunde inte stänga webbläsare: {e}")
+
+    def warm(self) -> int:
+        """Startar webbläsare tills poolen är full; returnerar antalet lediga."""
+        while self._idle.qsize() < self.size:
+            self._idle.put(self._launch())
+        return self._idle.qsize()
+
+    @property
+    def idle(self) -> int:
+        return self._idle.qsize()
+
+    def try_acquire(self):
+        """En ledig förstartad webbläsare, eller None; startar aldrig en ny."""
+        try:
+            driver = self._idle.get_nowait()
+        except queue.Empty:
+            return None
+        self.reused += 1
+        with self._lock:
+            self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+        return driver
+
+    def acquire(self):
+        driver = self.try_acquire()
+        if driver is None:
+            driver = self._launch()
+            with self._lock:
+                self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+        return driver
+
+    def release(self, driver, healthy: bool = True) -> None:
+        with self._lock:
+            uses = self._uses.get(id(driver), 0)
+        if not healthy or uses >= self.max_uses or self._idle.qsize() >= self.size:
+            self._quit(driver)
+            return
+        try:
+            # Ingen state (cookies, öppen sida) får följa med till nästa skrapning
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+        except Exception:
+            self._quit(driver)
+            return
+        self._idle.put(driver)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "launched": self.launched,
+            "reused": self.reused,
+        }
+
+browser_pool = BrowserPool(BROWSER_POOL_SIZE, BROWSER_MAX_USES)
+
 @log_timing
-def scrape_dynamic_page(url: str) -> Dict[str, Any]:
+def scrape_dynamic_page(url: str, timeout: Optional[float] = None, driver=None) -> Dict[str, Any]:
     """
     Scrapes a dynamic web page using Selenium and BeautifulSoup.
     
     Args:
         url: The URL to scrape
+        timeout: Max seconds for page load (defaults to 30; callers pass the
+            remaining request deadline)
+        driver: A browser already taken from browser_pool (returned to the
+            pool afterwards); by default one is acquired here
         
     Returns:
         A dictionary with extracted web page data
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from bs4 import BeautifulSoup
+
     logger.info(f"🔄 Börjar skrapa sidan: {url}")
     start_time = time.time()
-    driver = initialize_driver()
+    if driver is None:
+        driver = browser_pool.acquire()
+    healthy = True
 
     try:
         # --- STEG A: page_load ---
         with TimingContext("page_load"):
+            # Poolade webbläsare återanvänds, så timeouten sätts om vid varje skrapning
+            page_load_timeout = min(timeout, 30) if timeout is not None else 30
+            driver.set_page_load_timeout(max(page_load_timeout, 1))
             driver.get(url)
-            WebDriverWait(driver, 10).until(
+            WebDriverWait(driver, max(min(10, page_load_timeout), 1)).until(
                 EC.presence_of_element_located((By.TAG_NAME, "body"))
             )
             page_content = driver.page_source
@@ -79,8 +203,10 @@ def scrape_dynamic_page(url: str) -> Dict[str, Any]:
             # Buttons
             buttons = [btn.get_text(strip=True) for btn in soup.find_all('button') if btn.get_text(strip=True)]
             
-            # Images
-            images = [img.get('src', '') for img in soup.find_all('img') if img.get('src')]
+            # Images (alt="" är giltigt för dekorativa bilder; bara saknat attribut räknas)
+            image_tags = [img for img in soup.find_all('img') if img.get('src')]
+            images = [img.get('src', '') for img in image_tags]
+            images_without_alt = sum(1 for img in image_tags if img.get('alt') is None)
             
             # Get prices (common patterns)
             prices = []
@@ -131,9 +257,10 @@ def scrape_dynamic_page(url: str) -> Dict[str, Any]:
                     font_names = [f.strip().strip("'").strip('"') for f in font.split(',')]
                     design_summary["fonts"].extend(font_names)
             
-            # Remove duplicates and limit
-            design_summary["colors"] = list(set(design_summary["colors"]))[:10]
-            design_summary["fonts"] = list(set(design_summary["fonts"]))[:10]
+            # Remove duplicates and limit (dokumentordning: set() har olika ordning
+            # per process, vilket ändrar prompter och fingeravtryck efter omstart)
+            design_summary["colors"] = list(dict.fromkeys(design_summary["colors"]))[:10]
+            design_summary["fonts"] = list(dict.fromkeys(design_summary["fonts"]))[:10]
 
         elapsed = time.time() - start_time
         logger.info(f"✅ Skrapning slutförd på {elapsed:.2f} sekunder")
@@ -145,16 +272,18 @@ def scrape_dynamic_page(url: str) -> Dict[str, Any]:
             "navigation": navigation,
             "buttons": buttons,
             "images": images,
+            "images_without_alt": images_without_alt,
             "prices": prices,
             "security_elements": security_elements,
             "design_summary": design_summary
         }
 
     except Exception as e:
+        healthy = False
         elapsed = time.time() - start_time
         logger.error(f"❌ Fel vid skrapning efter {elapsed:.2f} sekunder: {e!r}")
         raise HTTPException(status_code=500, detail=f"Selenium/BeautifulSoup-fel: {e}")
 
     finally:
-        logger.info("Stänger driver")
-        driver.quit()
+        logger.info("Lämnar tillbaka driver till poolen")
+        browser_pool.release(driver, healthy)
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func, select, update
+
+from database import WebhookEvent, _dialect_insert, async_session_maker
+from utils.auth0_management import Auth0ManagementClient, ManagementAPIError, auth0_management
+from utils.logging_utils import logger
+from utils.quota_store import quota_store
+
+
+class WebhookOutboxWorker:
+    """
+    Bakgrundsworker som applicerar planuppdateringar från webhook-outboxen.
+
+    Webhooken sparar bara eventet och svarar direkt; workern plockar
+    förfallna rader, uppdaterar Auth0 och kvotlagringen och försöker igen
+    med exponentiell backoff (med jitter) vid tillfälliga fel.
+    """
+
+    def __init__(self, client: Auth0ManagementClient, poll_interval: float = 5.0,
+                 batch_size: int = 20, max_attempts: int = 8, base_backoff: float = 2.0,
+                 max_backoff: float = 600.0, lease_seconds: float = 60.0):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._applied = 0
+        self._retried = 0
+        self._failed = 0
+
+    async def enqueue(self, session, event_id: str, event_type: str,
+                      user_id: str, plan: str) -> bool:
+        """
+        Sparar eventet i outboxen. Returnerar False om samma event-id redan
+        finns (Stripe levererar om events vid timeout eller fel).
+        """
+        connection = await session.connection()
+        result = await session.execute(
+            _dialect_insert(connection)(WebhookEvent)
+            .values(event_id=event_id, event_type=event_type, user_id=user_id, plan=plan,
+                    status="pending", attempts=0, next_attempt_at=datetime.utcnow(),
+                    created_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["event_id"])
+        )
+        await session.commit()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return result.rowcount == 1
+
+    def _backoff(self, attempts: int, retry_after: Optional[float]) -> float:
+        delay = min(self.base_backoff * (2 ** (attempts - 1)), self.max_backoff)
+        delay = random.uniform(delay / 2, delay)
+        return max(delay, retry_after or 0)
+
+    async def _claim(self, session, event: WebhookEvent) -> bool:
+        """Tar en rad genom att skjuta fram next_attempt_at; misslyckas om någon annan hann före."""
+        result = await session.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.event_id == event.event_id,
+                   WebhookEvent.status == "pending",
+                   WebhookEvent.next_attempt_at == event.next_attempt_at)
+            .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds),
+                    attempts=WebhookEvent.attempts + 1)
+        )
+        await session.commit()
+        return result.rowcount == 1
+
+    async def _apply(self, event_id: str, user_id: str, plan: str, attempts: int) -> None:
+        values: Dict[str, Any]
+        try:
+            await self.client.update_user_plan(user_id, plan)
+            await quota_store.set_plan(user_id, plan)
+        except ManagementAPIError as e:
+            if e.retryable and attempts < self.max_attempts:
+                delay = self._backoff(attempts, e.retry_after)
+                self._retried += 1
+                logger.warning(
+                    f"❌ Planuppdatering för {event_id} misslyckades (försök {attempts}), "
+                    f"nytt försök om {delay:.0f}s: {e}"
+                )
+                values = {"next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+                          "last_error": str(e)}
+            else:
+                self._failed += 1
+                logger.error(f"❌ Planuppdatering för {event_id} gav upp efter {attempts} försök: {e}")
+                values = {"status": "failed", "last_error": str(e),
+                          "processed_at": datetime.utcnow()}
+        else:
+            self._applied += 1
+            logger.info(f"✅ Plan {plan} satt för {user_id} (event {event_id})")
+            values = {"status": "done", "last_error": None, "processed_at": datetime.utcnow()}
+
+        async with async_session_maker() as session:
+            await session.execute(
+                update(WebhookEvent).where(WebhookEvent.event_id == event_id).values(**values)
+            )
+            await session.commit()
+
+    async def process_due(self) -> int:
+        """Bearbetar förfallna events; returnerar antalet som plockades."""
+        async with async_session_maker() as session:
+            due = (await session.scalars(
+                select(WebhookEvent)
+                .where(WebhookEvent.status == "pending",
+                       WebhookEvent.next_attempt_at <= datetime.utcnow())
+                .order_by(WebhookEvent.next_attempt_at)
+                .limit(self.batch_size)
+            )).all()
+            claimed = []
+            for event in due:
+                args = (event.event_id, event.user_id, event.plan, event.attempts + 1)
+                if await self._claim(session, event):
+                    claimed.append(args)
+
+        if claimed:
+            await asyncio.gather(*(self._apply(*args) for args in claimed))
+        return len(claimed)
+
+    async def _next_due_in(self) -> float:
+        async with async_session_maker() as session:
+            next_at = await session.scalar(
+                select(func.min(WebhookEvent.next_attempt_at)).where(WebhookEvent.status == "pending")
+            )
+        if next_at is None:
+            return self.poll_interval
+        return min(max((next_at - datetime.utcnow()).total_seconds(), 0.0), self.poll_interval)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                while await self.process_due() == self.batch_size:
+                    pass
+                delay = await self._next_due_in()
+            except Exception as e:
+                logger.error(f"❌ Webhook-outboxen kunde inte bearbetas: {e}", exc_info=True)
+                delay = self.poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        # Events som blev kvar vid förra avstängningen plockas upp direkt
+        self._wakeup.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.client.close()
+
+    async def snapshot(self) -> Dict[str, Any]:
+        async with async_session_maker() as session:
+            rows = (await session.execute(
+                select(WebhookEvent.status, func.count()).group_by(WebhookEvent.status)
+            )).all()
+        return {
+            "outbox": {status: count for status, count in rows},
+            "applied": self._applied,
+            "retried": self._retried,
+            "failed": self._failed,
+            "management_api": self.client.snapshot(),
+        }
+
+
+webhook_worker = WebhookOutboxWorker(
+    auth0_management,
+    poll_interval=float(os.getenv("WEBHOOK_POLL_INTERVAL_S", "5")),
+    max_attempts=int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8")),
+    base_backoff=float(os.getenv("WEBHOOK_BASE_BACKOFF_S", "2")),
+)